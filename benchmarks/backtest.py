@@ -0,0 +1,229 @@
+"""
+Rolling-origin backtest of the balance forecasting methods.
+
+    python -m benchmarks.backtest --users 8 --years 4
+    python -m benchmarks.backtest --source db              # stored users (SMARTSPEND_DB_DIR)
+    python -m benchmarks.backtest --methods naive trend sarimax --horizon 3
+
+Each user's monthly history is replayed with an expanding window: every
+month from --min-train onwards becomes a forecast origin, each method is
+fitted on the months before it and its next --horizon month-end balances
+are compared with what actually happened. (user, method) pairs are
+evaluated in a process pool. Reports error metrics, skill against the
+naive forecast, and fit latency per method, so the production default can
+be weighed on accuracy per millisecond.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+METHODS = ["naive", "trend", "sarimax", "sarimax_selected", "categories"]
+
+
+# Methods: monthly category flows up to the origin -> next balances
+def _balance(flows):
+    return flows.sum(axis=1).cumsum()
+
+
+def _naive(flows, steps: int, model: dict) -> np.ndarray:
+    return np.full(steps, _balance(flows).iloc[-1])
+
+
+def _trend(flows, steps: int, model: dict) -> np.ndarray:
+    # The Forecast page's fallback when SARIMAX cannot be fitted
+    balance = _balance(flows)
+    return balance.iloc[-1] + np.arange(1, steps + 1) * balance.diff().mean()
+
+
+def _sarimax(flows, steps: int, model: dict) -> np.ndarray:
+    from utils.forecasting import sarimax_forecast
+    mean, _ = sarimax_forecast(_balance(flows), steps=steps, **model)
+    return mean.to_numpy()
+
+
+def _categories(flows, steps: int, model: dict) -> np.ndarray:
+    from utils.forecasting import flow_forecasts
+    total = flow_forecasts(flows, steps, workers=1).sum(axis=1).to_numpy()
+    return _balance(flows).iloc[-1] + np.cumsum(total)
+
+
+_FORECASTERS = {
+    "naive": _naive,
+    "trend": _trend,
+    "sarimax": _sarimax,
+    "sarimax_selected": _sarimax,
+    "categories": _categories,
+}
+
+
+# Workers (run in child processes)
+def _evaluate(name: str, flows, method: str, horizon: int, min_train: int, budget: float) -> dict:
+    """
+    Absolute errors (origins x months ahead) and per-fit seconds of one
+    method on one user's history.
+    """
+    import warnings
+    warnings.simplefilter("ignore")
+    from utils.forecasting import select_order
+
+    balance = _balance(flows).to_numpy()
+    origins = range(min_train, len(flows) - horizon + 1)
+    result = {"series": name, "method": method, "errors": [], "fit_seconds": [],
+              "failed": 0, "selection_seconds": None, "model": None}
+
+    model = {}
+    if method == "sarimax_selected" and len(origins):
+        # Orders are chosen once, from the history before the first origin,
+        # and only refitted afterwards, as in production
+        started = time.perf_counter()
+        choice = select_order(_balance(flows.iloc[:min_train]), budget=budget, workers=1)
+        result["selection_seconds"] = time.perf_counter() - started
+        model = {"order": choice["order"], "seasonal_order": choice["seasonal_order"]}
+        result["model"] = [list(model["order"]), list(model["seasonal_order"])]
+
+    forecaster = _FORECASTERS[method]
+    for origin in origins:
+        started = time.perf_counter()
+        try:
+            forecast = forecaster(flows.iloc[:origin], horizon, model)
+        except Exception:
+            result["failed"] += 1
+            continue
+        result["fit_seconds"].append(time.perf_counter() - started)
+        result["errors"].append(np.abs(forecast - balance[origin:origin + horizon]).tolist())
+    return result
+
+
+# Data sources
+def _synthetic_flows(args) -> dict:
+    from benchmarks.synthetic import generate_transactions
+    from utils.data_processing import categorise_frame
+    from utils.forecasting import monthly_category_flows
+
+    flows = {}
+    for i in range(args.users):
+        df = generate_transactions(args.rows, years=args.years, seed=args.seed * 10_000 + i)
+        df["category"] = categorise_frame(df, use_model=False)
+        flows[f"synthetic{i + 1}"] = monthly_category_flows(df)
+    return flows
+
+
+def _stored_flows(args) -> dict:
+    from utils.database import list_user_ids, load_transactions
+    from utils.forecasting import monthly_category_flows
+
+    flows = {}
+    for user_id in list_user_ids():
+        df = load_transactions(user_id)
+        if not df.empty:
+            flows[f"user{user_id}"] = monthly_category_flows(df)
+    return flows
+
+
+def _summarise(results: list[dict], horizon: int) -> dict:
+    summary = {}
+    for method in sorted({r["method"] for r in results}):
+        rows = [r for r in results if r["method"] == method]
+        errors = np.array([e for r in rows for e in r["errors"]]).reshape(-1, horizon)
+        fits = np.array([s for r in rows for s in r["fit_seconds"]])
+        selections = [r["selection_seconds"] for r in rows if r["selection_seconds"] is not None]
+        summary[method] = {
+            "forecasts": len(errors),
+            "failed": sum(r["failed"] for r in rows),
+            "mae": round(float(errors.mean()), 2) if len(errors) else None,
+            "rmse": round(float(np.sqrt((errors ** 2).mean())), 2) if len(errors) else None,
+            "mae_by_month_ahead": [round(float(v), 2) for v in errors.mean(axis=0)]
+            if len(errors) else [],
+            "fit_ms_mean": round(float(fits.mean()) * 1000, 2) if len(fits) else None,
+            "fit_ms_p95": round(float(np.percentile(fits, 95)) * 1000, 2) if len(fits) else None,
+            "selection_seconds_mean": round(float(np.mean(selections)), 3) if selections else None,
+        }
+
+    naive = summary.get("naive", {}).get("mae")
+    for stats in summary.values():
+        # Share of the naive forecast's error removed (higher is better)
+        stats["skill"] = (
+            round(1 - stats["mae"] / naive, 4) if naive and stats["mae"] is not None else None
+        )
+    return summary
+
+
+def run(args) -> dict:
+    flows = _stored_flows(args) if args.source == "db" else _synthetic_flows(args)
+    flows = {k: v for k, v in flows.items() if len(v) >= args.min_train + args.horizon}
+    if not flows:
+        raise SystemExit(
+            f"No histories of at least {args.min_train + args.horizon} months to backtest."
+        )
+
+    results = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [
+            pool.submit(_evaluate, name, f, method, args.horizon, args.min_train, args.budget)
+            for name, f in flows.items()
+            for method in args.methods
+        ]
+        for fut in as_completed(futures):
+            results.append(fut.result())
+    elapsed = time.perf_counter() - started
+
+    return {
+        "config": vars(args),
+        "series": {name: len(f) for name, f in flows.items()},
+        "seconds": round(elapsed, 3),
+        "methods": _summarise(results, args.horizon),
+        "models": {
+            r["series"]: r["model"] for r in results if r["method"] == "sarimax_selected"
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SmartSpend forecast backtest")
+    parser.add_argument("--source", choices=["synthetic", "db"], default="synthetic",
+                        help="synthetic users, or every user in the configured database")
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=METHODS)
+    parser.add_argument("--users", type=int, default=8, help="synthetic users")
+    parser.add_argument("--rows", type=int, default=3000, help="transactions per synthetic user")
+    parser.add_argument("--years", type=float, default=4, help="history per synthetic user")
+    parser.add_argument("--horizon", type=int, default=6, help="months forecast from each origin")
+    parser.add_argument("--min-train", type=int, default=12,
+                        help="months of history before the first origin")
+    parser.add_argument("--budget", type=float, default=10,
+                        help="seconds for sarimax_selected's order search per user")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="process pool size (default: CPU count)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=None, help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    if args.source == "synthetic":
+        # Never touch the real database
+        os.environ["SMARTSPEND_DB_DIR"] = tempfile.mkdtemp(prefix="smartspend-backtest-")
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+    report = run(args)
+    print(f"{len(report['series'])} series, {report['seconds']:.1f}s")
+    print(f"{'method':<18}{'forecasts':>10}{'failed':>8}{'MAE':>14}{'RMSE':>14}"
+          f"{'skill':>10}{'fit ms':>10}")
+    for method, s in sorted(report["methods"].items(), key=lambda kv: kv[1]["mae"] or np.inf):
+        print(
+            f"{method:<18}{s['forecasts']:>10}{s['failed']:>8}{s['mae'] or np.nan:>14,.0f}"
+            f"{s['rmse'] or np.nan:>14,.0f}{s['skill'] or 0:>10.2f}"
+            f"{s['fit_ms_mean'] or np.nan:>10.1f}"
+        )
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Throughput and accuracy of the learned categoriser on synthetic data.
+
+    python -m benchmarks.categoriser --rows 200000
+
+Trains on keyword-categorised synthetic transactions (with varied card
+payment wording and references). It then reports
+the held-out accuracy, training time, and rows per second for the keyword
+rules and for batch model inference over the same descriptions.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Card-payment wording banks wrap around merchant names
+PREFIXES = ["", "CARD PAYMENT TO ", "POS ", "CONTACTLESS ", "DEBIT CARD "]
+
+
+def run(args) -> dict:
+    from benchmarks.synthetic import generate_transactions
+    from utils.data_processing import categorise_frame
+    from utils.categoriser import train_categoriser, predict_categories, load_model
+
+    df = generate_transactions(args.rows, merchants=args.merchants, seed=args.seed)
+    # Vary the wording and references so descriptions are not all identical
+    rng = np.random.default_rng(args.seed)
+    prefixes = np.asarray(PREFIXES, dtype=object)[rng.integers(0, len(PREFIXES), len(df))]
+    refs = rng.integers(0, 10 ** 6, len(df)).astype(str)
+    df["description"] = prefixes + df["description"] + " REF " + refs
+
+    started = time.perf_counter()
+    df["category"] = categorise_frame(df, use_model=False)
+    keyword_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    trained = train_categoriser(df, seed=args.seed)
+    train_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    load_model()
+    load_seconds = time.perf_counter() - started
+
+    expenses = df[df["amount"] < 0]
+    started = time.perf_counter()
+    predicted = predict_categories(expenses["description"])
+    predict_seconds = time.perf_counter() - started
+
+    labelled = expenses["category"] != "Other"
+    agreement = float((predicted[labelled] == expenses.loc[labelled, "category"]).mean())
+    other = expenses[~labelled]
+    recovered = float((predicted[~labelled] != "Other").mean()) if len(other) else None
+
+    return {
+        "config": vars(args),
+        "training": trained,
+        "train_seconds": round(train_seconds, 3),
+        "model_load_seconds": round(load_seconds, 4),
+        "keyword_rows_per_second": round(len(df) / keyword_seconds, 1),
+        "model_rows_per_second": round(len(expenses) / predict_seconds, 1),
+        "agreement_with_keywords": round(agreement, 4),
+        "other_rows": len(other),
+        "other_rows_categorised": None if recovered is None else round(recovered, 4),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SmartSpend categoriser benchmark")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--merchants", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=None, help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    # The model is saved under the database directory; keep it temporary
+    os.environ["SMARTSPEND_DB_DIR"] = tempfile.mkdtemp(prefix="smartspend-categoriser-")
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+    report = run(args)
+    print(json.dumps(report, indent=2, default=str))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+End-to-end pipeline benchmark on synthetic statements.
+
+    python -m benchmarks.run --sizes 1000 100000 1000000 --users 4
+    python -m benchmarks.run --sizes 1000 --compare benchmarks/results/<previous>.json
+
+Each stage is timed once without tracing and, unless --no-memory is given,
+run again under tracemalloc to record its peak Python-visible allocation.
+Results are written as JSON to benchmarks/results/.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# Flag stages that got more than 20% slower in --compare output
+REGRESSION_THRESHOLD = 0.2
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parents[1],
+            stderr=subprocess.DEVNULL,
+            text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def _measure(fn, memory: bool) -> tuple[object, dict]:
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+
+    stats = {"seconds": round(elapsed, 6)}
+
+    if memory:
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats["peak_mb"] = round(peak / 2**20, 3)
+
+    return result, stats
+
+
+def run_size(rows: int, args) -> dict:
+    from benchmarks.synthetic import generate_statements
+    from utils.database import normalise_bank_csv, write_transactions, load_transactions
+    from utils.data_processing import categorise_frame
+    from utils.insights import detect_anomalies
+    from utils.recurring import detect_recurring
+    from utils.forecasting import sarimax_forecast, monthly_balance_series
+
+    statements = generate_statements(
+        rows,
+        users=args.users,
+        merchants=args.merchants,
+        years=args.years,
+        seed=args.seed
+    )
+
+    totals: dict[str, dict] = {}
+
+    def record(stage: str, stats: dict):
+        agg = totals.setdefault(stage, {"seconds": 0.0})
+        agg["seconds"] += stats["seconds"]
+        if "peak_mb" in stats:
+            agg["peak_mb"] = max(agg.get("peak_mb", 0.0), stats["peak_mb"])
+
+    for user_id, raw in statements.items():
+        cleaned, stats = _measure(lambda: normalise_bank_csv(raw), args.memory)
+        record("normalise_bank_csv", stats)
+
+        categories, stats = _measure(lambda: categorise_frame(cleaned), args.memory)
+        record("categorise", stats)
+        cleaned["category"] = categories
+
+        _, stats = _measure(
+            lambda: write_transactions(cleaned, user_id, replace_existing=True),
+            args.memory
+        )
+        record("write_transactions", stats)
+
+        history, stats = _measure(lambda: load_transactions(user_id), args.memory)
+        record("load_transactions", stats)
+
+        _, stats = _measure(lambda: detect_anomalies(history), args.memory)
+        record("detect_anomalies", stats)
+
+        _, stats = _measure(lambda: detect_recurring(history), args.memory)
+        record("detect_recurring", stats)
+
+        monthly = monthly_balance_series(history)
+        try:
+            _, stats = _measure(lambda: sarimax_forecast(monthly, steps=6), args.memory)
+            record("sarimax_forecast", stats)
+        except ValueError:
+            pass
+
+    for stage in totals.values():
+        stage["seconds"] = round(stage["seconds"], 6)
+        stage["rows_per_second"] = round(rows / stage["seconds"], 1) if stage["seconds"] else None
+
+    return {"rows": rows, "users": args.users, "stages": totals}
+
+
+def compare(current: dict, previous_path: Path):
+    previous = json.loads(previous_path.read_text())
+    prev_by_rows = {r["rows"]: r for r in previous["results"]}
+
+    print(f"\nCompared with {previous_path.name} ({previous.get('commit')}):")
+    for res in current["results"]:
+        prev = prev_by_rows.get(res["rows"])
+        if not prev:
+            continue
+        for stage, stats in res["stages"].items():
+            old = prev["stages"].get(stage)
+            if not old or not old["seconds"]:
+                continue
+            ratio = stats["seconds"] / old["seconds"]
+            flag = "  <-- slower" if ratio > 1 + REGRESSION_THRESHOLD else ""
+            print(f"  {res['rows']:>9} rows  {stage:<20} x{ratio:5.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SmartSpend pipeline benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--merchants", type=int, default=200)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="skip the tracemalloc pass")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", type=Path, default=None,
+                        help="previous results file to compare against")
+    args = parser.parse_args(argv)
+
+    # Benchmarks never touch the real database
+    db_dir = tempfile.mkdtemp(prefix="smartspend-bench-")
+    os.environ["SMARTSPEND_DB_DIR"] = db_dir
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+    import pandas as pd
+    import numpy as np
+    import sklearn
+    import statsmodels
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "scikit-learn": sklearn.__version__,
+            "statsmodels": statsmodels.__version__,
+        },
+        "config": {
+            "users": args.users,
+            "merchants": args.merchants,
+            "years": args.years,
+            "seed": args.seed,
+            "memory": args.memory,
+        },
+        "results": [],
+    }
+
+    for rows in args.sizes:
+        print(f"Benchmarking {rows:,} rows across {args.users} users...")
+        res = run_size(rows, args)
+        report["results"].append(res)
+        for stage, stats in res["stages"].items():
+            mem = f"  peak {stats['peak_mb']:.1f} MB" if "peak_mb" in stats else ""
+            print(f"  {stage:<20} {stats['seconds']:9.3f}s{mem}")
+
+    out = args.output
+    if out is None:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        out = RESULTS_DIR / f"{stamp}-{report['commit'] or 'nogit'}.json"
+    out.write_text(json.dumps(report, indent=2))
+    print(f"\nResults written to {out}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Concurrent write stress test.
+
+    python -m benchmarks.stress_writes --writers 8 --uploads 20 --rows 2000 --readers 4
+    python -m benchmarks.stress_writes --no-queue      # each thread writes directly
+    python -m benchmarks.stress_writes --shards 8      # per-user shard files
+
+Writer threads each save a series of uploads (append mode) for their own
+user while reader threads keep loading transaction counts and histories,
+as concurrent Streamlit sessions do. Reports sustained write throughput,
+upload and read latency percentiles, failed writes, and the group-commit
+batching achieved by the writer queue.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+def _percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "max_ms": None}
+    s = sorted(samples)
+
+    def pct(p: float) -> float:
+        return round(s[min(int(p * len(s)), len(s) - 1)] * 1000, 2)
+
+    return {"p50_ms": pct(0.50), "p95_ms": pct(0.95), "max_ms": round(s[-1] * 1000, 2)}
+
+
+def run(args) -> dict:
+    from benchmarks.synthetic import generate_transactions
+    import utils.database as db
+    from utils.database import (
+        run_write,
+        write_transactions,
+        count_transactions,
+        load_transactions,
+        write_queue_stats,
+    )
+
+    db.WRITE_QUEUE = args.queue
+    db.SHARDS = args.shards
+
+    user_ids = []
+    for i in range(args.writers):
+        user_ids.append(run_write(lambda cur, i=i: cur.execute(
+            "INSERT INTO users (username, first_name, last_name, password_hash) VALUES (?,?,?,?)",
+            (f"stress{i}", "Stress", str(i), b"-")
+        ).lastrowid))
+
+    upload = generate_transactions(args.rows, seed=args.seed)
+    upload["category"] = "Other"
+
+    write_latency, read_latency, errors = [], [], []
+    lock = threading.Lock()
+    stop_reading = threading.Event()
+
+    def writer(user_id: int):
+        for _ in range(args.uploads):
+            started = time.perf_counter()
+            try:
+                write_transactions(upload, user_id, replace_existing=False)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                write_latency.append(time.perf_counter() - started)
+
+    def reader(n: int):
+        while not stop_reading.is_set():
+            user_id = user_ids[n % len(user_ids)]
+            started = time.perf_counter()
+            count_transactions(user_id)
+            load_transactions(user_id)
+            with lock:
+                read_latency.append(time.perf_counter() - started)
+            n += 1
+
+    readers = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    writers = [threading.Thread(target=writer, args=(uid,)) for uid in user_ids]
+
+    started = time.perf_counter()
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    elapsed = time.perf_counter() - started
+    stop_reading.set()
+    for t in readers:
+        t.join()
+
+    rows = len(write_latency) * args.rows
+    return {
+        "config": vars(args),
+        "seconds": round(elapsed, 3),
+        "uploads": len(write_latency),
+        "failed_uploads": len(errors),
+        "errors": sorted(set(errors))[:5],
+        "rows_written": rows,
+        "rows_per_second": round(rows / elapsed, 1) if elapsed else None,
+        "upload_latency": _percentiles(write_latency),
+        "reads": len(read_latency),
+        "read_latency": _percentiles(read_latency),
+        "write_queue": write_queue_stats() if args.queue else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SmartSpend concurrent write stress test")
+    parser.add_argument("--writers", type=int, default=8, help="concurrent uploading users")
+    parser.add_argument("--uploads", type=int, default=20, help="uploads per writer")
+    parser.add_argument("--rows", type=int, default=2000, help="rows per upload")
+    parser.add_argument("--readers", type=int, default=4, help="concurrent reading sessions")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="store each user's data in one of this many shard files")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-queue", dest="queue", action="store_false",
+                        help="write from each thread instead of the writer queue")
+    parser.add_argument("--output", type=Path, default=None, help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    # Never touch the real database
+    os.environ["SMARTSPEND_DB_DIR"] = tempfile.mkdtemp(prefix="smartspend-stress-")
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+    report = run(args)
+    mode = "writer queue" if args.queue else "direct writes"
+    if args.shards:
+        mode += f", {args.shards} shards"
+    print(
+        f"{mode}: {report['uploads']} uploads ({report['failed_uploads']} failed), "
+        f"{report['rows_written']:,} rows in {report['seconds']:.1f}s "
+        f"({report['rows_per_second']:,.0f} rows/s)"
+    )
+    print(f"  upload latency  {report['upload_latency']}")
+    print(f"  read latency    {report['read_latency']}  ({report['reads']} reads)")
+    if report["write_queue"]:
+        print(f"  group commits   {report['write_queue']}")
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, default=str))
+    return 1 if report["failed_uploads"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Deterministic synthetic bank statements for benchmarking.
+
+Statements are generated in the raw layouts that normalise_bank_csv has to
+handle, so the whole upload pipeline can be exercised at any size.
+"""
+import numpy as np
+import pandas as pd
+
+from utils.data_processing import CATEGORY_KEYWORDS
+
+LAYOUTS = ("natwest", "standard", "debit_credit")
+
+TX_TYPES = ["POS", "DD", "SO", "ATM", "BAC", "TFR"]
+
+# Fixed monthly direct debits: (description, amount, day of month)
+BILLS = [
+    ("LANDLORD PROPERTIES RENT", 950.00, 1),
+    ("PUREGYM MEMBERSHIP", 24.99, 5),
+    ("VODAFONE MOBILE BILL", 18.00, 12),
+    ("COUNCIL TAX DD", 142.00, 15),
+]
+
+
+def _merchant_pool(rng: np.random.Generator, merchants: int) -> tuple[list[str], np.ndarray]:
+    """
+    Merchant names (a mix of known keywords and unknown traders) and the
+    typical spend for each one.
+    """
+    known = [
+        kw.upper()
+        for cat, kws in CATEGORY_KEYWORDS.items()
+        if cat != "Income"
+        for kw in kws
+    ]
+    towns = ["LONDON", "LEEDS", "MANCHESTER", "BRISTOL", "GLASGOW", "CARDIFF"]
+
+    names = []
+    for i in range(merchants):
+        if i < len(known) and rng.random() < 0.7:
+            base = known[i]
+        else:
+            base = f"TRADER {i:05d} LTD"
+        names.append(f"{base} {rng.integers(1000, 9999)} {towns[i % len(towns)]}")
+
+    typical = rng.lognormal(mean=2.5, sigma=0.9, size=merchants)
+    return names, typical
+
+
+def generate_transactions(
+    rows: int,
+    merchants: int = 200,
+    start: str = "2020-01-01",
+    years: float = 3,
+    seed: int = 0
+) -> pd.DataFrame:
+    """
+    Clean (date, description, amount) rows, sorted by date, with a monthly
+    salary, monthly BILLS and Zipf-distributed merchant popularity.
+    """
+    rng = np.random.default_rng(seed)
+    names, typical = _merchant_pool(rng, merchants)
+
+    start_ts = pd.Timestamp(start)
+    span_days = max(int(years * 365), 1)
+
+    # Salary on the 28th of every month in range
+    paydays = pd.date_range(start_ts, periods=max(int(years * 12), 1), freq="MS") + pd.Timedelta(days=27)
+    paydays = paydays[: max(rows // 20, 1)]
+    n_salary = min(len(paydays), rows)
+
+    bill_dates, bill_desc, bill_amounts = [], [], []
+    for desc, amount, day in BILLS:
+        due = paydays - pd.Timedelta(days=27 - (day - 1))
+        bill_dates.append(due.values)
+        bill_desc += [desc] * len(due)
+        bill_amounts.append(np.full(len(due), -amount))
+    n_bills = min(len(bill_desc), max(rows - n_salary, 0))
+    bill_dates = np.concatenate(bill_dates)[:n_bills]
+    bill_desc = bill_desc[:n_bills]
+    bill_amounts = np.concatenate(bill_amounts)[:n_bills]
+
+    n_spend = rows - n_salary - n_bills
+
+    weights = 1.0 / np.arange(1, merchants + 1)
+    weights /= weights.sum()
+    merchant_idx = rng.choice(merchants, size=n_spend, p=weights)
+
+    spend_dates = start_ts + pd.to_timedelta(rng.integers(0, span_days, size=n_spend), unit="D")
+    spend_amounts = -np.round(typical[merchant_idx] * rng.lognormal(0, 0.35, size=n_spend), 2)
+    spend_desc = np.asarray(names, dtype=object)[merchant_idx]
+
+    salary = float(np.round(typical.sum() / merchants * rows / max(len(paydays), 1) * 1.1, 2))
+
+    df = pd.DataFrame({
+        "date": np.concatenate([spend_dates.values, paydays[:n_salary].values, bill_dates]),
+        "description": np.concatenate(
+            [spend_desc, ["EMPLOYER LTD SALARY"] * n_salary, np.asarray(bill_desc, dtype=object)]
+        ),
+        "amount": np.concatenate([spend_amounts, np.full(n_salary, salary), bill_amounts]),
+    })
+    df["date"] = pd.to_datetime(df["date"])
+    return df.sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def to_layout(df: pd.DataFrame, layout: str = "natwest", seed: int = 0) -> pd.DataFrame:
+    """
+    Renders clean rows in one of the raw bank export layouts.
+    """
+    if layout == "natwest":
+        rng = np.random.default_rng(seed)
+        return pd.DataFrame({
+            "Date": df["date"].dt.strftime("%d-%b-%y"),
+            "Type": rng.choice(TX_TYPES, size=len(df)),
+            "Description": df["description"],
+            "Value": df["amount"],
+            "Balance": df["amount"].cumsum().round(2),
+        })
+
+    if layout == "standard":
+        return pd.DataFrame({
+            "date": df["date"].dt.strftime("%Y-%m-%d"),
+            "description": df["description"],
+            "amount": df["amount"],
+        })
+
+    if layout == "debit_credit":
+        return pd.DataFrame({
+            "Transaction Date": df["date"].dt.strftime("%d/%m/%Y"),
+            "Details": df["description"],
+            "Money Out": (-df["amount"]).where(df["amount"] < 0),
+            "Money In": df["amount"].where(df["amount"] > 0),
+        })
+
+    raise ValueError(f"Unknown layout: {layout}. Expected one of {LAYOUTS}")
+
+
+def generate_statements(
+    rows: int,
+    users: int = 1,
+    merchants: int = 200,
+    start: str = "2020-01-01",
+    years: float = 3,
+    layouts: tuple[str, ...] = LAYOUTS,
+    seed: int = 0
+) -> dict[int, pd.DataFrame]:
+    """
+    One raw statement per user (user ids 1..users), rows split evenly.
+    Layouts are assigned round-robin so every format is exercised.
+    """
+    statements = {}
+    per_user = max(rows // users, 1)
+    for i in range(users):
+        user_seed = seed * 10_000 + i
+        clean = generate_transactions(per_user, merchants, start, years, user_seed)
+        statements[i + 1] = to_layout(clean, layouts[i % len(layouts)], user_seed)
+    return statements
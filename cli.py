@@ -0,0 +1,475 @@
+"""
+Headless batch processing for SmartSpend.
+
+    python cli.py --workers 8 ingest statements/
+    python cli.py detect --users alice bob
+    python cli.py forecast --steps 6
+    python cli.py all statements/ --replace
+    python cli.py migrate-shards 16
+    python cli.py train-categoriser
+    python cli.py reparse-receipts --chunk 200
+    python cli.py compact --months 24
+
+`ingest` expects one sub-directory per username, each holding that user's
+CSV statements:
+
+    statements/
+        alice/2023.csv
+        alice/2024.csv
+        bob/export.csv
+
+Files are parsed, normalised and categorised in a process pool; the
+database writes happen in this process, one file at a time, because
+SQLite allows a single writer.
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from utils.database import (
+    normalise_bank_csv,
+    write_transactions,
+    load_transactions,
+    get_user_id,
+    list_user_ids,
+    migrate_to_shards,
+    receipts_to_parse,
+    replace_receipt_items,
+    archive_transactions,
+    database_files,
+    compact_database,
+    ARCHIVE_AFTER_MONTHS,
+)
+from utils.data_processing import categorise_frame
+from utils.categoriser import train_categoriser
+from utils.insights import score_anomalies
+from utils.recurring import recurring_series, split_recurring
+from utils.forecasting import sarimax_forecast, monthly_balance_series, forecast_orders
+from utils.ocr_utils import ocr_image, parse_receipt, PARSER_VERSION
+from utils.receipt_store import has_image, open_image
+
+
+# Workers (run in child processes)
+def _prepare_file(path: str) -> tuple[pd.DataFrame, float]:
+    started = time.perf_counter()
+    raw = pd.read_csv(path)
+    cleaned = normalise_bank_csv(raw)
+    cleaned["category"] = categorise_frame(cleaned)
+    return cleaned, time.perf_counter() - started
+
+
+def _detect_user(user_id: int, refit: bool) -> dict:
+    df = load_transactions(user_id)
+    flagged = score_anomalies(user_id, df, refit=refit)
+    n = int(flagged["is_anomaly"].sum())
+    recurring = recurring_series(user_id, df)
+    return {
+        "user_id": user_id,
+        "rows": len(df),
+        "anomalies": n,
+        "recurring": int(recurring["active"].sum()),
+    }
+
+
+def _forecast_user(user_id: int, steps: int, reselect: bool) -> dict:
+    df = load_transactions(user_id)
+    if df.empty:
+        raise ValueError("no transactions")
+    monthly = monthly_balance_series(df)
+    # Fitted without recurring payments, which are added back when due (as
+    # on the Forecast page)
+    base, scheduled = split_recurring(df, recurring_series(user_id, df), monthly, steps)
+    # Users are already spread over the process pool, so candidates are
+    # evaluated inline rather than in a nested pool
+    model = forecast_orders(user_id, base, reselect=reselect, workers=1)
+    mean, _ = sarimax_forecast(
+        base, steps=steps, order=model["order"], seasonal_order=model["seasonal_order"]
+    )
+    mean = mean + scheduled.to_numpy()
+    return {
+        "user_id": user_id,
+        "rows": len(df),
+        "order": [list(model["order"]), list(model["seasonal_order"])],
+        "backtest_mae": model.get("backtest_mae"),
+        "forecast": {str(k.date()): round(float(v), 2) for k, v in mean.items()},
+    }
+
+
+# Commands
+def _reparse_receipt(ocr_text: str | None, image_sha256: str | None, rerun_ocr: bool) -> dict:
+    """
+    Items parsed from the receipt's image when it is stored (and
+    rerun_ocr), otherwise from its stored OCR text.
+    """
+    text, ocr_failed = None, False
+    if rerun_ocr and isinstance(image_sha256, str) and has_image(image_sha256):
+        try:
+            with open_image(image_sha256) as img:
+                text = ocr_image(img)
+        except Exception:
+            # e.g. Tesseract not installed here; the stored text still parses
+            ocr_failed = True
+    items = parse_receipt(text if text is not None else (ocr_text or ""))["items"]
+    return {"ocr_text": text, "items": items, "ocr_failed": ocr_failed}
+
+
+def _resolve_users(usernames: list[str] | None) -> dict[int, str]:
+    if not usernames:
+        return {uid: str(uid) for uid in list_user_ids()}
+    resolved = {}
+    for name in usernames:
+        uid = get_user_id(name)
+        if uid is None:
+            print(f"  ! unknown user: {name}", file=sys.stderr)
+            continue
+        resolved[uid] = name
+    return resolved
+
+
+def cmd_ingest(args) -> dict:
+    root = Path(args.directory)
+    jobs = []
+    for user_dir in sorted(p for p in root.iterdir() if p.is_dir()):
+        for csv_path in sorted(user_dir.glob(args.pattern)):
+            jobs.append((user_dir.name, csv_path))
+
+    user_ids = {name: get_user_id(name) for name in {u for u, _ in jobs}}
+    cleared = set()
+    files = []
+    total_rows = 0
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {}
+        for username, path in jobs:
+            if user_ids[username] is None:
+                files.append({"file": str(path), "user": username, "ok": False,
+                              "error": "unknown user"})
+                continue
+            futures[pool.submit(_prepare_file, str(path))] = (username, path)
+
+        for fut in as_completed(futures):
+            username, path = futures[fut]
+            user_id = user_ids[username]
+            try:
+                cleaned, prep_seconds = fut.result()
+                write_started = time.perf_counter()
+                # --replace clears a user's history once, before their first file
+                replace = args.replace and user_id not in cleared
+                write_transactions(cleaned, user_id, replace_existing=replace)
+                cleared.add(user_id)
+            except Exception as e:
+                files.append({"file": str(path), "user": username, "ok": False, "error": str(e)})
+                print(f"  ✗ {path}: {e}", file=sys.stderr)
+                continue
+
+            elapsed = prep_seconds + time.perf_counter() - write_started
+            total_rows += len(cleaned)
+            files.append({
+                "file": str(path),
+                "user": username,
+                "ok": True,
+                "rows": len(cleaned),
+                "seconds": round(elapsed, 3),
+                "rows_per_second": round(len(cleaned) / elapsed, 1) if elapsed else None,
+            })
+            print(f"  ✓ {path}: {len(cleaned):,} rows")
+
+    elapsed = time.perf_counter() - started
+    failed = sum(1 for f in files if not f["ok"])
+    print(
+        f"Ingested {total_rows:,} rows from {len(files) - failed}/{len(files)} files "
+        f"in {elapsed:.1f}s ({total_rows / elapsed if elapsed else 0:,.0f} rows/s), "
+        f"{failed} failed"
+    )
+    return {
+        "command": "ingest",
+        "rows": total_rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(total_rows / elapsed, 1) if elapsed else None,
+        "failed": failed,
+        "files": files,
+    }
+
+
+def _run_per_user(name: str, fn, users: dict[int, str], workers: int, *extra) -> dict:
+    results = []
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fn, uid, *extra): uid for uid in users}
+        for fut in as_completed(futures):
+            uid = futures[fut]
+            try:
+                res = fut.result()
+                res["ok"] = True
+                print(f"  ✓ {users[uid]}: {res['rows']:,} rows")
+            except Exception as e:
+                res = {"user_id": uid, "ok": False, "error": str(e)}
+                print(f"  ✗ {users[uid]}: {e}", file=sys.stderr)
+            res["user"] = users[uid]
+            results.append(res)
+
+    elapsed = time.perf_counter() - started
+    rows = sum(r.get("rows", 0) for r in results)
+    failed = sum(1 for r in results if not r["ok"])
+    print(f"{name}: {len(results)} users, {rows:,} rows in {elapsed:.1f}s, {failed} failed")
+    return {
+        "command": name,
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed, 1) if elapsed else None,
+        "failed": failed,
+        "users": results,
+    }
+
+
+def cmd_detect(args) -> dict:
+    return _run_per_user(
+        "detect", _detect_user, _resolve_users(args.users), args.workers, args.refit
+    )
+
+
+def cmd_forecast(args) -> dict:
+    return _run_per_user(
+        "forecast", _forecast_user, _resolve_users(args.users), args.workers,
+        args.steps, args.reselect
+    )
+
+
+def cmd_all(args) -> list[dict]:
+    reports = [cmd_ingest(args)]
+    args.refit = False
+    args.reselect = False
+    args.users = sorted({f["user"] for f in reports[0]["files"] if f["ok"]})
+    if args.users:
+        reports.append(cmd_detect(args))
+        reports.append(cmd_forecast(args))
+    return reports
+
+
+def cmd_migrate_shards(args) -> dict:
+    started = time.perf_counter()
+    result = migrate_to_shards(args.shards, drop_source=args.drop_source)
+    elapsed = time.perf_counter() - started
+    print(
+        f"Copied {result['users']} users into {len(result['files'])} shard files "
+        f"in {elapsed:.1f}s: "
+        + ", ".join(f"{n:,} {table}" for table, n in result["rows"].items())
+    )
+    if result["orphaned"]:
+        print(
+            "Left in the source database, owned by no user: "
+            + ", ".join(f"{n:,} {table}" for table, n in result["orphaned"].items()),
+            file=sys.stderr
+        )
+    print(f"Start the app with SMARTSPEND_SHARDS={args.shards} to use them.")
+    return {"command": "migrate-shards", "seconds": round(elapsed, 3), "failed": 0, **result}
+
+
+def cmd_train_categoriser(args) -> dict:
+    users = _resolve_users(args.users)
+    started = time.perf_counter()
+    frames = [load_transactions(uid) for uid in users]
+    if not frames:
+        print("  ✗ no users to train on", file=sys.stderr)
+        return {"command": "train-categoriser", "rows": 0, "failed": 1, "error": "no users"}
+    history = pd.concat(frames, ignore_index=True)
+    try:
+        result = train_categoriser(history)
+    except ValueError as e:
+        print(f"  ✗ {e}", file=sys.stderr)
+        return {"command": "train-categoriser", "rows": len(history), "failed": 1, "error": str(e)}
+    elapsed = time.perf_counter() - started
+    accuracy = result["holdout_accuracy"]
+    print(
+        f"Trained on {result['n_rows']:,} distinct descriptions from {len(users)} users "
+        f"in {elapsed:.1f}s; held-out accuracy "
+        + ("n/a" if accuracy is None else f"{accuracy:.1%}")
+    )
+    return {
+        "command": "train-categoriser",
+        "rows": len(history),
+        "seconds": round(elapsed, 3),
+        "failed": 0,
+        **result,
+    }
+
+
+def cmd_reparse_receipts(args) -> dict:
+    users = _resolve_users(args.users)
+    totals = {"receipts": 0, "items_before": 0, "items_after": 0,
+              "ocr_rerun": 0, "ocr_failed": 0, "failed": 0}
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+
+        def submit(user_id: int, after_id: int):
+            chunk = receipts_to_parse(user_id, PARSER_VERSION, after_id, args.chunk, args.force)
+            return [
+                (int(r.id), pool.submit(_reparse_receipt, r.ocr_text, r.image_sha256, args.ocr))
+                for r in chunk.itertuples(index=False)
+            ]
+
+        for user_id, name in users.items():
+            done = failed = 0
+            jobs = submit(user_id, 0)
+            while jobs:
+                # Queue the next chunk before writing this one, so the pool
+                # keeps parsing while results are saved
+                upcoming = submit(user_id, jobs[-1][0])
+                for receipt_id, fut in jobs:
+                    try:
+                        res = fut.result()
+                        # Each receipt is swapped and stamped atomically, so
+                        # an interrupted run resumes after the last one saved
+                        totals["items_before"] += replace_receipt_items(
+                            receipt_id, res["items"], PARSER_VERSION, res["ocr_text"], user_id
+                        )
+                    except Exception as e:
+                        failed += 1
+                        print(f"  ✗ {name} receipt {receipt_id}: {e}", file=sys.stderr)
+                        continue
+                    done += 1
+                    totals["items_after"] += len(res["items"])
+                    totals["ocr_rerun"] += res["ocr_text"] is not None
+                    totals["ocr_failed"] += res["ocr_failed"]
+                jobs = upcoming
+            totals["receipts"] += done
+            totals["failed"] += failed
+            if done or failed:
+                print(f"  ✓ {name}: {done:,} receipts re-parsed, {failed} failed")
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"reparse-receipts: {totals['receipts']:,} receipts in {elapsed:.1f}s "
+        f"({totals['receipts'] / elapsed if elapsed else 0:,.0f} receipts/s), "
+        f"{totals['ocr_rerun']:,} re-OCR'd, {totals['failed']} failed"
+    )
+    return {
+        "command": "reparse-receipts",
+        "parser_version": PARSER_VERSION,
+        "seconds": round(elapsed, 3),
+        "receipts_per_second": round(totals["receipts"] / elapsed, 1) if elapsed else None,
+        **totals,
+    }
+
+
+def cmd_compact(args) -> dict:
+    started = time.perf_counter()
+    archived = 0
+    if args.archive:
+        for user_id, name in _resolve_users(args.users).items():
+            moved = archive_transactions(user_id, args.months)
+            archived += moved
+            if moved:
+                print(f"  ✓ {name}: {moved:,} transactions archived")
+
+    files = [compact_database(path, vacuum=args.vacuum) for path in database_files()]
+    before = sum(f["bytes_before"] for f in files)
+    after = sum(f["bytes_after"] for f in files)
+    compressed = sum(f["receipts_compressed"] for f in files)
+    elapsed = time.perf_counter() - started
+    print(
+        f"compact: {archived:,} transactions archived, {compressed:,} receipt texts compressed, "
+        f"{before / 2**20:,.1f} MB -> {after / 2**20:,.1f} MB in {elapsed:.1f}s"
+    )
+    return {
+        "command": "compact",
+        "seconds": round(elapsed, 3),
+        "transactions_archived": archived,
+        "receipts_compressed": compressed,
+        "bytes_before": before,
+        "bytes_after": after,
+        "failed": 0,
+        "files": files,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="SmartSpend batch processing")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="process pool size (default: CPU count)")
+    parser.add_argument("--report", type=Path, default=None,
+                        help="write a JSON report to this path")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_ingest_args(p):
+        p.add_argument("directory", help="directory with one sub-directory of CSVs per username")
+        p.add_argument("--pattern", default="*.csv")
+        p.add_argument("--replace", action="store_true",
+                       help="replace each user's stored history instead of appending")
+
+    p_ingest = sub.add_parser("ingest", help="normalise, categorise and store CSV statements")
+    add_ingest_args(p_ingest)
+    p_ingest.set_defaults(func=cmd_ingest)
+
+    p_detect = sub.add_parser("detect", help="score new transactions for anomalies and detect "
+                                   "recurring payments per user")
+    p_detect.add_argument("--users", nargs="*", help="usernames (default: all users)")
+    p_detect.add_argument("--refit", action="store_true",
+                          help="refit each user's model instead of scoring only new rows")
+    p_detect.set_defaults(func=cmd_detect)
+
+    p_forecast = sub.add_parser("forecast", help="run SARIMAX balance forecasts per user")
+    p_forecast.add_argument("--users", nargs="*", help="usernames (default: all users)")
+    p_forecast.add_argument("--steps", type=int, default=6)
+    p_forecast.add_argument("--reselect", action="store_true",
+                            help="choose each user's SARIMAX orders again")
+    p_forecast.set_defaults(func=cmd_forecast)
+
+    p_all = sub.add_parser("all", help="ingest, then detect and forecast for the ingested users")
+    add_ingest_args(p_all)
+    p_all.add_argument("--steps", type=int, default=6)
+    p_all.set_defaults(func=cmd_all)
+
+    p_shards = sub.add_parser("migrate-shards",
+                              help="split the main database into per-user shard files")
+    p_shards.add_argument("shards", type=int, help="number of shard files")
+    p_shards.add_argument("--drop-source", action="store_true",
+                          help="delete the copied rows from the main database afterwards")
+    p_shards.set_defaults(func=cmd_migrate_shards)
+
+    p_train = sub.add_parser("train-categoriser",
+                             help="train the fallback categoriser on stored transactions")
+    p_train.add_argument("--users", nargs="*", help="usernames (default: all users)")
+    p_train.set_defaults(func=cmd_train_categoriser)
+
+    p_reparse = sub.add_parser("reparse-receipts",
+                               help="re-parse stored receipts made by an older parser")
+    p_reparse.add_argument("--users", nargs="*", help="usernames (default: all users)")
+    p_reparse.add_argument("--chunk", type=int, default=200, help="receipts read per query")
+    p_reparse.add_argument("--force", action="store_true",
+                           help="re-parse every receipt, not only outdated ones")
+    p_reparse.add_argument("--no-ocr", dest="ocr", action="store_false",
+                           help="parse the stored OCR text even when the image is stored")
+    p_reparse.set_defaults(func=cmd_reparse_receipts)
+
+    p_compact = sub.add_parser("compact", help="archive old transactions, compress receipt text "
+                                    "and shrink the database files")
+    p_compact.add_argument("--users", nargs="*", help="usernames (default: all users)")
+    p_compact.add_argument("--months", type=int, default=ARCHIVE_AFTER_MONTHS,
+                           help="archive transactions from months older than this")
+    p_compact.add_argument("--no-archive", dest="archive", action="store_false",
+                           help="only compress and vacuum")
+    p_compact.add_argument("--no-vacuum", dest="vacuum", action="store_false",
+                           help="skip rebuilding the database files")
+    p_compact.set_defaults(func=cmd_compact)
+
+    args = parser.parse_args(argv)
+    report = args.func(args)
+
+    if args.report:
+        args.report.write_text(json.dumps(report, indent=2))
+
+    reports = report if isinstance(report, list) else [report]
+    return 1 if any(r["failed"] for r in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
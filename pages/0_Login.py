@@ -8,7 +8,7 @@ from utils.auth import (
     login_user,
     logout_user
 )
-from utils.database import load_transactions
+from utils.database import count_transactions
 
 st.set_page_config(
     page_title="SmartSpend | Login",
@@ -59,8 +59,7 @@ with tab_login:
             login_user(username, user_id, first_name, last_name)
             st.success(msg)
 
-            df = load_transactions(user_id)
-            if df.empty:
+            if count_transactions(user_id) == 0:
                 st.switch_page("pages/1_Upload_Transactions.py")
             else:
                 st.switch_page("pages/2_Dashboard.py")
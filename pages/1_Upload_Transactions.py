@@ -5,136 +5,166 @@ import pandas as pd
 from utils.style import apply_global_style
 apply_global_style()
 
-# Auth
-from utils.auth import require_login, logout_user
-require_login()
-
-with st.sidebar:
-    st.markdown(f"👤 **{st.session_state.first_name} {st.session_state.last_name}**")
-    if st.button("🚪 Log out"):
-        logout_user()
-        st.switch_page("pages/0_Login.py")
-
-st.set_page_config(
-    page_title="Upload Transactions",
-    page_icon="📤",
-    layout="wide"
-)
-
-# Data
-from utils.database import (
-    write_transactions,
-    load_transactions,
-    normalise_bank_csv
-)
-from utils.data_processing import categorise
-
-# Header
-st.markdown(
-    """
-    <h1 style="margin-bottom: 0.25rem;">📤 Upload and Analyse Transactions</h1>
-    <p style="color: #6b7280; margin-bottom: 1.5rem;">
-        Upload a bank statement CSV. The system automatically detects and standardises
-        different formats.
-    </p>
-    """,
-    unsafe_allow_html=True
-)
-
-left, right = st.columns([2.2, 1])
-
-# Upload section
-with left:
-    st.markdown('<div class="card">', unsafe_allow_html=True)
-    st.subheader("Upload CSV File")
-
-    uploaded = st.file_uploader(
-        "Select a CSV file",
-        type=["csv"],
-        label_visibility="collapsed"
-    )
-    
-    st.caption(
-    "Tip: Most UK banks (e.g. Monzo, Santander, Lloyds) allow you to export "
-    "transaction history as a CSV file directly from their mobile or web apps."
+from utils.timing import start_rerun, span
+from utils.sidebar import timing_panel
+from utils.profiling import profile_page
+start_rerun()
+with profile_page("Upload Transactions"):
+    # Auth
+    from utils.auth import require_login, logout_user
+    require_login()
+
+    with st.sidebar:
+        st.markdown(f"👤 **{st.session_state.first_name} {st.session_state.last_name}**")
+        if st.button("🚪 Log out"):
+            logout_user()
+            st.switch_page("pages/0_Login.py")
+
+    st.set_page_config(
+        page_title="Upload Transactions",
+        page_icon="📤",
+        layout="wide"
     )
 
-    st.markdown('</div>', unsafe_allow_html=True)
+    # Data
+    from utils.database import (
+        write_transactions,
+        count_transactions,
+        search_transactions,
+        normalise_bank_csv
+    )
+    from utils.data_processing import categorise_frame
+    from utils.snapshots import export_transactions, load_snapshot
+    from utils.insights import score_anomalies
 
-# Info
-with right:
-    st.markdown('<div class="card">', unsafe_allow_html=True)
-    st.subheader("Supported Formats")
+    # Header
     st.markdown(
         """
-        This page supports:
-        - Standard CSVs (`date, description, amount`)
-        - Bank statements with **Debit / Credit**
-        - Statements with different column names
-        """
-    )
-    st.markdown(
-        "<small><b>Note:</b> Expenses are stored as negative values.</small>",
+        <h1 style="margin-bottom: 0.25rem;">📤 Upload and Analyse Transactions</h1>
+        <p style="color: #6b7280; margin-bottom: 1.5rem;">
+            Upload a bank statement CSV. The system automatically detects and standardises
+            different formats.
+        </p>
+        """,
         unsafe_allow_html=True
     )
-    st.markdown('</div>', unsafe_allow_html=True)
 
-# Process uploaded file
-if uploaded is not None:
-    try:
-        raw = pd.read_csv(uploaded)
+    left, right = st.columns([2.2, 1])
 
+    # Upload section
+    with left:
         st.markdown('<div class="card">', unsafe_allow_html=True)
-        st.subheader("Raw CSV Preview")
-        st.caption("Showing first 10 transactions from uploaded file")
-        st.dataframe(raw.head(10), use_container_width=True)
-        st.markdown('</div>', unsafe_allow_html=True)
+        st.subheader("Upload CSV File")
 
-        # Normalise bank CSV
-        cleaned = normalise_bank_csv(raw)
+        uploaded = st.file_uploader(
+            "Select a CSV file",
+            type=["csv"],
+            label_visibility="collapsed"
+        )
 
-        # Categorise transactions
-        cleaned["category"] = cleaned.apply(
-            lambda r: categorise(str(r["description"]), float(r["amount"])),
-            axis=1
+        st.caption(
+        "Tip: Most UK banks (e.g. Monzo, Santander, Lloyds) allow you to export "
+        "transaction history as a CSV file directly from their mobile or web apps."
         )
 
-        # Add month (required by dashboard & forecasting)
-        cleaned["month"] = cleaned["date"].dt.to_period("M").astype(str)
+        st.markdown('</div>', unsafe_allow_html=True)
 
+    # Info
+    with right:
         st.markdown('<div class="card">', unsafe_allow_html=True)
-        st.subheader("Standardised & Categorised Transactions")
-        st.caption("Unified format with categories applied")
-        st.dataframe(cleaned.head(15), use_container_width=True)
-
-        if st.button("💾 Save and Analyse", type="primary"):
-            write_transactions(
-                cleaned,
-                st.session_state.user_id,
-                replace_existing=True
+        st.subheader("Supported Formats")
+        st.markdown(
+            """
+            This page supports:
+            - Standard CSVs (`date, description, amount`)
+            - Bank statements with **Debit / Credit**
+            - Statements with different column names
+            """
+        )
+        st.markdown(
+            "<small><b>Note:</b> Expenses are stored as negative values.</small>",
+            unsafe_allow_html=True
+        )
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # Process uploaded file
+    if uploaded is not None:
+        try:
+            raw = pd.read_csv(uploaded)
+
+            st.markdown('<div class="card">', unsafe_allow_html=True)
+            st.subheader("Raw CSV Preview")
+            st.caption("Showing first 10 transactions from uploaded file")
+            st.dataframe(raw.head(10), use_container_width=True)
+            st.markdown('</div>', unsafe_allow_html=True)
+
+            # Normalise bank CSV
+            cleaned = normalise_bank_csv(raw)
+
+            # Categorise transactions
+            with span("upload.categorise"):
+                cleaned["category"] = categorise_frame(cleaned)
+
+            # Add month (required by dashboard & forecasting)
+            cleaned["month"] = cleaned["date"].dt.to_period("M").astype(str)
+
+            st.markdown('<div class="card">', unsafe_allow_html=True)
+            st.subheader("Standardised & Categorised Transactions")
+            st.caption("Unified format with categories applied")
+            st.dataframe(cleaned.head(15), use_container_width=True)
+
+            if st.button("💾 Save and Analyse", type="primary"):
+                write_transactions(
+                    cleaned,
+                    st.session_state.user_id,
+                    replace_existing=True
+                    )
+                # Score the new rows now so the Dashboard reads stored flags
+                score_anomalies(
+                    st.session_state.user_id,
+                    load_snapshot(st.session_state.user_id)
+                )
+                st.success(
+                    "Transactions saved successfully. You can now explore the Dashboard, Forecast, and Advisor."
                 )
-            st.success(
-                "Transactions saved successfully. You can now explore the Dashboard, Forecast, and Advisor."
-            )
 
-        st.markdown('</div>', unsafe_allow_html=True)
+            st.markdown('</div>', unsafe_allow_html=True)
 
-    except Exception as e:
-        st.error(f"Upload failed: {e}")
+        except Exception as e:
+            st.error(f"Upload failed: {e}")
 
-# Stored transactions
-st.markdown('<div class="card">', unsafe_allow_html=True)
-st.subheader("Current Stored Transactions")
+    # Stored transactions
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("Current Stored Transactions")
 
-df = load_transactions(st.session_state.user_id)
+    total = count_transactions(st.session_state.user_id)
 
-if df.empty:
-    st.warning("No transactions stored yet.")
-else:
-    st.dataframe(
-        df.sort_values("date", ascending=False),
-        use_container_width=True
-    )
+    if total == 0:
+        st.warning("No transactions stored yet.")
+    else:
+        query = st.text_input(
+            "Search stored transactions",
+            placeholder="Merchant or description",
+            key="history_search"
+        )
+        df = search_transactions(st.session_state.user_id, query, limit=200)
+        st.caption(f"Showing {len(df)} of {total} transactions (newest first)")
+        st.dataframe(df, use_container_width=True)
+
+        export_format = st.selectbox(
+            "Export full history",
+            ["CSV", "Parquet", "Arrow"],
+            key="export_format"
+        )
+        if st.button("Prepare export"):
+            fmt = export_format.lower()
+            st.download_button(
+                f"⬇️ Download {export_format}",
+                data=export_transactions(st.session_state.user_id, fmt),
+                file_name=f"smartspend_transactions.{fmt}",
+                mime="text/csv" if fmt == "csv" else "application/octet-stream"
+            )
 
-st.markdown('</div>', unsafe_allow_html=True)
+    st.markdown('</div>', unsafe_allow_html=True)
 
+timing_panel("Upload Transactions")
@@ -1,115 +1,261 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import numpy as np
 
 # Styling 
 from utils.style import apply_global_style
 apply_global_style()
 
-# Auth
-from utils.auth import require_login, logout_user
-require_login()
-with st.sidebar:
-    st.markdown(f"👤 **{st.session_state.first_name} {st.session_state.last_name}**")
-    if st.button("🚪 Log out"):
-        logout_user()
-        st.switch_page("pages/0_Login.py")
-
-
-# Data
-from utils.database import load_transactions
-from utils.forecasting import sarimax_forecast
-
-st.set_page_config(
-    page_title="Financial Forecast",
-    page_icon="📈",
-    layout="wide"
-)
-
-# Header
-st.markdown(
-    """
-    <h1 style="margin-bottom: 0.25rem;">📈 Financial Forecast</h1>
-    <p style="color: #6b7280; margin-bottom: 1.5rem;">
-        Predict future balances using time-series forecasting and scenario analysis.
-    </p>
-    """,
-    unsafe_allow_html=True
-)
-
-df = load_transactions(st.session_state.user_id)
-
-# Safety check
-if "category" not in df.columns:
-    df["category"] = "Other"
-
-if df.empty:
-    st.warning("No transaction data available. Upload transactions first.")
-    st.stop()
-
-# Prepare Monthly Balance
-df["date"] = pd.to_datetime(df["date"])
-monthly_balance = (
-    df.groupby(pd.Grouper(key="date", freq="M"))["amount"]
-    .sum()
-    .cumsum()
-)
-
-st.markdown('<div class="card">', unsafe_allow_html=True)
-st.subheader("SARIMAX Balance Forecast (Next 6 Months)")
-
-# SARIMAX Forecast with Fallback
-try:
-    mean_fc, ci = sarimax_forecast(monthly_balance, steps=6)
-
-    forecast_df = pd.DataFrame({
-        "Month": mean_fc.index.astype(str),
-        "Forecast Balance": mean_fc.values,
-        "Lower CI": ci.iloc[:, 0].values,
-        "Upper CI": ci.iloc[:, 1].values
+from utils.timing import start_rerun, span
+from utils.sidebar import timing_panel
+from utils.profiling import profile_page
+start_rerun()
+with profile_page("Forecast"):
+    # Auth
+    from utils.auth import require_login, logout_user
+    require_login()
+    with st.sidebar:
+        st.markdown(f"👤 **{st.session_state.first_name} {st.session_state.last_name}**")
+        if st.button("🚪 Log out"):
+            logout_user()
+            st.switch_page("pages/0_Login.py")
+
+
+    # Data
+    from utils.snapshots import load_snapshot
+    from utils.forecasting import (
+        sarimax_forecast,
+        monthly_balance_series,
+        cached_category_forecasts,
+        forecast_orders,
+        monthly_category_flows,
+        simulate_balance,
+    )
+    from utils.charts import line_chart, band_chart
+    from utils.recurring import recurring_series, project_outflows, split_recurring
+
+    st.set_page_config(
+        page_title="Financial Forecast",
+        page_icon="📈",
+        layout="wide"
+    )
+
+    # Header
+    st.markdown(
+        """
+        <h1 style="margin-bottom: 0.25rem;">📈 Financial Forecast</h1>
+        <p style="color: #6b7280; margin-bottom: 1.5rem;">
+            Predict future balances using time-series forecasting and scenario analysis.
+        </p>
+        """,
+        unsafe_allow_html=True
+    )
+
+    df = load_snapshot(st.session_state.user_id)
+
+    # Safety check
+    if "category" not in df.columns:
+        df["category"] = "Other"
+
+    if df.empty:
+        st.warning("No transaction data available. Upload transactions first.")
+        st.stop()
+
+    # Prepare Monthly Balance
+    with span("forecast.prep"):
+        df["date"] = pd.to_datetime(df["date"])
+        monthly_balance = monthly_balance_series(df)
+        recurring = recurring_series(st.session_state.user_id, df)
+        horizon = pd.date_range(monthly_balance.index[-1], periods=7, freq="ME")[1:]
+        known_outflows = project_outflows(recurring, horizon)
+        # Models see the balance without recurring payments; their scheduled
+        # dates and amounts are added back onto the projection
+        base_balance, scheduled = split_recurring(df, recurring, monthly_balance, steps=6)
+        flows = monthly_category_flows(df)
+
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("SARIMAX Balance Forecast (Next 6 Months)")
+
+    # SARIMAX Forecast with Fallback
+    try:
+        # Orders are chosen once per user (re-chosen as history grows);
+        # later reruns only refit the parameters
+        with st.spinner("Choosing a forecast model..."):
+            model = forecast_orders(st.session_state.user_id, base_balance)
+        mean_fc, ci = sarimax_forecast(
+            base_balance,
+            steps=6,
+            order=model["order"],
+            seasonal_order=model["seasonal_order"]
+        )
+        mean_fc = mean_fc + scheduled.to_numpy()
+        ci = ci.add(scheduled.to_numpy(), axis=0)
+
+        forecast_df = pd.DataFrame({
+            "Month": mean_fc.index.astype(str),
+            "Forecast Balance": mean_fc.values,
+            "Lower CI": ci.iloc[:, 0].values,
+            "Upper CI": ci.iloc[:, 1].values,
+            "Known Outflows": known_outflows.values
+        })
+
+        fig = band_chart(
+            forecast_df,
+            x="Month",
+            y="Forecast Balance",
+            bands=[("Lower CI", "Upper CI", "95% interval")],
+            labels={"Forecast Balance": "Balance (£)"},
+            hover_data=["Known Outflows"]
+        )
+
+        st.plotly_chart(fig, use_container_width=True)
+        st.success("SARIMAX forecasting active.")
+        if model.get("backtest_mae") is not None:
+            st.caption(
+                f"Model SARIMAX{model['order']}x{model['seasonal_order']}, chosen from "
+                f"{model['evaluated']} candidates; typical error over the next "
+                f"3 months in past data: £{model['backtest_mae']:,.0f}."
+            )
+
+    except Exception as e:
+        st.warning(
+            "Not enough historical data for SARIMAX yet. "
+            "Showing baseline trend projection instead."
+        )
+
+        trend = (
+            base_balance.iloc[-1] + np.arange(1, 7) * base_balance.diff().mean()
+            + scheduled.to_numpy()
+        )
+        trend_df = pd.DataFrame({"Months Ahead": np.arange(1, 7), "Balance": trend})
+        st.plotly_chart(
+            line_chart(trend_df, x="Months Ahead", y="Balance", markers=True),
+            use_container_width=True
+        )
+
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    # Monte Carlo range
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("Range of Outcomes")
+
+    simulation = simulate_balance(flows, steps=6)
+    fan = simulation["percentiles"]
+    fan_df = pd.DataFrame({
+        "Month": simulation["months"].strftime("%b %Y"),
+        "Median": fan[50].values,
+        "Low": fan[5].values,
+        "High": fan[95].values,
+        "Lower quartile": fan[25].values,
+        "Upper quartile": fan[75].values,
     })
 
-    fig = px.line(
-        forecast_df,
-        x="Month",
-        y="Forecast Balance",
-        markers=True,
-        labels={"Forecast Balance": "Balance (£)"}
+    col1, col2 = st.columns(2)
+    col1.metric("Chance of going overdrawn", f"{simulation['overdraft_probability']:.0%}")
+    col2.metric(
+        "Likely balance in 6 months",
+        f"£{fan[5].iloc[-1]:,.0f} – £{fan[95].iloc[-1]:,.0f}"
+    )
+    st.plotly_chart(
+        band_chart(
+            fan_df,
+            x="Month",
+            y="Median",
+            bands=[("Low", "High", "90% of outcomes"), ("Lower quartile", "Upper quartile", "50%")],
+            labels={"Median": "Balance (£)"}
+        ),
+        use_container_width=True
     )
+    st.caption(
+        f"{simulation['paths']:,} possible futures, each built by replaying randomly chosen "
+        "runs of your past months."
+    )
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    # Recurring payments
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("Recurring Payments")
+
+    active = recurring[recurring["active"]]
+    if active.empty:
+        st.info("No regular bills or subscriptions detected yet.")
+    else:
+        col1, col2 = st.columns(2)
+        col1.metric("Committed per month", f"£{-known_outflows.mean():,.2f}")
+        col2.metric("Recurring payments", len(active))
+
+        st.dataframe(
+            active.rename(columns={
+                "description": "Payee",
+                "cadence": "Every",
+                "amount": "Amount (£)",
+                "next_date": "Next Due",
+                "n_payments": "Payments Seen",
+            })[["Payee", "Every", "Amount (£)", "Next Due", "Payments Seen"]],
+            use_container_width=True,
+            hide_index=True
+        )
+        st.caption(
+            "Known outflows for the next 6 months: "
+            + ", ".join(
+                f"{m:%b %Y} £{-v:,.0f}" for m, v in known_outflows.items()
+            )
+            + ". The balance forecast takes these out on their due dates."
+        )
 
-    st.plotly_chart(fig, use_container_width=True)
-    st.success("SARIMAX forecasting active.")
+    st.markdown('</div>', unsafe_allow_html=True)
 
-except Exception as e:
-    st.warning(
-        "Not enough historical data for SARIMAX yet. "
-        "Showing baseline trend projection instead."
+    # What-if Simulation
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("What-If Spending Simulation")
+
+    st.caption(
+        "Each category is forecast separately and reconciled to the total, "
+        "so the sliders start from your projected monthly spend."
     )
 
-    baseline = monthly_balance.iloc[-1] + np.arange(1, 7) * monthly_balance.diff().mean()
-    st.line_chart(baseline)
+    # Category forecasts are cached per data version, so moving a slider
+    # only re-runs the arithmetic below
+    with st.spinner("Projecting your categories..."):
+        projection = cached_category_forecasts(st.session_state.user_id, df, steps=6)
 
-st.markdown('</div>', unsafe_allow_html=True)
+    projected_spend = -projection["categories"].mean()
+    projected_spend = projected_spend[projected_spend >= 1].sort_values(ascending=False)
+    defaults = projected_spend.round().astype(int)
+    adjustments = {}
 
-# What-if Simulation
-st.markdown('<div class="card">', unsafe_allow_html=True)
-st.subheader("What-If Spending Simulation")
+    for cat, avg in defaults.items():
+        adjustments[cat] = st.slider(
+            f"{cat} (£ / month)",
+            min_value=0,
+            max_value=max(int(avg * 2), 10),
+            value=int(avg),
+            step=5
+        )
 
-categories = df[df["amount"] < 0].groupby("category")["amount"].mean().abs()
-adjustments = {}
+    # Extra spend per month relative to the projection
+    delta = sum(adjustments[cat] - defaults[cat] for cat in adjustments)
+    baseline = projection["balance"].to_numpy()
+    simulated = baseline - np.arange(1, 7) * delta
+    simulated_df = pd.DataFrame({
+        "Month": projection["months"].strftime("%b %Y").tolist() * 2,
+        "Balance": np.concatenate([baseline, simulated]),
+        "Scenario": ["Projected"] * 6 + ["With your changes"] * 6,
+    })
 
-for cat, avg in categories.items():
-    adjustments[cat] = st.slider(
-        f"{cat} (£ / month)",
-        min_value=0,
-        max_value=int(avg * 2),
-        value=int(avg),
-        step=10
+    st.plotly_chart(
+        line_chart(simulated_df, x="Month", y="Balance", color="Scenario", markers=True),
+        use_container_width=True
     )
 
-delta = sum(adjustments.values()) - categories.sum()
-simulated = baseline - np.arange(1, 7) * delta
+    # Same random paths, so the change in risk comes from the sliders alone
+    what_if = simulate_balance(flows, steps=6, monthly_change=-delta)
+    st.metric(
+        "Chance of going overdrawn with your changes",
+        f"{what_if['overdraft_probability']:.0%}",
+        delta=f"{what_if['overdraft_probability'] - simulation['overdraft_probability']:+.0%}",
+        delta_color="inverse"
+    )
+    st.markdown('</div>', unsafe_allow_html=True)
 
-st.line_chart(simulated)
-st.markdown('</div>', unsafe_allow_html=True)
+timing_panel("Forecast")
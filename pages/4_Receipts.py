@@ -1,3 +1,5 @@
+import io
+
 import streamlit as st
 import pandas as pd
 from PIL import Image
@@ -6,80 +8,129 @@ from PIL import Image
 from utils.style import apply_global_style
 apply_global_style()
 
-# Auth
-from utils.auth import require_login, logout_user
-require_login()
-with st.sidebar:
-    st.markdown(f"👤 **{st.session_state.first_name} {st.session_state.last_name}**")
-    if st.button("🚪 Log out"):
-        logout_user()
-        st.switch_page("pages/0_Login.py")
-
-
-# Data
-from utils.database import (
-    load_transactions,
-    insert_receipt,
-    insert_receipt_items,
-    get_receipts_for_transaction,
-    get_items_for_receipt
-)
-from utils.ocr_utils import ocr_image, parse_receipt_items
-
-st.set_page_config(
-    page_title="Receipt Analysis",
-    page_icon="🧾",
-    layout="wide"
-)
-
-# Header
-st.markdown(
-    """
-    <h1 style="margin-bottom: 0.25rem;">🧾 Receipt Analysis</h1>
-    <p style="color: #6b7280; margin-bottom: 1.5rem;">
-        Attach receipts to transactions and extract item-level details using OCR.
-    </p>
-    """,
-    unsafe_allow_html=True
-)
-
-df = load_transactions(st.session_state.user_id)
-if df.empty:
-    st.warning("Upload transactions before adding receipts.")
-    st.stop()
-
-# Select Transaction
-df["label"] = df["date"].astype(str) + " | " + df["description"] + " | £" + df["amount"].astype(str)
-choice = st.selectbox("Select transaction", df["label"])
-transaction_id = int(df.loc[df["label"] == choice, "id"].iloc[0])
-
-uploaded = st.file_uploader("Upload receipt image (PNG/JPG)", type=["png", "jpg", "jpeg"])
-
-if uploaded:
-    img = Image.open(uploaded)
-    st.image(img, use_container_width=True)
-
-    if st.button("Run OCR & Save", type="primary"):
-        text = ocr_image(img)
-        items = parse_receipt_items(text)
-
-        rid = insert_receipt(transaction_id, uploaded.name, text)
-        insert_receipt_items(rid, items)
-
-        st.success(f"Receipt saved. {len(items)} items extracted.")
-        st.rerun()
-
-# Show Linked Receipts
-st.markdown('<div class="card">', unsafe_allow_html=True)
-st.subheader("Linked Receipts")
-
-receipts = get_receipts_for_transaction(transaction_id)
-if receipts.empty:
-    st.info("No receipts linked yet.")
-else:
-    st.dataframe(receipts[["id", "filename", "created_at"]], use_container_width=True)
-    rid = st.selectbox("View receipt items", receipts["id"])
-    items_df = get_items_for_receipt(int(rid))
-    st.dataframe(items_df, use_container_width=True)
-
-st.markdown('</div>', unsafe_allow_html=True)
+from utils.timing import start_rerun
+from utils.sidebar import timing_panel
+from utils.profiling import profile_page
+start_rerun()
+with profile_page("Receipts"):
+    # Auth
+    from utils.auth import require_login, logout_user
+    require_login()
+    with st.sidebar:
+        st.markdown(f"👤 **{st.session_state.first_name} {st.session_state.last_name}**")
+        if st.button("🚪 Log out"):
+            logout_user()
+            st.switch_page("pages/0_Login.py")
+
+
+    # Data
+    from utils.database import (
+        count_transactions,
+        search_transactions,
+        insert_receipt,
+        insert_receipt_items,
+        get_receipts_for_transaction,
+        get_items_for_receipt
+    )
+    from utils.ocr_utils import ocr_image, parse_receipt, PARSER_VERSION
+    from utils.receipt_store import put_image, thumbnail, read_image, has_image
+
+    st.set_page_config(
+        page_title="Receipt Analysis",
+        page_icon="🧾",
+        layout="wide"
+    )
+
+    # Header
+    st.markdown(
+        """
+        <h1 style="margin-bottom: 0.25rem;">🧾 Receipt Analysis</h1>
+        <p style="color: #6b7280; margin-bottom: 1.5rem;">
+            Attach receipts to transactions and extract item-level details using OCR.
+        </p>
+        """,
+        unsafe_allow_html=True
+    )
+
+    user_id = st.session_state.user_id
+    # Archived months are not searchable and cannot take receipts
+    if count_transactions(user_id, include_archive=False) == 0:
+        st.warning("Upload recent transactions before adding receipts.")
+        st.stop()
+
+    # Select Transaction
+    query = st.text_input(
+        "Search transactions",
+        placeholder="Type a merchant or description, e.g. tesco"
+    )
+    matches = search_transactions(user_id, query, limit=50)
+    if matches.empty:
+        st.info("No transactions match your search.")
+        st.stop()
+
+    labels = {
+        int(r.id): f"{r.date} | {r.description} | £{r.amount}"
+        for r in matches.itertuples(index=False)
+    }
+    transaction_id = st.selectbox(
+        "Select transaction",
+        list(labels),
+        format_func=labels.get
+    )
+
+    uploaded = st.file_uploader("Upload receipt image (PNG/JPG)", type=["png", "jpg", "jpeg"])
+
+    if uploaded:
+        data = uploaded.getvalue()
+        img = Image.open(io.BytesIO(data))
+        st.image(img, use_container_width=True)
+
+        if st.button("Run OCR & Save", type="primary"):
+            text = ocr_image(img)
+            parsed = parse_receipt(text)
+            items = parsed["items"]
+
+            # Keep the image so it can be viewed and re-read later
+            digest = put_image(data)
+            rid = insert_receipt(transaction_id, uploaded.name, text, user_id, image_sha256=digest)
+            insert_receipt_items(rid, items, user_id, parser_version=PARSER_VERSION)
+
+            st.success(f"Receipt saved. {len(items)} items extracted.")
+            if parsed["reconciled"] is False:
+                # Keep the warning on screen instead of rerunning straight away
+                expected = parsed["total"] if parsed["total"] is not None else parsed["subtotal"]
+                st.warning(
+                    f"Parsed items add up to £{parsed['items_total']:,.2f} "
+                    f"but the receipt total is £{expected:,.2f}. "
+                    "Some lines may not have been read correctly."
+                )
+            else:
+                st.rerun()
+
+    # Show Linked Receipts
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("Linked Receipts")
+
+    receipts = get_receipts_for_transaction(transaction_id, user_id)
+    if receipts.empty:
+        st.info("No receipts linked yet.")
+    else:
+        st.dataframe(receipts[["id", "filename", "created_at"]], use_container_width=True)
+        rid = st.selectbox("View receipt items", receipts["id"])
+        items_df = get_items_for_receipt(int(rid), user_id)
+
+        digest = receipts.loc[receipts["id"] == rid, "image_sha256"].iloc[0]
+        thumb = thumbnail(digest) if isinstance(digest, str) else None
+        if thumb is None:
+            st.dataframe(items_df, use_container_width=True)
+        else:
+            col1, col2 = st.columns([1, 3])
+            col1.image(thumb)
+            col2.dataframe(items_df, use_container_width=True)
+            # The full image is only read from disk when asked for
+            if st.toggle("Show full image") and has_image(digest):
+                st.image(read_image(digest), use_container_width=True)
+
+    st.markdown('</div>', unsafe_allow_html=True)
+
+timing_panel("Receipts")
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Never touch the real database
+os.environ["SMARTSPEND_DB_DIR"] = tempfile.mkdtemp(prefix="smartspend-test-")
+os.environ.setdefault("SMARTSPEND_BCRYPT_ROUNDS", "4")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,73 @@
+import sqlite3
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import utils.auth as auth
+from utils.auth import SESSION_PARAM, _start_session, _token_hash, create_user, verify_user
+from utils.database import get_session_user
+from utils.timing import set_enabled
+
+PAGE = """
+from utils.auth import init_session
+init_session()
+"""
+
+
+def _refresh(token: str) -> AppTest:
+    # A refresh starts a new Streamlit session from the URL alone
+    at = AppTest.from_string(PAGE, default_timeout=60)
+    at.query_params[SESSION_PARAM] = token
+    at.run()
+    return at
+
+
+def test_session_survives_repeated_refreshes():
+    create_user("refresher", "Re", "Fresh", "pw")
+    user_id = verify_user("refresher", "pw")[2]
+    token = _start_session(user_id)
+
+    for _ in range(2):
+        at = _refresh(token)
+        assert at.session_state.logged_in
+        new_token = at.query_params[SESSION_PARAM]
+        assert new_token != token
+        assert at.session_state.session_token == new_token
+        # The token that was in the URL before the refresh is revoked
+        assert get_session_user(_token_hash(token), 0) is None
+        token = new_token
+
+
+def test_unknown_token_is_removed_from_url():
+    at = _refresh("not-a-token")
+    assert not at.session_state.logged_in
+    assert SESSION_PARAM not in at.query_params
+
+
+def test_duplicate_username_is_reported():
+    assert create_user("twice", "Tw", "Ice", "pw")[0]
+    assert create_user("twice", "Tw", "Ice", "pw") == (False, "Username already exists.")
+
+
+def test_database_errors_are_not_reported_as_duplicates(monkeypatch):
+    def fail(fn, user_id=None):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(auth, "run_write", fail)
+    with pytest.raises(sqlite3.OperationalError):
+        create_user("locked", "Lo", "Cked", "pw")
+
+
+def test_timing_panel_shows_login_latency():
+    create_user("timed", "Ti", "Med", "pw")
+    verify_user("timed", "pw")
+    set_enabled(True)
+    try:
+        at = AppTest.from_string(
+            "from utils.sidebar import timing_panel\ntiming_panel('Test')",
+            default_timeout=60
+        )
+        at.run()
+    finally:
+        set_enabled(False)
+    assert any(c.value.startswith("Logins (") for c in at.sidebar.caption)
@@ -0,0 +1,38 @@
+import pandas as pd
+
+from utils.categoriser import _model_path, train_categoriser, training_rows
+
+
+def _history() -> pd.DataFrame:
+    known = [f"TESCO STORES {name}" for name in "ABCDEFGHIJKLMNOPQRST"]
+    known += [f"UBER TRIP {name}" for name in "ABCDEFGHIJKLMNOPQRST"]
+    unknown = [f"ZEPHYR WORKSHOP {name}" for name in "ABCDEFGHIJKLMNOPQRST"]
+    df = pd.DataFrame({"description": known + unknown, "amount": -12.5})
+    df["category"] = ["Groceries"] * 20 + ["Transport"] * 20 + ["Other"] * 20
+    return df
+
+
+def test_training_labels_ignore_earlier_predictions():
+    df = _history()
+    # As if a model had filled in the merchants the keyword rules miss
+    df.loc[df["description"].str.startswith("ZEPHYR"), "category"] = "Groceries"
+
+    rows = training_rows(df)
+    unknown = rows[rows["text"].str.startswith("zephyr")]
+    assert len(unknown) == 20
+    assert (unknown["category"] == "Other").all()
+
+
+def test_training_ignores_income():
+    df = pd.concat([_history(), pd.DataFrame({
+        "description": ["PAYROLL ACME"], "amount": [2000.0], "category": ["Income"]
+    })], ignore_index=True)
+    assert "Income" not in set(training_rows(df)["category"])
+
+
+def test_saved_model_leaves_no_temp_files():
+    report = train_categoriser(_history())
+    assert report["n_rows"] == 60
+    path = _model_path()
+    assert path.exists()
+    assert [p.name for p in path.parent.iterdir()] == [path.name]
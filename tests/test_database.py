@@ -0,0 +1,350 @@
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+
+import utils.database as database
+from utils.database import (
+    archive_transactions,
+    compact_database,
+    count_transactions,
+    database_files,
+    get_items_for_receipt,
+    get_receipts_for_transaction,
+    insert_receipt,
+    insert_receipt_items,
+    migrate_to_shards,
+    load_archive_totals,
+    load_transactions,
+    run_write,
+    search_transactions,
+    write_transactions,
+)
+
+
+def _user(username: str) -> int:
+    return run_write(lambda cur: cur.execute(
+        "INSERT INTO users (username, first_name, last_name, password_hash) VALUES (?,?,?,?)",
+        (username, "Test", "User", b"-")
+    ).lastrowid)
+
+
+def _rows(start: str, months: int, description: str = "TESCO STORES") -> pd.DataFrame:
+    dates = pd.date_range(start, periods=months * 3, freq="10D")
+    return pd.DataFrame({
+        "date": dates,
+        "description": [f"{description} {i}" for i in range(len(dates))],
+        "amount": [-(i % 7) - 1.25 for i in range(len(dates))],
+        "category": ["Groceries", "Transport", "Bills"] * months,
+    })
+
+
+def _history(user_id: int) -> pd.DataFrame:
+    # Four old months to archive, then recent ones that stay
+    recent = (pd.Timestamp.today() - pd.DateOffset(months=3)).strftime("%Y-%m-01")
+    df = pd.concat([_rows("2019-01-01", 4, "OLD SHOP"), _rows(recent, 3)], ignore_index=True)
+    write_transactions(df, user_id)
+    return load_transactions(user_id)
+
+
+# Archive
+def test_archive_round_trip_keeps_every_row():
+    user_id = _user("archive")
+    before = _history(user_id)
+
+    moved = archive_transactions(user_id)
+    after = load_transactions(user_id)
+
+    assert moved == (before["month"] < "2020").sum()
+    pd.testing.assert_frame_equal(after, before)
+    totals = load_archive_totals(user_id)
+    assert totals["n_rows"].sum() == moved
+    assert totals["total"].sum() == pytest.approx(before.loc[before["month"] < "2020", "amount"].sum())
+
+    # Counts agree with what search can see
+    assert count_transactions(user_id) == len(before)
+    assert count_transactions(user_id, include_archive=False) == len(before) - moved
+    assert search_transactions(user_id, "OLD SHOP").empty
+    assert len(search_transactions(user_id, "TESCO", limit=1000)) == len(before) - moved
+
+
+def test_archiving_twice_merges_months():
+    user_id = _user("archive-twice")
+    before = _history(user_id)
+    archive_transactions(user_id)
+    assert archive_transactions(user_id) == 0
+    pd.testing.assert_frame_equal(load_transactions(user_id), before)
+
+
+def test_rows_with_receipts_are_not_archived():
+    user_id = _user("archive-receipt")
+    before = _history(user_id)
+    kept = int(before["id"].iloc[0])
+    insert_receipt(kept, "r.jpg", "TESCO 1.25", user_id)
+
+    archive_transactions(user_id)
+    assert kept in set(search_transactions(user_id, "OLD SHOP")["id"])
+
+
+def test_everything_archived_keeps_dtypes():
+    user_id = _user("archive-all")
+    write_transactions(_rows("2019-01-01", 4), user_id)
+    before = load_transactions(user_id)
+
+    archive_transactions(user_id)
+    after = load_transactions(user_id)
+    assert after["id"].dtype == "int64"
+    assert after["amount"].dtype == "float64"
+    pd.testing.assert_frame_equal(after, before)
+
+
+def test_archive_is_decompressed_only_when_it_changes(monkeypatch):
+    user_id = _user("archive-cache")
+    _history(user_id)
+    archive_transactions(user_id)
+
+    calls = []
+    unpack = database._unpack_archives
+    monkeypatch.setattr(database, "_unpack_archives", lambda rows: calls.append(1) or unpack(rows))
+    database._archive_cache.pop(user_id, None)
+
+    load_transactions(user_id)
+    load_transactions(user_id)
+    # A new upload does not touch the archive
+    write_transactions(_rows("2024-06-01", 1, "NEW SHOP"), user_id, replace_existing=False)
+    load_transactions(user_id)
+    assert len(calls) == 1
+
+    write_transactions(_rows("2018-06-01", 1, "OLDER SHOP"), user_id, replace_existing=False)
+    archive_transactions(user_id)
+    calls.clear()
+    loaded = load_transactions(user_id)
+    assert calls
+    assert loaded["description"].str.startswith("OLDER SHOP").sum() == 3
+
+
+# Sharding
+def _use_database(monkeypatch, path, shards: int):
+    monkeypatch.setattr(database, "DB_DIR", path)
+    monkeypatch.setattr(database, "DB_PATH", path / "smartspend.db")
+    monkeypatch.setattr(database, "SHARDS", shards)
+    monkeypatch.setattr(database, "_initialised_paths", set())
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    _use_database(monkeypatch, tmp_path, 4)
+    return tmp_path
+
+
+def test_compact_sharded_database(sharded):
+    user_ids = [_user(f"shard{i}") for i in range(3)]
+    for user_id in user_ids:
+        _history(user_id)
+        archive_transactions(user_id)
+
+    files = database_files()
+    assert database.DB_PATH in files and len(files) == 4
+    reports = [compact_database(path) for path in files]
+    assert all(r["bytes_after"] > 0 for r in reports)
+    for user_id in user_ids:
+        assert count_transactions(user_id) == len(load_transactions(user_id))
+
+
+def _multi_user_database() -> dict:
+    """
+    Three users with transactions, receipts, items and archived months,
+    plus a receipt whose transaction was replaced by a later upload.
+    """
+    users = {}
+    for i in range(3):
+        user_id = _user(f"migrate{i}")
+        df = _history(user_id)
+        archive_transactions(user_id)
+        hot = load_transactions(user_id, include_archive=False)
+        receipt_id = insert_receipt(int(hot["id"].iloc[-1]), "r.jpg", f"SHOP {i} 2.50", user_id)
+        insert_receipt_items(receipt_id, [{"item_name": "TEA", "qty": 1, "unit_price": 2.5, "total": 2.5}], user_id)
+        users[user_id] = (load_transactions(user_id), int(hot["id"].iloc[-1]))
+
+    orphan_owner = _user("orphan-owner")
+    write_transactions(_rows("2024-01-01", 1), orphan_owner)
+    tid = int(load_transactions(orphan_owner)["id"].iloc[0])
+    receipt_id = insert_receipt(tid, "gone.jpg", "GONE 1.00", orphan_owner)
+    insert_receipt_items(receipt_id, [{"item_name": "GONE", "qty": 1, "unit_price": 1.0, "total": 1.0}], orphan_owner)
+    # Re-uploading replaces the transactions; the receipt keeps the old id
+    write_transactions(_rows("2024-01-01", 1), orphan_owner)
+    users[orphan_owner] = (load_transactions(orphan_owner), None)
+    return users
+
+
+def test_migrate_to_shards_copies_every_user_and_reports_orphans(tmp_path, monkeypatch):
+    _use_database(monkeypatch, tmp_path, 0)
+    users = _multi_user_database()
+
+    result = migrate_to_shards(3, drop_source=True)
+    assert result["users"] == len(users)
+    assert result["orphaned"] == {"receipts": 1, "receipt_items": 1}
+
+    _use_database(monkeypatch, tmp_path, 3)
+    for user_id, (before, receipt_tid) in users.items():
+        pd.testing.assert_frame_equal(load_transactions(user_id), before)
+        if receipt_tid is not None:
+            receipts = get_receipts_for_transaction(receipt_tid, user_id)
+            assert len(receipts) == 1
+            assert len(get_items_for_receipt(int(receipts["id"].iloc[0]), user_id)) == 1
+
+    # Re-running after drop_source keeps the shards as they are
+    again = migrate_to_shards(3)
+    assert sum(again["rows"].values()) == 0
+    assert again["orphaned"] == {"receipts": 1, "receipt_items": 1}
+
+
+# Write queue
+@pytest.fixture
+def scratch(tmp_path, monkeypatch):
+    _use_database(monkeypatch, tmp_path, 0)
+    run_write(lambda cur: cur.execute("CREATE TABLE scratch (v TEXT UNIQUE)"))
+    return database._get_writer(database.DB_PATH)
+
+
+def _insert(value: str, fail: bool = False):
+    def write(cur):
+        cur.execute("INSERT INTO scratch (v) VALUES (?)", (value,))
+        if fail:
+            raise KeyError(value)
+        return value
+    return write
+
+
+def _scratch_values() -> list[str]:
+    return run_write(lambda cur: [r[0] for r in cur.execute("SELECT v FROM scratch ORDER BY v")])
+
+
+def _queued(writer, jobs: list) -> list:
+    """
+    Submits jobs while the writer is held busy, so they are committed as
+    one batch once it is released.
+    """
+    started, release = threading.Event(), threading.Event()
+    blocker = writer.submit(lambda cur: started.set() or release.wait(10))
+    started.wait(10)
+    futures = [writer.submit(fn) for fn in jobs]
+    release.set()
+    blocker.result()
+    return futures
+
+
+def test_queued_writes_are_committed_together(scratch):
+    before = dict(scratch.stats)
+    futures = _queued(scratch, [_insert(f"v{i}") for i in range(10)])
+    assert [f.result() for f in futures] == [f"v{i}" for i in range(10)]
+    assert scratch.stats["jobs"] - before["jobs"] == 11
+    assert scratch.stats["batches"] - before["batches"] == 2
+
+
+def test_failing_job_is_rolled_back_alone(scratch):
+    futures = _queued(scratch, [_insert("a"), _insert("b", fail=True), _insert("c")])
+    assert futures[0].result() == "a"
+    with pytest.raises(KeyError):
+        futures[1].result()
+    assert futures[2].result() == "c"
+    assert _scratch_values() == ["a", "c"]
+
+
+def test_write_errors_reach_the_caller(scratch):
+    run_write(_insert("a"))
+    with pytest.raises(sqlite3.IntegrityError):
+        run_write(_insert("a"))
+    with pytest.raises(KeyError):
+        run_write(_insert("b", fail=True))
+    assert _scratch_values() == ["a"]
+
+
+def test_write_from_inside_a_job_runs_inline(scratch):
+    def outer(cur):
+        cur.execute("INSERT INTO scratch (v) VALUES ('outer')")
+        inner = run_write(_insert("inner"))
+        try:
+            run_write(_insert("undone", fail=True))
+        except KeyError:
+            pass
+        return inner
+
+    assert run_write(outer) == "inner"
+    assert _scratch_values() == ["inner", "outer"]
+
+
+def test_write_from_inside_a_job_to_another_database_fails(sharded):
+    first, second = _user("writer-a"), _user("writer-b")
+    assert database.db_path_for(first) != database.db_path_for(second)
+    with pytest.raises(ValueError, match="its own database"):
+        run_write(lambda cur: run_write(lambda inner: None, second), first)
+
+
+# Transaction search
+@pytest.fixture
+def searchable(tmp_path, monkeypatch):
+    _use_database(monkeypatch, tmp_path, 0)
+    user_id = _user("search")
+    write_transactions(pd.DataFrame({
+        "date": pd.date_range("2024-01-01", periods=6, freq="D"),
+        "description": [
+            "TESCO STORES 1234",
+            "UBER *TRIP HELP.UBER.COM",
+            "AMAZON MKTPLACE 50% OFF",
+            "O2 MOBILE",
+            'CAFE "NERO" AND CO (LONDON)',
+            "PAYPAL_ACME NOT REFUND",
+        ],
+        "amount": -10.0,
+    }), user_id)
+    return user_id
+
+
+def _found(user_id: int, query: str) -> list[str]:
+    return list(search_transactions(user_id, query)["description"])
+
+
+def test_search_short_terms_match_substrings(searchable):
+    assert _found(searchable, "o2") == ["O2 MOBILE"]
+    assert _found(searchable, "50%") == ["AMAZON MKTPLACE 50% OFF"]
+    # LIKE wildcards in the query are literal characters
+    assert _found(searchable, "%") == ["AMAZON MKTPLACE 50% OFF"]
+    assert _found(searchable, "_") == ["PAYPAL_ACME NOT REFUND"]
+    # Short terms narrow the trigram matches
+    assert _found(searchable, "uber *t") == ["UBER *TRIP HELP.UBER.COM"]
+    assert _found(searchable, "tesco zz") == []
+
+
+@pytest.mark.parametrize("query, expected", [
+    ('"nero"', ['CAFE "NERO" AND CO (LONDON)']),
+    ("(london)", ['CAFE "NERO" AND CO (LONDON)']),
+    ("*trip", ["UBER *TRIP HELP.UBER.COM"]),
+    ("help.uber.com", ["UBER *TRIP HELP.UBER.COM"]),
+    ("and", ['CAFE "NERO" AND CO (LONDON)']),
+    ("NOT", ["PAYPAL_ACME NOT REFUND"]),
+    ("description:tesco", []),
+    ("NEAR(tesco", []),
+    ("^tesco", []),
+    ('"', ['CAFE "NERO" AND CO (LONDON)']),
+])
+def test_search_treats_fts_syntax_as_text(searchable, query, expected):
+    assert _found(searchable, query) == expected
+
+
+def test_search_follows_updated_and_deleted_rows(searchable):
+    tesco = int(search_transactions(searchable, "tesco")["id"].iloc[0])
+    run_write(lambda cur: cur.execute(
+        "UPDATE transactions SET description = 'SAINSBURYS 99' WHERE id = ?", (tesco,)
+    ), searchable)
+    assert _found(searchable, "tesco") == []
+    assert _found(searchable, "sainsburys") == ["SAINSBURYS 99"]
+
+    run_write(lambda cur: cur.execute("DELETE FROM transactions WHERE id = ?", (tesco,)), searchable)
+    assert _found(searchable, "sainsburys") == []
+
+    # A replacing upload drops the old rows from the index too
+    write_transactions(_rows("2024-01-01", 1), searchable)
+    assert _found(searchable, "nero") == []
+    assert len(_found(searchable, "tesco")) == 3
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils.forecasting as forecasting
+from utils.database import load_forecast_order, run_write
+
+
+def _user(username: str) -> int:
+    return run_write(lambda cur: cur.execute(
+        "INSERT INTO users (username, first_name, last_name, password_hash) VALUES (?,?,?,?)",
+        (username, "Test", "User", b"-")
+    ).lastrowid)
+
+
+def _balance(months: int = 30) -> pd.Series:
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2022-01-31", periods=months, freq="ME")
+    return pd.Series(np.cumsum(rng.normal(100, 50, months)), index=index)
+
+
+def test_search_that_evaluates_nothing_is_not_stored(monkeypatch):
+    user_id = _user("cold-pool")
+    monkeypatch.setattr(forecasting, "SELECTION_BUDGET_SECONDS", 0)
+
+    choice = forecasting.forecast_orders(user_id, _balance(), workers=1)
+    assert choice["evaluated"] == 0
+    assert choice["order"] == forecasting.DEFAULT_ORDER
+    assert load_forecast_order(user_id) is None
+
+    # The next forecast searches again and keeps what it finds
+    monkeypatch.setattr(forecasting, "SELECTION_BUDGET_SECONDS", 60)
+    choice = forecasting.forecast_orders(user_id, _balance(), workers=1)
+    assert choice["evaluated"] > 0
+    assert load_forecast_order(user_id)["evaluated"] == choice["evaluated"]
+
+
+def test_discarded_pool_is_shut_down(monkeypatch):
+    monkeypatch.setattr(forecasting, "FORECAST_WORKERS", 1)
+    pool = forecasting._get_pool()
+    forecasting._discard_pool()
+
+    with pytest.raises(RuntimeError):
+        pool.submit(int)
+    assert forecasting._get_pool() is not pool
+    forecasting._discard_pool()
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+import utils.insights as insights
+from benchmarks.synthetic import generate_transactions
+from utils.database import run_write, write_transactions, load_transactions
+
+
+def _user_with_history(username: str) -> int:
+    user_id = run_write(lambda cur: cur.execute(
+        "INSERT INTO users (username, first_name, last_name, password_hash) VALUES (?,?,?,?)",
+        (username, "Test", "User", b"-")
+    ).lastrowid)
+    df = generate_transactions(500, years=1)
+    df["category"] = "Other"
+    write_transactions(df, user_id)
+    return user_id
+
+
+def test_stale_model_refits_when_every_row_is_scored(monkeypatch):
+    user_id = _user_with_history("refit")
+    df = load_transactions(user_id)
+    first = insights.score_anomalies(user_id, df)
+    assert first["anomaly_score"].notna().all()
+
+    # A feature change makes the stored model stale with nothing unscored
+    monkeypatch.setattr(insights, "FEATURE_VERSION", insights.FEATURE_VERSION + 1)
+    second = insights.score_anomalies(user_id, df)
+
+    assert second["anomaly_score"].notna().all()
+    stored = insights.load_anomaly_model(user_id)
+    assert stored["feature_version"] == insights.FEATURE_VERSION
+
+
+def test_window_stats_are_the_same_in_chunks(monkeypatch):
+    rng = np.random.default_rng(0)
+    values = rng.gamma(2.0, 30.0, 5000)
+    groups = np.sort(rng.integers(0, 7, 5000))
+
+    whole = insights._prior_window_stats(values, groups, insights.SIGN_WINDOW)
+    monkeypatch.setattr(insights, "WINDOW_CHUNK_ROWS", 333)
+    chunked = insights._prior_window_stats(values, groups, insights.SIGN_WINDOW)
+    for a, b in zip(whole, chunked):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_refunds_do_not_move_the_category_baseline():
+    dates = pd.date_range("2024-01-01", periods=12, freq="7D")
+    spends = pd.DataFrame({"date": dates, "description": "SHOP", "amount": -20.0, "category": "Shopping"})
+    refunds = spends.iloc[::2].assign(amount=500.0, description="SHOP REFUND")
+    df = pd.concat([spends, refunds], ignore_index=True)
+
+    features = insights.transaction_features(df)
+    last_spend = features.loc[spends.index[-1]]
+    assert last_spend["cat_median"] == 20.0
+    assert last_spend["cat_mad"] == 0.0
@@ -0,0 +1,79 @@
+import pytest
+
+from utils.ocr_utils import parse_receipt
+
+
+def _items(text: str) -> list[tuple]:
+    return [(it["item_name"], it["qty"], it["unit_price"], it["total"])
+            for it in parse_receipt(text)["items"]]
+
+
+@pytest.mark.parametrize("line", ["REDUCED FAT MILK 1.20", "HOLIDAY OFFER PACK 1.20"])
+def test_discount_words_inside_item_names_are_items(line):
+    assert _items(line) == [(line[:-5], 1, 1.20, 1.20)]
+
+
+@pytest.mark.parametrize("line", [
+    "MULTIBUY SAVING 0.50",
+    "CLUBCARD PRICE 0.50",
+    "OFFER 0.50",
+    "REDUCED 0.50",
+    "BREAD 0.50-",
+    "Bread promo -0.50",
+])
+def test_discount_lines_are_negative(line):
+    assert _items(line)[0][3] == -0.50
+
+
+def test_receipt_with_discount_words_in_names_reconciles():
+    result = parse_receipt(
+        "REDUCED FAT MILK 1.20\n"
+        "HOLIDAY OFFER PACK 3.00\n"
+        "BREAD 2.20\n"
+        "MULTIBUY SAVING -0.50\n"
+        "TOTAL 5.90\n"
+        "CARD 5.90\n"
+    )
+    assert result["items_total"] == 5.90
+    assert result["total"] == 5.90
+    assert result["reconciled"] is True
+
+
+def test_thousands_separator():
+    result = parse_receipt("LAPTOP 1,234.56\nTOTAL £1,234.56")
+    assert _items("LAPTOP 1,234.56") == [("LAPTOP", 1, 1234.56, 1234.56)]
+    assert result["total"] == 1234.56
+    assert result["reconciled"] is True
+
+
+def test_decimal_comma():
+    assert _items("KAFFEE 3,49") == [("KAFFEE", 1, 3.49, 3.49)]
+
+
+def test_quantity_line_under_priced_item():
+    assert _items("APPLES 3.00\n2 x 1.50") == [("APPLES", 2, 1.50, 3.00)]
+
+
+def test_quantity_line_under_unit_priced_item():
+    result = parse_receipt("APPLES 1.50\n2 x 1.50\nTOTAL 3.00")
+    assert _items("APPLES 1.50\n2 x 1.50") == [("APPLES", 2, 1.50, 3.00)]
+    assert result["reconciled"] is True
+
+
+def test_unmatched_quantity_line_is_kept():
+    result = parse_receipt("APPLES 1.00\n2 x 1.50\nTOTAL 4.00")
+    assert _items("APPLES 1.00\n2 x 1.50") == [
+        ("APPLES", 1, 1.00, 1.00),
+        ("Unnamed item", 2, 1.50, 3.00),
+    ]
+    assert result["reconciled"] is True
+
+
+def test_quantity_line_under_name_only_line():
+    assert _items("BANANAS\n0.450 kg @ £2.00/kg 0.90") == [("BANANAS", 0.45, 2.00, 0.90)]
+
+
+def test_lines_after_total_are_ignored():
+    result = parse_receipt("TEA 2.00\nTOTAL 2.00\nCHANGE 3.00\nNECTAR POINTS 12.00")
+    assert result["items_total"] == 2.00
+    assert result["reconciled"] is True
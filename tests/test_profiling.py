@@ -0,0 +1,38 @@
+import tracemalloc
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import utils.profiling as profiling
+
+PAGE = """
+import streamlit as st
+from utils.profiling import profile_page
+
+with profile_page(f"Exit {st.session_state.exit}"):
+    st.write("body")
+    if st.session_state.get("exit") == "stop":
+        st.stop()
+    if st.session_state.get("exit") == "rerun" and not st.session_state.get("reran"):
+        st.session_state.reran = True
+        st.rerun()
+    if st.session_state.get("exit") == "error":
+        raise RuntimeError("page failed")
+"""
+
+
+@pytest.mark.parametrize("exit", [None, "stop", "rerun", "error"])
+def test_capture_ends_however_the_page_exits(exit, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_MODE", "1")
+    at = AppTest.from_string(PAGE, default_timeout=60)
+    at.session_state["exit"] = exit
+    at.run()
+
+    assert profiling._trace_users == 0
+    assert not tracemalloc.is_tracing()
+    assert list(_profile_dir().glob(f"*-exit_{str(exit).lower()}.prof"))
+
+
+def _profile_dir():
+    from utils.database import DB_DIR
+    return DB_DIR / "profiles"
@@ -1,6 +1,57 @@
+import os
+import time
+import hashlib
+import secrets
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import bcrypt
-from utils.database import init_db, get_conn
+from utils.database import (
+    init_db,
+    get_conn,
+    run_write,
+    insert_session,
+    get_session_user,
+    delete_session,
+    purge_expired_sessions
+)
+
+
+# Password hashing configuration
+# Work factor for new hashes; existing hashes are upgraded on next login.
+BCRYPT_ROUNDS = int(os.environ.get("SMARTSPEND_BCRYPT_ROUNDS", "12"))
+
+# bcrypt releases the GIL, so a small pool bounds how many hashes run at
+# once instead of letting a login burst saturate every core. Callers wait
+# for their hash, so this caps CPU use, not the number of blocked threads.
+BCRYPT_WORKERS = int(os.environ.get("SMARTSPEND_BCRYPT_WORKERS", "2"))
+_bcrypt_pool = ThreadPoolExecutor(
+    max_workers=BCRYPT_WORKERS,
+    thread_name_prefix="bcrypt"
+)
+
+# Persistent sessions: the token travels in the URL so a refresh or
+# websocket reconnect can resume without re-entering the password.
+# Restoring a session replaces the token in the URL, so a URL left in
+# browser history or shared stops working after the next restore.
+SESSION_PARAM = "sid"
+SESSION_TTL_SECONDS = int(os.environ.get("SMARTSPEND_SESSION_TTL_HOURS", "12")) * 3600
+SESSION_CLEANUP_INTERVAL = 15 * 60
+_last_session_cleanup = 0.0
+
+# Account rows cached for logins. Entries expire so accounts created or
+# re-hashed by another process (a second app worker, cli.py) are seen.
+USER_CACHE_SIZE = 1024
+USER_CACHE_SECONDS = 60
+_user_cache: dict[str, tuple[float, tuple]] = {}
+_user_cache_lock = threading.Lock()
+
+# Recent login latencies (seconds), used to size BCRYPT_ROUNDS
+_login_latencies = deque(maxlen=500)
+_latency_lock = threading.Lock()
 
 
 # Session handling
@@ -15,6 +66,68 @@ def init_session():
         st.session_state.first_name = None
     if "last_name" not in st.session_state:
         st.session_state.last_name = None
+    if "session_token" not in st.session_state:
+        st.session_state.session_token = None
+
+    if st.session_state.logged_in:
+        # Keep the token in the URL across page switches
+        token = st.session_state.session_token
+        if token and st.query_params.get(SESSION_PARAM) != token:
+            st.query_params[SESSION_PARAM] = token
+    else:
+        _restore_session()
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _cleanup_sessions(now: float):
+    global _last_session_cleanup
+    if now - _last_session_cleanup < SESSION_CLEANUP_INTERVAL:
+        return
+    _last_session_cleanup = now
+    purge_expired_sessions(int(now))
+
+
+def _restore_session():
+    """
+    Resumes a login from the session token in the URL, if still valid.
+    Costs a single primary-key lookup instead of a password check. The
+    token is used once: it is revoked and replaced in the URL by a new one.
+    """
+    token = st.query_params.get(SESSION_PARAM)
+    if not token:
+        return
+
+    now = time.time()
+    _cleanup_sessions(now)
+
+    row = get_session_user(_token_hash(token), int(now))
+    if not row:
+        del st.query_params[SESSION_PARAM]
+        return
+
+    user_id, username, first_name, last_name = row
+    delete_session(_token_hash(token))
+    _set_logged_in(username, user_id, first_name, last_name)
+    token = _start_session(user_id)
+    st.session_state.session_token = token
+    st.query_params[SESSION_PARAM] = token
+
+
+def _start_session(user_id: int) -> str:
+    now = time.time()
+    _cleanup_sessions(now)
+
+    token = secrets.token_urlsafe(32)
+    insert_session(
+        _token_hash(token),
+        user_id,
+        int(now),
+        int(now) + SESSION_TTL_SECONDS
+    )
+    return token
 
 
 # User creation
@@ -27,72 +140,153 @@ def create_user(
     """
     Creates a new user account.
     """
-    init_db()
-    conn = get_conn()
-    cur = conn.cursor()
-
-    password_hash = bcrypt.hashpw(
-        password.encode("utf-8"),
-        bcrypt.gensalt()
-    )
+    password_hash = _hash_password(password)
 
     try:
-        cur.execute(
+        run_write(lambda cur: cur.execute(
             """
             INSERT INTO users (username, first_name, last_name, password_hash)
             VALUES (?, ?, ?, ?)
             """,
             (username, first_name, last_name, password_hash)
-        )
-        conn.commit()
+        ))
+        _forget_user(username)
         return True, "Account created successfully. Please log in."
-    except Exception:
+    except sqlite3.IntegrityError:
         return False, "Username already exists."
-    finally:
-        conn.close()
 
 
-# Authentication
-def verify_user(username: str, password: str) -> tuple[bool, str, int | None, str | None, str | None]:
-    """
-    Verifies user credentials.
+# Password hashing
+def _hash_password(password: str) -> bytes:
+    return _bcrypt_pool.submit(
+        bcrypt.hashpw,
+        password.encode("utf-8"),
+        bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    ).result()
+
+
+def _check_password(password: str, stored_hash: bytes) -> bool:
+    return _bcrypt_pool.submit(
+        bcrypt.checkpw,
+        password.encode("utf-8"),
+        stored_hash
+    ).result()
+
+
+def _hash_rounds(stored_hash: bytes) -> int | None:
+    # Hash layout: $2b$<rounds>$<salt+hash>
+    try:
+        return int(stored_hash.split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def _lookup_user(username: str) -> tuple | None:
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get(username)
+    if cached and cached[0] > now:
+        return cached[1]
 
-    Returns:
-        (success, message, user_id, first_name, last_name)
-    """
     init_db()
     conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute(
+    row = conn.execute(
         """
         SELECT id, first_name, last_name, password_hash
         FROM users
         WHERE username = ?
         """,
         (username,)
-    )
-
-    row = cur.fetchone()
+    ).fetchone()
     conn.close()
 
-    if not row:
-        return False, "User not found.", None, None, None
+    # "No such user" is not cached: the account may be created elsewhere
+    if row:
+        with _user_cache_lock:
+            if len(_user_cache) >= USER_CACHE_SIZE:
+                _user_cache.clear()
+            _user_cache[username] = (now + USER_CACHE_SECONDS, row)
+    return row
 
-    user_id, first_name, last_name, stored_hash = row
 
-    if isinstance(stored_hash, str):
-        stored_hash = stored_hash.encode("utf-8")
+def _forget_user(username: str):
+    with _user_cache_lock:
+        _user_cache.pop(username, None)
 
-    if bcrypt.checkpw(password.encode("utf-8"), stored_hash):
-        return True, "Login successful.", user_id, first_name, last_name
 
-    return False, "Incorrect password.", None, None, None
+def _rehash_password(username: str, user_id: int, password: str):
+    password_hash = _hash_password(password)
+    run_write(lambda cur: cur.execute(
+        "UPDATE users SET password_hash = ? WHERE id = ?",
+        (password_hash, user_id)
+    ))
+    _forget_user(username)
+
+
+def _record_login_latency(seconds: float):
+    with _latency_lock:
+        _login_latencies.append(seconds)
+
+
+def login_latency_stats() -> dict:
+    """
+    Summary of recent verify_user latencies in milliseconds, alongside the
+    configured work factor, for sizing BCRYPT_ROUNDS to the hardware.
+    """
+    with _latency_lock:
+        samples = sorted(_login_latencies)
+
+    stats = {"rounds": BCRYPT_ROUNDS, "workers": BCRYPT_WORKERS, "count": len(samples)}
+    if not samples:
+        return stats
+
+    def pct(p: float) -> float:
+        return samples[min(len(samples) - 1, int(p * len(samples)))] * 1000
+
+    stats.update({
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "max_ms": samples[-1] * 1000,
+    })
+    return stats
+
+
+# Authentication
+def verify_user(username: str, password: str) -> tuple[bool, str, int | None, str | None, str | None]:
+    """
+    Verifies user credentials. Hashes made with a different work factor
+    are transparently re-hashed with BCRYPT_ROUNDS on a successful login.
+
+    Returns:
+        (success, message, user_id, first_name, last_name)
+    """
+    started = time.perf_counter()
+    try:
+        row = _lookup_user(username)
+
+        if not row:
+            return False, "User not found.", None, None, None
+
+        user_id, first_name, last_name, stored_hash = row
+
+        if isinstance(stored_hash, str):
+            stored_hash = stored_hash.encode("utf-8")
+
+        if not _check_password(password, stored_hash):
+            return False, "Incorrect password.", None, None, None
+
+        if _hash_rounds(stored_hash) != BCRYPT_ROUNDS:
+            _rehash_password(username, user_id, password)
+
+        return True, "Login successful.", user_id, first_name, last_name
+    finally:
+        _record_login_latency(time.perf_counter() - started)
 
 
 # Login / logout
 
-def login_user(username: str, user_id: int, first_name: str, last_name: str):
+def _set_logged_in(username: str, user_id: int, first_name: str, last_name: str):
     st.session_state.logged_in = True
     st.session_state.username = username
     st.session_state.user_id = user_id
@@ -100,19 +294,35 @@ def login_user(username: str, user_id: int, first_name: str, last_name: str):
     st.session_state.last_name = last_name
 
 
+def login_user(username: str, user_id: int, first_name: str, last_name: str):
+    _set_logged_in(username, user_id, first_name, last_name)
+
+    token = _start_session(user_id)
+    st.session_state.session_token = token
+    st.query_params[SESSION_PARAM] = token
+
+
 def logout_user():
+    token = st.session_state.get("session_token")
+    if token:
+        delete_session(_token_hash(token))
+    if SESSION_PARAM in st.query_params:
+        del st.query_params[SESSION_PARAM]
+
     for key in [
         "logged_in",
         "username",
         "user_id",
         "first_name",
-        "last_name"
+        "last_name",
+        "session_token"
     ]:
         if key in st.session_state:
             del st.session_state[key]
 
 
 def require_login():
+    init_session()
     if not st.session_state.get("logged_in", False):
         st.warning("Please log in to continue.")
         st.stop()
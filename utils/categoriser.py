@@ -0,0 +1,202 @@
+"""
+Learned fallback for transactions the keyword rules leave as "Other".
+
+Descriptions are normalised (case, digits and spacing removed), turned
+into hashed character n-grams (no vocabulary to fit or store) and
+classified by a linear model trained on transactions the keyword rules
+already categorised, "Other" included, so unfamiliar merchants stay
+"Other". Labels are the keyword rules' own, never the stored category:
+stored categories include the model's earlier predictions, and training
+on those would only teach it to repeat itself. The model is saved under <db dir>/models/ and loaded once per
+process. An upload is scored with one sparse matrix product over its
+distinct normalised descriptions.
+"""
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+from utils.timing import timed, count
+
+MODEL_FILE = "categoriser.pkl"
+MODEL_VERSION = 1
+
+# Feature hashing settings (changing them needs MODEL_VERSION bumped)
+NGRAM_RANGE = (3, 5)
+HASH_FEATURES = 2 ** 18
+
+# Predictions below this probability stay "Other"
+MIN_CONFIDENCE = 0.6
+# Income is decided by the amount sign, never by the model
+EXCLUDED_LABELS = ("Income",)
+MIN_TRAINING_ROWS = 50
+HOLDOUT_SHARE = 0.2
+
+_vectoriser = HashingVectorizer(
+    analyzer="char_wb",
+    ngram_range=NGRAM_RANGE,
+    n_features=HASH_FEATURES,
+    alternate_sign=False,
+    lowercase=False,
+)
+
+# (mtime of the model file, loaded model or None)
+_loaded: tuple[float, dict | None] | None = None
+_loaded_lock = threading.Lock()
+
+
+def _model_path():
+    from utils.database import DB_DIR
+    return DB_DIR / "models" / MODEL_FILE
+
+
+def normalise(descriptions: pd.Series) -> pd.Series:
+    """
+    Lower-cased descriptions without digits (store numbers and payment
+    references carry no category signal) or repeated spaces.
+    """
+    return (
+        descriptions.fillna("").astype(str)
+        .str.lower()
+        .str.replace(r"\d+", " ", regex=True)
+        .str.split()
+        .str.join(" ")
+    )
+
+
+def vectorise(texts):
+    return _vectoriser.transform(texts)
+
+
+def load_model() -> dict | None:
+    """
+    The saved model, read from disk once per process and again only when
+    the file changes. None when no usable model has been trained.
+    """
+    global _loaded
+    path = _model_path()
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+    with _loaded_lock:
+        if _loaded is not None and _loaded[0] == mtime:
+            return _loaded[1]
+        try:
+            with open(path, "rb") as f:
+                model = pickle.load(f)
+            if model.get("version") != MODEL_VERSION:
+                model = None
+        except Exception:
+            # Unreadable or partially written; keyword rules still apply
+            model = None
+        _loaded = (mtime, model)
+        return model
+
+
+def _probabilities(scores: np.ndarray) -> np.ndarray:
+    # One-vs-rest log-loss models: per-class sigmoids, normalised per row
+    if scores.shape[1] == 1:
+        p = 1.0 / (1.0 + np.exp(-scores[:, 0]))
+        return np.column_stack([1.0 - p, p])
+    p = 1.0 / (1.0 + np.exp(-scores))
+    return p / p.sum(axis=1, keepdims=True)
+
+
+@timed()
+def predict_categories(descriptions: pd.Series) -> pd.Series:
+    """
+    Predicted category per description (aligned to its index), or "Other"
+    when no model is trained or the model is not confident enough.
+    """
+    model = load_model()
+    if model is None or descriptions.empty:
+        return pd.Series("Other", index=descriptions.index, dtype=object)
+
+    # Repeated merchants are vectorised and scored once
+    codes, uniques = pd.factorize(normalise(descriptions))
+    X = vectorise(uniques)
+    # One sparse (descriptions x features) @ (features x classes) product
+    scores = np.asarray(X @ model["coef"].T) + model["intercept"]
+    proba = _probabilities(scores)
+    best = proba.argmax(axis=1)
+
+    labels = np.asarray(model["classes"], dtype=object)[best]
+    labels[proba[np.arange(len(best)), best] < MIN_CONFIDENCE] = "Other"
+    out = pd.Series(labels[codes], index=descriptions.index, dtype=object)
+    count("categoriser.predicted", int((out != "Other").sum()))
+    return out
+
+
+def _fit(texts: pd.Series, labels: pd.Series) -> SGDClassifier:
+    clf = SGDClassifier(loss="log_loss", alpha=1e-5, max_iter=20, tol=None, random_state=0)
+    clf.fit(vectorise(texts), labels.to_numpy())
+    return clf
+
+
+def training_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Expense rows as (text, category), one row per distinct normalised
+    description and category, so frequent merchants do not dominate.
+    Categories come from the keyword rules, not the frame's own column.
+    """
+    from utils.data_processing import categorise_frame
+
+    d = df[pd.to_numeric(df["amount"], errors="coerce") < 0]
+    labels = categorise_frame(d, use_model=False)
+    keep = ~labels.isin(EXCLUDED_LABELS)
+    return pd.DataFrame({
+        "text": normalise(d["description"][keep]).to_numpy(),
+        "category": labels[keep].astype(str).to_numpy(),
+    }).drop_duplicates()
+
+
+@timed()
+def train_categoriser(df: pd.DataFrame, seed: int = 0) -> dict:
+    """
+    Trains on transactions (any number of users), reports
+    accuracy on a held-out share of distinct descriptions, then refits on
+    everything and saves the model. Returns the report.
+    """
+    rows = training_rows(df)
+    if len(rows) < MIN_TRAINING_ROWS or rows["category"].nunique() < 2:
+        raise ValueError(
+            f"Need at least {MIN_TRAINING_ROWS} distinct expense descriptions "
+            f"in two or more categories (found {len(rows)})."
+        )
+
+    rng = np.random.default_rng(seed)
+    holdout = rng.random(len(rows)) < HOLDOUT_SHARE
+    clf = _fit(rows["text"][~holdout], rows["category"][~holdout])
+    accuracy = None
+    if holdout.any():
+        predicted = clf.predict(vectorise(rows["text"][holdout]))
+        accuracy = float((predicted == rows["category"][holdout].to_numpy()).mean())
+
+    clf = _fit(rows["text"], rows["category"])
+    model = {
+        "version": MODEL_VERSION,
+        "trained_at": int(time.time()),
+        "n_rows": len(rows),
+        "holdout_accuracy": accuracy,
+        "classes": [str(c) for c in clf.classes_],
+        # Only the weights are needed to score, as float32 to halve the file
+        "coef": clf.coef_.astype(np.float32),
+        "intercept": clf.intercept_.astype(np.float32),
+    }
+
+    path = _model_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Unique per writer, so two trainings at once never share a temp file
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(model, f)
+    os.replace(tmp, path)
+
+    return {k: v for k, v in model.items() if k not in ("coef", "intercept")}
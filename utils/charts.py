@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from utils.timing import timed
+
+# Roughly one point per horizontal pixel of a wide chart; anything beyond
+# this is invisible on screen but still shipped to the browser as JSON.
+CHART_MAX_POINTS = 1500
+
+RESAMPLE_FREQS = {
+    "Daily": "D",
+    "Weekly": "W",
+    "Monthly": "ME",
+}
+
+
+def _numeric_x(values: pd.Series) -> np.ndarray:
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype("int64").to_numpy(dtype=float)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=float)
+    # Categorical axes (e.g. "2025-01" month labels) are evenly spaced
+    return np.arange(len(values), dtype=float)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: picks n_out points that preserve the
+    visual shape of the series. Returns positional indices, always keeping
+    the first and last point.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype=int)
+    keep[0] = 0
+    keep[-1] = n - 1
+
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        nxt_start, nxt_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[nxt_start:nxt_end].mean()
+        avg_y = y[nxt_start:nxt_end].mean()
+
+        bx = x[start:end]
+        by = y[start:end]
+        area = np.abs(
+            (x[prev] - avg_x) * (by - y[prev])
+            - (x[prev] - bx) * (avg_y - y[prev])
+        )
+        prev = start + int(area.argmax())
+        keep[i + 1] = prev
+
+    return keep
+
+
+def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Keeps the minimum and maximum of each bucket, so spikes survive.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+
+    buckets = np.arange(n) * ((n_out - 2) // 2) // n
+    s = pd.Series(y)
+    grouped = s.groupby(buckets)
+    idx = np.concatenate([
+        grouped.idxmin().to_numpy(),
+        grouped.idxmax().to_numpy(),
+        [0, n - 1],
+    ])
+    return np.unique(idx)
+
+
+def downsample(
+    df: pd.DataFrame,
+    x: str,
+    y: str,
+    max_points: int = CHART_MAX_POINTS,
+    method: str = "lttb"
+) -> pd.DataFrame:
+    """
+    Reduces a line series to at most max_points rows (sorted by x).
+    method: "lttb" (shape-preserving) or "minmax" (extremes-preserving).
+    """
+    if len(df) <= max_points:
+        return df
+
+    d = df.sort_values(x) if not df[x].is_monotonic_increasing else df
+    yv = pd.to_numeric(d[y], errors="coerce").fillna(0).to_numpy(dtype=float)
+
+    if method == "minmax":
+        idx = minmax_indices(yv, max_points)
+    elif method == "lttb":
+        idx = lttb_indices(_numeric_x(d[x]), yv, max_points)
+    else:
+        raise ValueError(f"Unknown downsampling method: {method}")
+
+    return d.iloc[idx]
+
+
+def resample_series(
+    df: pd.DataFrame,
+    x: str,
+    y: str,
+    freq: str,
+    how: str = "last"
+) -> pd.DataFrame:
+    """
+    Aggregates a date-indexed series to a coarser period ("D", "W", "ME").
+    how="last" suits balances, how="sum" suits flows.
+    """
+    s = df.set_index(x)[y]
+    s = s.resample(freq).agg(how)
+    if how == "last":
+        s = s.ffill()
+    return s.dropna().reset_index()
+
+
+@timed()
+def line_chart(
+    df: pd.DataFrame,
+    x: str,
+    y: str,
+    max_points: int = CHART_MAX_POINTS,
+    method: str = "lttb",
+    **kwargs
+):
+    """
+    px.line over a downsampled copy of the series, so the figure payload
+    stays bounded whatever the history length.
+    """
+    return px.line(downsample(df, x, y, max_points, method), x=x, y=y, **kwargs)
+
+
+def band_chart(
+    df: pd.DataFrame,
+    x: str,
+    y: str,
+    bands: list[tuple[str, str, str]],
+    labels: dict | None = None,
+    hover_data: list[str] | None = None
+):
+    """
+    Line for y over shaded ranges; bands are (lower column, upper column,
+    legend name), widest first so narrower ones draw on top. hover_data
+    columns are shown when hovering the line.
+    """
+    fig = go.Figure()
+    for i, (lower, upper, name) in enumerate(bands):
+        opacity = 0.15 + 0.15 * i
+        fig.add_trace(go.Scatter(
+            x=df[x], y=df[upper], mode="lines", line={"width": 0},
+            showlegend=False, hoverinfo="skip"
+        ))
+        fig.add_trace(go.Scatter(
+            x=df[x], y=df[lower], mode="lines", line={"width": 0},
+            fill="tonexty", fillcolor=f"rgba(99, 110, 250, {opacity:.2f})", name=name
+        ))
+    hover_data = hover_data or []
+    fig.add_trace(go.Scatter(
+        x=df[x], y=df[y], mode="lines+markers", name=y,
+        customdata=df[hover_data].to_numpy() if hover_data else None,
+        hovertemplate="%{y:,.2f}" + "".join(
+            f"<br>{col}: %{{customdata[{i}]:,.2f}}" for i, col in enumerate(hover_data)
+        )
+    ))
+    labels = labels or {}
+    fig.update_layout(
+        xaxis_title=labels.get(x, x),
+        yaxis_title=labels.get(y, y),
+        hovermode="x unified"
+    )
+    return fig
@@ -79,6 +79,26 @@ def clean_description(text: str) -> str:
     text = re.sub(r"[^\w\s]", " ", text)
     return text
 
+
+# Words kept from a cleaned description to identify the merchant,
+# e.g. "TESCO STORES 5986 LONDON" -> "tesco stores london"
+MERCHANT_KEY_WORDS = 3
+
+
+def merchant_keys(descriptions: pd.Series) -> pd.Series:
+    """
+    Vectorised merchant key per description (store numbers, punctuation
+    and case removed), used to group transactions by merchant.
+    """
+    cleaned = (
+        descriptions.astype(str)
+        .str.lower()
+        .str.replace(r"\d+", " ", regex=True)
+        .str.replace(r"[^\w\s]", " ", regex=True)
+        .str.split()
+    )
+    return cleaned.str[:MERCHANT_KEY_WORDS].str.join(" ")
+
 # Categorisation logic
 
 def categorise(description: str, amount: float) -> str:
@@ -95,6 +115,30 @@ def categorise(description: str, amount: float) -> str:
 
     return "Other"
 
+
+def categorise_frame(df: pd.DataFrame, use_model: bool = True) -> pd.Series:
+    """
+    Categorises every row of a (description, amount) frame. Expenses the
+    keyword rules leave as "Other" are passed, as one batch, to the
+    learned categoriser when a model has been trained.
+    """
+    categories = pd.Series(
+        [
+            categorise(str(desc), float(amount))
+            for desc, amount in zip(df["description"], df["amount"])
+        ],
+        index=df.index,
+        dtype=object
+    )
+
+    if use_model:
+        from utils.categoriser import predict_categories
+
+        unmatched = (categories == "Other") & (pd.to_numeric(df["amount"], errors="coerce") < 0)
+        if unmatched.any():
+            categories[unmatched] = predict_categories(df.loc[unmatched, "description"])
+    return categories
+
 # Main cleaning pipeline
 
 def clean_and_prepare(df: pd.DataFrame) -> pd.DataFrame:
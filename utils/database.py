@@ -1,22 +1,121 @@
+import json
+import os
+import queue
 import sqlite3
+import threading
+import zlib
+from concurrent.futures import Future
 from pathlib import Path
 import pandas as pd
 
+from utils.timing import timed, count
+
 
 # Database configuration
-DB_DIR = Path(__file__).resolve().parents[1] / "db"
+DB_DIR = Path(
+    os.environ.get("SMARTSPEND_DB_DIR", Path(__file__).resolve().parents[1] / "db")
+)
 DB_PATH = DB_DIR / "smartspend.db"
 
+# Trigram FTS needs SQLite >= 3.34; older builds fall back to LIKE scans
+FTS_MIN_TERM = 3
+_fts_available = True
 
-def get_conn():
-    DB_DIR.mkdir(exist_ok=True)
-    return sqlite3.connect(DB_PATH)
+# Schema is created once per process (per database path)
+_initialised_paths: set[Path] = set()
 
+# Optional per-user sharding: with SMARTSPEND_SHARDS=N, each user's data
+# lives in DB_DIR/shards/shard_<user_id % N>.db, so uploads from users on
+# different shards never wait on the same write lock. DB_PATH stays the
+# catalog (users, sessions). Existing databases are split with
+# `python cli.py migrate-shards N`.
+SHARDS = int(os.environ.get("SMARTSPEND_SHARDS", "0"))
+SHARD_DIR_NAME = "shards"
 
-def init_db():
-    conn = get_conn()
+# Writes go through one writer thread per process (see run_write);
+# set SMARTSPEND_WRITE_QUEUE=0 to write from the calling thread instead
+WRITE_QUEUE = os.environ.get("SMARTSPEND_WRITE_QUEUE", "1") != "0"
+# How long a connection waits for another process's write lock
+BUSY_TIMEOUT_SECONDS = float(os.environ.get("SMARTSPEND_BUSY_TIMEOUT", "30"))
+# Most queued writes committed together in one transaction
+WRITE_BATCH_MAX = 64
+
+# Large text values (receipt OCR text) are stored zlib-compressed, primed
+# with words common on receipts; shorter ones stay plain TEXT
+COMPRESS_MIN_CHARS = 128
+_TEXT_ZDICT = (
+    b"SUBTOTAL TOTAL VAT NO BALANCE DUE AMOUNT DUE CHANGE DUE CARD PAYMENT "
+    b"VISA DEBIT CONTACTLESS MASTERCARD CASH CLUBCARD NECTAR POINTS SAVING "
+    b"DISCOUNT MULTIBUY PROMO OFFER PRICE QTY kg @ /kg x THANK YOU FOR "
+    b"SHOPPING RECEIPT STORE TEL "
+)
+# First byte of a compressed value; a new dictionary gets a new format
+_TEXT_FORMAT = b"\x01"
+
+# Archived transactions (see archive_transactions): months older than
+# this are moved out of the transactions table by `cli.py compact`
+ARCHIVE_AFTER_MONTHS = 24
+ARCHIVE_COLUMNS = ["id", "date", "description", "amount"]
+
+# user_id -> (archive signature, unpacked archived rows). The signature
+# only changes when months are archived, so uploads of new statements
+# reuse the unpacked rows.
+_archive_cache: dict[int, tuple[tuple, pd.DataFrame]] = {}
+_archive_cache_lock = threading.Lock()
+
+
+def shard_path(user_id: int, shards: int) -> Path:
+    return DB_DIR / SHARD_DIR_NAME / f"shard_{user_id % shards:03d}.db"
+
+
+def db_path_for(user_id: int | None = None) -> Path:
+    """
+    Database file holding user_id's data; the catalog for user_id=None or
+    when sharding is off.
+    """
+    if SHARDS and user_id is not None:
+        return shard_path(user_id, SHARDS)
+    return DB_PATH
+
+
+def _connect(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS)
+
+
+def get_conn(user_id: int | None = None):
+    return _connect(db_path_for(user_id))
+
+
+def init_db(user_id: int | None = None):
+    """
+    Creates the schema of the database holding `user_id`'s data (the
+    catalog when user_id is None), once per process and path.
+    """
+    path = db_path_for(user_id)
+    if path in _initialised_paths and path.exists():
+        return
+
+    conn = _connect(path)
     cur = conn.cursor()
 
+    # WAL lets readers keep reading their snapshot while a write commits
+    cur.execute("PRAGMA journal_mode=WAL")
+
+    if path == DB_PATH:
+        _init_catalog(cur)
+    if not SHARDS or path != DB_PATH:
+        _init_user_data(cur)
+
+    conn.commit()
+    conn.close()
+    _initialised_paths.add(path)
+
+
+def _init_catalog(cur):
+    """
+    Accounts and login sessions (always in DB_PATH).
+    """
     cur.execute("""
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -27,7 +126,33 @@ def init_db():
         )
     """)
 
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            token_hash TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_sessions_expires
+        ON sessions(expires_at)
+    """)
+
+
+def _add_column(cur, table: str, column: str, decl: str):
+    columns = {r[1] for r in cur.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
 
+def _init_user_data(cur):
+    """
+    Per-user data: transactions, receipts and everything derived from them
+    (in DB_PATH, or in the user's shard file).
+    """
     cur.execute("""
         CREATE TABLE IF NOT EXISTS transactions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -48,9 +173,14 @@ def init_db():
             filename TEXT,
             ocr_text TEXT,
             created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            image_sha256 TEXT,
+            parser_version INTEGER,
             FOREIGN KEY(transaction_id) REFERENCES transactions(id)
         )
     """)
+    # Databases created before receipt images were kept / parses versioned
+    _add_column(cur, "receipts", "image_sha256", "TEXT")
+    _add_column(cur, "receipts", "parser_version", "INTEGER")
 
     cur.execute("""
         CREATE TABLE IF NOT EXISTS receipt_items (
@@ -64,8 +194,475 @@ def init_db():
         )
     """)
 
-    conn.commit()
-    conn.close()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS anomaly_models (
+            user_id INTEGER PRIMARY KEY,
+            fitted_at INTEGER NOT NULL,
+            n_rows INTEGER NOT NULL,
+            threshold REAL NOT NULL,
+            feature_version INTEGER NOT NULL,
+            model BLOB NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS anomaly_scores (
+            transaction_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            FOREIGN KEY(transaction_id) REFERENCES transactions(id)
+        )
+    """)
+
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_anomaly_scores_user
+        ON anomaly_scores(user_id)
+    """)
+
+    # Bumped on every write so caches and snapshots can detect stale data
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_date
+        ON transactions(user_id, date)
+    """)
+
+    # Detected recurring payments; recurring_scans records the data
+    # version each user's series were detected from
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS recurring_series (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            merchant_key TEXT NOT NULL,
+            description TEXT,
+            cadence TEXT NOT NULL,
+            interval_days REAL NOT NULL,
+            amount REAL NOT NULL,
+            n_payments INTEGER NOT NULL,
+            first_date TEXT NOT NULL,
+            last_date TEXT NOT NULL,
+            next_date TEXT NOT NULL,
+            active INTEGER NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_recurring_user_merchant
+        ON recurring_series(user_id, merchant_key)
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS recurring_scans (
+            user_id INTEGER PRIMARY KEY,
+            data_version INTEGER NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+
+    # SARIMAX orders chosen for each user's balance series; forecasts
+    # reuse them and only refit the parameters
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS forecast_orders (
+            user_id INTEGER PRIMARY KEY,
+            arima_order TEXT NOT NULL,
+            seasonal_order TEXT NOT NULL,
+            aic REAL,
+            backtest_mae REAL,
+            n_months INTEGER NOT NULL,
+            evaluated INTEGER NOT NULL,
+            selected_at INTEGER NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+
+    # Transactions moved out of the hot table, one row per user, month and
+    # category: the totals stay queryable in SQL and the rows themselves
+    # are kept as a compressed column payload
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS transaction_archive (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            category TEXT NOT NULL,
+            n_rows INTEGER NOT NULL,
+            total REAL NOT NULL,
+            money_out REAL NOT NULL,
+            payload BLOB NOT NULL,
+            PRIMARY KEY (user_id, month, category)
+        ) WITHOUT ROWID
+    """)
+
+    _init_search_index(cur)
+
+
+# Text compression
+def _pack_text(text: str | None):
+    if text is None or len(text) < COMPRESS_MIN_CHARS:
+        return text
+    c = zlib.compressobj(9, zdict=_TEXT_ZDICT)
+    return _TEXT_FORMAT + c.compress(text.encode("utf-8")) + c.flush()
+
+
+def _unpack_text(value):
+    # Plain TEXT comes back as str, compressed values as bytes
+    if not isinstance(value, bytes):
+        return value
+    if value[:1] != _TEXT_FORMAT:
+        raise ValueError(f"Unknown text format {value[:1]!r}")
+    d = zlib.decompressobj(zdict=_TEXT_ZDICT)
+    return (d.decompress(value[1:]) + d.flush()).decode("utf-8")
+
+
+# Write coordination
+class _Writer:
+    """
+    Owns the process's write connection to one database file. Queued jobs
+    are drained in batches and committed together (group commit); each
+    job runs in its own savepoint, so a failing job is rolled back without
+    affecting the rest of its batch. A job that calls run_write itself is
+    run inline (see run_write).
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.jobs: queue.Queue = queue.Queue()
+        self.stats = {"jobs": 0, "batches": 0, "failed_jobs": 0, "failed_batches": 0}
+        self._conn = None
+        threading.Thread(
+            target=self._run, name=f"smartspend-writer-{path.stem}", daemon=True
+        ).start()
+
+    def submit(self, fn) -> Future:
+        fut = Future()
+        self.jobs.put((fn, fut))
+        return fut
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = _connect(self.path)
+            # Transactions are managed explicitly below
+            self._conn.isolation_level = None
+            # Safe with WAL: a crash can lose the last commits, never corrupt
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        return self._conn
+
+    def _run(self):
+        while True:
+            batch = [self.jobs.get()]
+            while len(batch) < WRITE_BATCH_MAX:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch: list[tuple]):
+        outcomes = []
+        try:
+            conn = self._connect()
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            _writing.current = (self.path, cur)
+            try:
+                for fn, _ in batch:
+                    cur.execute("SAVEPOINT job")
+                    try:
+                        outcomes.append((True, fn(cur)))
+                        cur.execute("RELEASE job")
+                    except Exception as e:
+                        cur.execute("ROLLBACK TO job")
+                        cur.execute("RELEASE job")
+                        outcomes.append((False, e))
+            finally:
+                _writing.current = None
+            cur.execute("COMMIT")
+        except Exception as e:
+            # Nothing in the batch was committed
+            if self._conn is not None and self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            self.stats["failed_batches"] += 1
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+
+        self.stats["batches"] += 1
+        self.stats["jobs"] += len(batch)
+        for (ok, value), (_, fut) in zip(outcomes, batch):
+            if ok:
+                fut.set_result(value)
+            else:
+                self.stats["failed_jobs"] += 1
+                fut.set_exception(value)
+
+
+# (database path, cursor) of the write job running on this thread, if any
+_writing = threading.local()
+
+# One writer per database file (catalog and each shard)
+_writers: dict[Path, _Writer] = {}
+_writers_pid = os.getpid()
+_writers_lock = threading.Lock()
+
+
+def _get_writer(path: Path) -> _Writer:
+    global _writers_pid
+    with _writers_lock:
+        # A forked child (CLI process pool) needs its own threads
+        if _writers_pid != os.getpid():
+            _writers.clear()
+            _writers_pid = os.getpid()
+        if path not in _writers:
+            _writers[path] = _Writer(path)
+        return _writers[path]
+
+
+def run_write(fn, user_id: int | None = None):
+    """
+    Runs fn(cursor) as one atomic write against the database holding
+    user_id's data (the catalog for None) and returns its result, or
+    raises its exception. With WRITE_QUEUE on, the call is executed by
+    that database's writer thread and committed together with other
+    queued writes, so concurrent sessions queue instead of failing with
+    "database is locked".
+
+    Called from inside another write job on the same database, fn runs
+    inline in a nested savepoint of that job, as part of its transaction;
+    queueing it would leave the writer thread waiting on itself. Writing
+    to a different database from inside a job raises ValueError.
+    """
+    init_db(user_id)
+    path = db_path_for(user_id)
+    current = getattr(_writing, "current", None)
+    if current is not None:
+        return _run_nested(fn, path, *current)
+    if not WRITE_QUEUE:
+        conn = get_conn(user_id)
+        _writing.current = (path, conn.cursor())
+        try:
+            result = fn(_writing.current[1])
+            conn.commit()
+            return result
+        finally:
+            _writing.current = None
+            conn.close()
+    return _get_writer(path).submit(fn).result()
+
+
+def _run_nested(fn, path: Path, job_path: Path, cur):
+    if path != job_path:
+        raise ValueError(
+            f"run_write for {path.name} called from a write job on {job_path.name}; "
+            "a job can only write to its own database"
+        )
+    cur.execute("SAVEPOINT nested")
+    try:
+        result = fn(cur)
+    except Exception:
+        cur.execute("ROLLBACK TO nested")
+        cur.execute("RELEASE nested")
+        raise
+    cur.execute("RELEASE nested")
+    return result
+
+
+def write_queue_stats() -> dict:
+    """
+    Jobs and group commits done by this process's writer threads.
+    """
+    stats = {"jobs": 0, "batches": 0, "failed_jobs": 0, "failed_batches": 0}
+    for writer in list(_writers.values()):
+        for key in stats:
+            stats[key] += writer.stats[key]
+    stats["writers"] = len(_writers)
+    stats["jobs_per_batch"] = round(stats["jobs"] / stats["batches"], 2) if stats["batches"] else None
+    return stats
+
+
+def _init_search_index(cur):
+    """
+    External-content trigram index over transactions.description,
+    kept in sync by triggers.
+    """
+    global _fts_available
+
+    exists = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'transactions_fts'"
+    ).fetchone()
+    if exists:
+        return
+
+    try:
+        cur.execute("""
+            CREATE VIRTUAL TABLE transactions_fts USING fts5(
+                description,
+                content='transactions',
+                content_rowid='id',
+                tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError:
+        _fts_available = False
+        return
+
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_ai
+        AFTER INSERT ON transactions BEGIN
+            INSERT INTO transactions_fts(rowid, description)
+            VALUES (new.id, new.description);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_ad
+        AFTER DELETE ON transactions BEGIN
+            INSERT INTO transactions_fts(transactions_fts, rowid, description)
+            VALUES ('delete', old.id, old.description);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_au
+        AFTER UPDATE OF description ON transactions BEGIN
+            INSERT INTO transactions_fts(transactions_fts, rowid, description)
+            VALUES ('delete', old.id, old.description);
+            INSERT INTO transactions_fts(rowid, description)
+            VALUES (new.id, new.description);
+        END
+    """)
+
+    # Index rows that existed before the search table was added
+    cur.execute("INSERT INTO transactions_fts(transactions_fts) VALUES ('rebuild')")
+
+
+# Shard migration
+# Rows of each per-user table that belong to :uid, in the attached
+# database {db}. Parents come first (copy order); deletes run in reverse.
+_USER_ROWS = {
+    "transactions": "user_id = :uid",
+    "receipts": "transaction_id IN (SELECT id FROM {db}.transactions WHERE user_id = :uid)",
+    "receipt_items": (
+        "receipt_id IN (SELECT r.id FROM {db}.receipts r "
+        "JOIN {db}.transactions t ON t.id = r.transaction_id WHERE t.user_id = :uid)"
+    ),
+    "anomaly_models": "user_id = :uid",
+    "anomaly_scores": "user_id = :uid",
+    "data_versions": "user_id = :uid",
+    "recurring_series": "user_id = :uid",
+    "recurring_scans": "user_id = :uid",
+    "forecast_orders": "user_id = :uid",
+    "transaction_archive": "user_id = :uid",
+}
+
+
+def _table_columns(cur, db: str, table: str) -> list[str]:
+    return [r[1] for r in cur.execute(f"PRAGMA {db}.table_info({table})")]
+
+
+def _delete_user_rows(cur, db: str, user_id: int, tables: list[str]):
+    for table in reversed(tables):
+        where = _USER_ROWS[table].format(db=db)
+        cur.execute(f"DELETE FROM {db}.{table} WHERE {where}", {"uid": user_id})
+
+
+def migrate_to_shards(shards: int, drop_source: bool = False) -> dict:
+    """
+    Splits per-user data from DB_PATH into `shards` shard files, keeping
+    row ids so receipts, items and anomaly scores still line up. Safe to
+    re-run: a user's rows already in their shard are replaced by the
+    source rows (users with no source rows left are skipped). With
+    drop_source, copied rows are then deleted from DB_PATH.
+
+    Rows no user owns (receipts and items whose transaction was deleted,
+    rows of deleted users) are not copied; they stay in DB_PATH and are
+    counted per table in the result's "orphaned".
+
+    Run with the app stopped, then start it with SMARTSPEND_SHARDS=shards.
+    """
+    if shards < 1:
+        raise ValueError("shards must be at least 1")
+
+    init_db()
+    src = _connect(DB_PATH)
+    present = {
+        r[0] for r in src.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    }
+    src.close()
+    tables = [t for t in _USER_ROWS if t in present]
+
+    by_shard: dict[Path, list[int]] = {}
+    for user_id in list_user_ids():
+        by_shard.setdefault(shard_path(user_id, shards), []).append(user_id)
+
+    copied = {t: 0 for t in tables}
+    expected = {t: 0 for t in tables}
+    for path, user_ids in sorted(by_shard.items()):
+        conn = _connect(path)
+        cur = conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        _init_user_data(cur)
+        conn.commit()
+
+        cur.execute("ATTACH DATABASE ? AS src", (str(DB_PATH),))
+        for user_id in user_ids:
+            params = {"uid": user_id}
+            counts = {
+                table: cur.execute(
+                    f"SELECT COUNT(*) FROM src.{table} WHERE {_USER_ROWS[table].format(db='src')}",
+                    params
+                ).fetchone()[0]
+                for table in tables
+            }
+            if not any(counts.values()):
+                # Nothing left in the source (e.g. already migrated with
+                # drop_source): keep what the shard holds
+                continue
+
+            _delete_user_rows(cur, "main", user_id, tables)
+            for table in tables:
+                src_cols = set(_table_columns(cur, "src", table))
+                cols = ", ".join(c for c in _table_columns(cur, "main", table) if c in src_cols)
+                where = _USER_ROWS[table].format(db="src")
+                expected[table] += counts[table]
+                copied[table] += cur.execute(
+                    f"INSERT INTO main.{table} ({cols}) SELECT {cols} FROM src.{table} WHERE {where}",
+                    params
+                ).rowcount
+        conn.commit()
+        cur.execute("DETACH DATABASE src")
+        conn.close()
+
+    if copied != expected:
+        raise ValueError(f"Shard copy incomplete: copied {copied}, expected {expected}")
+
+    src = _connect(DB_PATH)
+    orphaned = {}
+    for table in tables:
+        (total,) = src.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+        if total > expected[table]:
+            orphaned[table] = total - expected[table]
+    src.close()
+
+    if drop_source:
+        conn = _connect(DB_PATH)
+        cur = conn.cursor()
+        for user_ids in by_shard.values():
+            for user_id in user_ids:
+                _delete_user_rows(cur, "main", user_id, tables)
+        conn.commit()
+        conn.close()
+
+    return {
+        "shards": shards,
+        "files": [str(p) for p in sorted(by_shard)],
+        "users": sum(len(u) for u in by_shard.values()),
+        "rows": copied,
+        "orphaned": orphaned,
+    }
 
 
 # Bank CSV normalisation
@@ -91,50 +688,124 @@ def _clean_colname(c: str) -> str:
     return str(c).strip().lower().replace("\ufeff", "")
 
 
-def _find_column(df: pd.DataFrame, options: list[str]) -> str | None:
+# Date formats tried (in order) when a new bank layout is first seen.
+# Day-first formats come before month-first ones, as these are UK banks.
+DATE_FORMATS = [
+    "%d-%b-%y", "%d-%b-%Y", "%d %b %Y", "%d %b %y",
+    "%d/%m/%Y", "%d/%m/%y", "%d.%m.%Y", "%d-%m-%Y",
+    "%Y-%m-%d", "%Y/%m/%d",
+    "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%d/%m/%Y %H:%M:%S",
+    "%m/%d/%Y", "%m/%d/%y",
+]
+DATE_SAMPLE_SIZE = 200
+
+# Header fingerprint -> resolved column positions and date format
+BANK_PROFILES: dict[tuple[str, ...], dict] = {}
+BANK_PROFILE_LIMIT = 256
+
+
+def _find_column(columns: list[str], options: list[str]) -> int | None:
+    """
+    Position of the first column matching an option (options in priority order).
+    """
     for opt in options:
-        opt = opt.lower()
-        for col in df.columns:
-            if opt == col.lower() or opt in col.lower():
-                return col
+        for i, col in enumerate(columns):
+            if opt in col:
+                return i
     return None
 
 
+def _detect_date_format(values: pd.Series) -> str | None:
+    sample = values.dropna().astype(str).str.strip()
+    sample = sample[sample != ""].drop_duplicates().head(DATE_SAMPLE_SIZE)
+    if sample.empty:
+        return None
+
+    for fmt in DATE_FORMATS:
+        if pd.to_datetime(sample, format=fmt, errors="coerce").notna().all():
+            return fmt
+    return None
+
+
+def resolve_bank_profile(df: pd.DataFrame) -> dict:
+    """
+    Column positions for each role (date, description, amount, debit,
+    credit) plus the explicit date format, cached per header fingerprint
+    so repeat uploads from a known bank skip detection entirely.
+    """
+    fingerprint = tuple(_clean_colname(c) for c in df.columns)
+
+    profile = BANK_PROFILES.get(fingerprint)
+    if profile is not None:
+        return profile
+
+    profile = {
+        role: _find_column(list(fingerprint), [o.lower() for o in options])
+        for role, options in COLUMN_MAP.items()
+    }
+    profile["date_format"] = (
+        _detect_date_format(df.iloc[:, profile["date"]])
+        if profile["date"] is not None else None
+    )
+
+    if len(BANK_PROFILES) >= BANK_PROFILE_LIMIT:
+        BANK_PROFILES.clear()
+    BANK_PROFILES[fingerprint] = profile
+    return profile
+
+
+def _parse_dates(values: pd.Series, fmt: str | None) -> pd.Series:
+    if fmt:
+        parsed = pd.to_datetime(values, format=fmt, errors="coerce")
+        failed = parsed.isna() & values.notna()
+        # Same header but a different date style: fall back to inference
+        if failed.sum() * 2 <= values.notna().sum():
+            # A few odd cells (footers, "Balance brought forward") are
+            # inferred alone, in the profile's day/month order
+            if failed.any():
+                parsed[failed] = pd.to_datetime(
+                    values[failed], errors="coerce", format="mixed",
+                    dayfirst=fmt.startswith("%d")
+                )
+            return parsed
+    return pd.to_datetime(values, errors="coerce")
+
+
+@timed()
 def normalise_bank_csv(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df.columns = [_clean_colname(c) for c in df.columns]
+    profile = resolve_bank_profile(df)
 
-    date_col = _find_column(df, COLUMN_MAP["date"])
-    desc_col = _find_column(df, COLUMN_MAP["description"])
-    amount_col = _find_column(df, COLUMN_MAP["amount"])
-    debit_col = _find_column(df, COLUMN_MAP["debit"])
-    credit_col = _find_column(df, COLUMN_MAP["credit"])
+    date_col = profile["date"]
+    desc_col = profile["description"]
+    amount_col = profile["amount"]
+    debit_col = profile["debit"]
+    credit_col = profile["credit"]
 
-    if not date_col or not desc_col:
+    if date_col is None or desc_col is None:
         raise ValueError("CSV must include a date and description column")
 
-    if amount_col:
-        df["amount"] = pd.to_numeric(df[amount_col], errors="coerce")
-    elif debit_col or credit_col:
-        debit = pd.to_numeric(df[debit_col], errors="coerce").fillna(0) if debit_col else 0
-        credit = pd.to_numeric(df[credit_col], errors="coerce").fillna(0) if credit_col else 0
-        df["amount"] = credit - debit
+    if amount_col is not None:
+        amount = pd.to_numeric(df.iloc[:, amount_col], errors="coerce")
+    elif debit_col is not None or credit_col is not None:
+        debit = pd.to_numeric(df.iloc[:, debit_col], errors="coerce").fillna(0) if debit_col is not None else 0
+        credit = pd.to_numeric(df.iloc[:, credit_col], errors="coerce").fillna(0) if credit_col is not None else 0
+        amount = credit - debit
     else:
         raise ValueError("No usable amount column found")
 
-    df["date"] = pd.to_datetime(df[date_col], errors="coerce")
-    df["description"] = df[desc_col].astype(str).fillna("")
-
-    out = df[["date", "description", "amount"]].copy()
+    out = pd.DataFrame({
+        "date": _parse_dates(df.iloc[:, date_col], profile["date_format"]),
+        "description": df.iloc[:, desc_col].astype(str).fillna(""),
+        "amount": amount,
+    })
     out = out.dropna(subset=["date", "amount"])
 
     return out
 
 
 # Transaction persistence (user-scoped)
+@timed()
 def write_transactions(df: pd.DataFrame, user_id: int, replace_existing: bool = True):
-    init_db()
-
     df = df.copy()
 
     df["date"] = pd.to_datetime(df["date"], errors="coerce")
@@ -151,31 +822,68 @@ def write_transactions(df: pd.DataFrame, user_id: int, replace_existing: bool =
     df["user_id"] = user_id
 
     df = df[["user_id", "date", "description", "amount", "category", "month"]]
+    rows = df.values.tolist()
 
-    conn = get_conn()
-    cur = conn.cursor()
+    def write(cur):
+        if replace_existing:
+            cur.execute(
+                "DELETE FROM transactions WHERE user_id = ?",
+                (user_id,)
+            )
+            cur.execute(
+                "DELETE FROM anomaly_scores WHERE user_id = ?",
+                (user_id,)
+            )
+            cur.execute(
+                "DELETE FROM transaction_archive WHERE user_id = ?",
+                (user_id,)
+            )
 
-    if replace_existing:
-        cur.execute(
-            "DELETE FROM transactions WHERE user_id = ?",
-            (user_id,)
+        cur.executemany(
+            """
+            INSERT INTO transactions (user_id, date, description, amount, category, month)
+            VALUES (?,?,?,?,?,?)
+            """,
+            rows
         )
+        _bump_data_version(cur, user_id)
 
-    cur.executemany(
+    run_write(write, user_id)
+    count("db.rows_written", len(df))
+
+
+def _bump_data_version(cur, user_id: int):
+    cur.execute(
         """
-        INSERT INTO transactions (user_id, date, description, amount, category, month)
-        VALUES (?,?,?,?,?,?)
+        INSERT INTO data_versions(user_id, version) VALUES (?, 1)
+        ON CONFLICT(user_id) DO UPDATE SET version = version + 1
         """,
-        df.values.tolist()
+        (user_id,)
     )
 
-    conn.commit()
+
+def get_data_version(user_id: int) -> int:
+    """
+    Increases whenever the user's transactions change (0 = never written).
+    """
+    init_db(user_id)
+    conn = get_conn(user_id)
+    row = conn.execute(
+        "SELECT version FROM data_versions WHERE user_id = ?",
+        (user_id,)
+    ).fetchone()
     conn.close()
+    return row[0] if row else 0
 
 
-def load_transactions(user_id: int) -> pd.DataFrame:
-    init_db()
-    conn = get_conn()
+@timed()
+def load_transactions(user_id: int, include_archive: bool = True) -> pd.DataFrame:
+    """
+    The user's full history, archived months included unless
+    include_archive is False.
+    """
+    init_db(user_id)
+    conn = get_conn(user_id)
     df = pd.read_sql_query(
         """
         SELECT id, date, description, amount, category, month
@@ -186,56 +894,659 @@ def load_transactions(user_id: int) -> pd.DataFrame:
         conn,
         params=(user_id,)
     )
+    old = _load_archive(conn, user_id) if include_archive else None
     conn.close()
+    if old is not None:
+        # Concatenating an empty hot frame would make id an object column
+        df = pd.concat([old, df], ignore_index=True) if len(df) else old.copy()
+        df = df.sort_values(["date", "id"], ignore_index=True)
+    count("db.rows_loaded", len(df))
     return df
 
 
-# Receipt handling
-def insert_receipt(transaction_id: int, filename: str, ocr_text: str) -> int:
+def count_transactions(user_id: int, include_archive: bool = True) -> int:
+    """
+    Number of the user's transactions, archived ones included unless
+    include_archive is False (as search_transactions does not see them).
+    """
+    init_db(user_id)
+    conn = get_conn(user_id)
+    archived = (
+        "(SELECT COALESCE(SUM(n_rows), 0) FROM transaction_archive WHERE user_id = :uid)"
+        if include_archive else "0"
+    )
+    (n,) = conn.execute(
+        f"SELECT (SELECT COUNT(*) FROM transactions WHERE user_id = :uid) + {archived}",
+        {"uid": user_id}
+    ).fetchone()
+    conn.close()
+    return n
+
+
+# Transaction archive
+def _pack_archive(rows: pd.DataFrame) -> bytes:
+    payload = json.dumps({c: rows[c].tolist() for c in ARCHIVE_COLUMNS}, separators=(",", ":"))
+    return zlib.compress(payload.encode("utf-8"), 9)
+
+
+def _unpack_archives(archived: list[tuple]) -> pd.DataFrame:
+    """
+    One frame from (month, category, payload) archive rows.
+    """
+    columns = {c: [] for c in ARCHIVE_COLUMNS + ["category", "month"]}
+    for month, category, payload in archived:
+        part = json.loads(zlib.decompress(payload))
+        for c in ARCHIVE_COLUMNS:
+            columns[c].extend(part[c])
+        columns["category"].extend([category] * len(part["id"]))
+        columns["month"].extend([month] * len(part["id"]))
+    df = pd.DataFrame(columns)[["id", "date", "description", "amount", "category", "month"]]
+    return df.astype({"id": "int64", "amount": "float64"})
+
+
+def _load_archive(conn, user_id: int) -> pd.DataFrame | None:
+    """
+    The user's archived rows (None when there are none), decompressed
+    only when the archive has changed since the last call.
+    """
+    signature = conn.execute(
+        """
+        SELECT COUNT(*), COALESCE(SUM(n_rows), 0), COALESCE(SUM(total), 0)
+        FROM transaction_archive WHERE user_id = ?
+        """,
+        (user_id,)
+    ).fetchone()
+    if not signature[0]:
+        return None
+
+    with _archive_cache_lock:
+        cached = _archive_cache.get(user_id)
+    if cached is not None and cached[0] == signature:
+        count("db.archive_cache_hits")
+        return cached[1]
+
+    archived = conn.execute(
+        "SELECT month, category, payload FROM transaction_archive WHERE user_id = ?",
+        (user_id,)
+    ).fetchall()
+    old = _unpack_archives(archived)
+    with _archive_cache_lock:
+        _archive_cache[user_id] = (signature, old)
+    return old
+
+
+@timed()
+def archive_transactions(user_id: int, older_than_months: int = ARCHIVE_AFTER_MONTHS) -> int:
+    """
+    Moves the user's transactions from months more than
+    older_than_months before the current month into transaction_archive,
+    merging with months archived earlier. Rows with receipts stay in
+    place. Ids are kept, so anomaly scores still line up; archived rows
+    are still returned by load_transactions but no longer searched.
+    Returns the number of rows moved.
+    """
+    cutoff = (pd.Timestamp.today().to_period("M") - older_than_months).strftime("%Y-%m")
+
+    def write(cur):
+        moving = pd.DataFrame(
+            cur.execute(
+                """
+                SELECT id, date, description, amount, category, month
+                FROM transactions t
+                WHERE user_id = ? AND month < ?
+                  AND NOT EXISTS (SELECT 1 FROM receipts r WHERE r.transaction_id = t.id)
+                """,
+                (user_id, cutoff)
+            ).fetchall(),
+            columns=["id", "date", "description", "amount", "category", "month"]
+        )
+        if moving.empty:
+            return 0
+
+        archived = []
+        for (month, category), rows in moving.groupby(["month", "category"], sort=False):
+            previous = cur.execute(
+                """
+                SELECT payload FROM transaction_archive
+                WHERE user_id = ? AND month = ? AND category = ?
+                """,
+                (user_id, month, category)
+            ).fetchone()
+            if previous:
+                rows = pd.concat([_unpack_archives([(month, category, previous[0])]), rows])
+            rows = rows.sort_values(["date", "id"])
+            archived.append((
+                user_id, month, category, len(rows),
+                float(rows["amount"].sum()),
+                float(rows["amount"].clip(upper=0).sum()),
+                _pack_archive(rows),
+            ))
+
+        cur.executemany(
+            """
+            INSERT OR REPLACE INTO transaction_archive
+                (user_id, month, category, n_rows, total, money_out, payload)
+            VALUES (?,?,?,?,?,?,?)
+            """,
+            archived
+        )
+        cur.executemany(
+            "DELETE FROM transactions WHERE id = ?",
+            [(int(i),) for i in moving["id"]]
+        )
+        _bump_data_version(cur, user_id)
+        return len(moving)
+
+    moved = run_write(write, user_id)
+    count("db.rows_archived", moved)
+    return moved
+
+
+def load_archive_totals(user_id: int) -> pd.DataFrame:
+    """
+    Archived months per category: n_rows, total and money_out, without
+    decompressing the rows.
+    """
+    init_db(user_id)
+    conn = get_conn(user_id)
+    df = pd.read_sql_query(
+        """
+        SELECT month, category, n_rows, total, money_out
+        FROM transaction_archive
+        WHERE user_id = ?
+        ORDER BY month, category
+        """,
+        conn,
+        params=(user_id,)
+    )
+    conn.close()
+    return df
+
+
+def database_files() -> list[Path]:
+    """
+    Every database file in use: the catalog plus, with sharding, each
+    user's shard.
+    """
+    return sorted({DB_PATH, *(db_path_for(uid) for uid in list_user_ids())})
+
+
+def _file_bytes(path: Path) -> int:
+    # Recent commits may still sit in the write-ahead log
+    wal = path.with_name(path.name + "-wal")
+    return sum(p.stat().st_size for p in (path, wal) if p.exists())
+
+
+@timed()
+def compact_database(path: Path, vacuum: bool = True) -> dict:
+    """
+    Compresses receipt OCR text still stored as plain TEXT and, with
+    vacuum, rebuilds the file so freed pages are returned to the OS. Run
+    with the app stopped: VACUUM needs the database to itself.
+    """
+    before = _file_bytes(path)
+    conn = _connect(path)
+    rows = []
+    # The catalog of a sharded database holds no receipts
+    has_receipts = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'receipts'"
+    ).fetchone()
+    if has_receipts:
+        rows = conn.execute(
+            """
+            SELECT id, ocr_text FROM receipts
+            WHERE typeof(ocr_text) = 'text' AND length(ocr_text) >= ?
+            """,
+            (COMPRESS_MIN_CHARS,)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE receipts SET ocr_text = ? WHERE id = ?",
+            [(_pack_text(text), rid) for rid, text in rows]
+        )
+        conn.commit()
+    if vacuum:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+    conn.close()
+    return {
+        "file": str(path),
+        "receipts_compressed": len(rows),
+        "bytes_before": before,
+        "bytes_after": _file_bytes(path),
+    }
+
+
+# Transaction search
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+@timed()
+def search_transactions(user_id: int, query: str = "", limit: int = 50) -> pd.DataFrame:
+    """
+    Typeahead search over transaction descriptions, newest first.
+
+    Terms of FTS_MIN_TERM characters or more go through the trigram index;
+    shorter terms are matched as substrings on the already-narrowed rows.
+    An empty query returns the most recent transactions.
+    """
+    init_db(user_id)
+
+    terms = query.split()
+    long_terms = [t for t in terms if len(t) >= FTS_MIN_TERM]
+    short_terms = [t for t in terms if len(t) < FTS_MIN_TERM]
+
+    if not _fts_available:
+        short_terms = terms
+        long_terms = []
+
+    where = ["t.user_id = ?"]
+    params: list = [user_id]
+
+    if long_terms:
+        source = "transactions_fts f JOIN transactions t ON t.id = f.rowid"
+        where.append("transactions_fts MATCH ?")
+        params.append(" AND ".join(_fts_phrase(t) for t in long_terms))
+    else:
+        source = "transactions t"
+
+    for t in short_terms:
+        where.append("t.description LIKE ? ESCAPE '\\'")
+        escaped = t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params.append(f"%{escaped}%")
+
+    params.append(limit)
+
+    conn = get_conn(user_id)
+    df = pd.read_sql_query(
+        f"""
+        SELECT t.id, t.date, t.description, t.amount, t.category, t.month
+        FROM {source}
+        WHERE {" AND ".join(where)}
+        ORDER BY t.date DESC, t.id DESC
+        LIMIT ?
+        """,
+        conn,
+        params=params
+    )
+    conn.close()
+    return df
+
+
+def get_user_id(username: str) -> int | None:
     init_db()
     conn = get_conn()
-    cur = conn.cursor()
+    row = conn.execute(
+        "SELECT id FROM users WHERE username = ?",
+        (username,)
+    ).fetchone()
+    conn.close()
+    return row[0] if row else None
 
-    cur.execute(
-        "INSERT INTO receipts(transaction_id, filename, ocr_text) VALUES (?,?,?)",
-        (transaction_id, filename, ocr_text)
-    )
 
-    receipt_id = cur.lastrowid
-    conn.commit()
+def list_user_ids() -> list[int]:
+    init_db()
+    conn = get_conn()
+    ids = [r[0] for r in conn.execute("SELECT id FROM users ORDER BY id")]
     conn.close()
-    return receipt_id
+    return ids
+
+
+# Session tokens
+def insert_session(token_hash: str, user_id: int, created_at: int, expires_at: int):
+    run_write(lambda cur: cur.execute(
+        """
+        INSERT INTO sessions(token_hash, user_id, created_at, expires_at)
+        VALUES (?,?,?,?)
+        """,
+        (token_hash, user_id, created_at, expires_at)
+    ))
 
 
-def insert_receipt_items(receipt_id: int, items: list[dict]):
+def get_session_user(token_hash: str, now: int) -> tuple | None:
+    """
+    Returns (user_id, username, first_name, last_name) for a live session.
+    """
     init_db()
     conn = get_conn()
-    cur = conn.cursor()
+    row = conn.execute(
+        """
+        SELECT u.id, u.username, u.first_name, u.last_name
+        FROM sessions s
+        JOIN users u ON u.id = s.user_id
+        WHERE s.token_hash = ? AND s.expires_at > ?
+        """,
+        (token_hash, now)
+    ).fetchone()
+    conn.close()
+    return row
 
-    for it in items:
-        cur.execute(
+
+def delete_session(token_hash: str):
+    run_write(lambda cur: cur.execute(
+        "DELETE FROM sessions WHERE token_hash = ?", (token_hash,)
+    ))
+
+
+def purge_expired_sessions(now: int) -> int:
+    return run_write(lambda cur: cur.execute(
+        "DELETE FROM sessions WHERE expires_at <= ?", (now,)
+    ).rowcount)
+
+
+# Anomaly models and scores
+def save_anomaly_model(
+    user_id: int,
+    model: bytes,
+    threshold: float,
+    n_rows: int,
+    fitted_at: int,
+    feature_version: int
+):
+    run_write(lambda cur: cur.execute(
+        """
+        INSERT OR REPLACE INTO anomaly_models
+            (user_id, fitted_at, n_rows, threshold, feature_version, model)
+        VALUES (?,?,?,?,?,?)
+        """,
+        (user_id, fitted_at, n_rows, threshold, feature_version, model)
+    ), user_id)
+
+
+def load_anomaly_model(user_id: int) -> dict | None:
+    init_db(user_id)
+    conn = get_conn(user_id)
+    row = conn.execute(
+        """
+        SELECT fitted_at, n_rows, threshold, feature_version, model
+        FROM anomaly_models
+        WHERE user_id = ?
+        """,
+        (user_id,)
+    ).fetchone()
+    conn.close()
+    if not row:
+        return None
+    keys = ["fitted_at", "n_rows", "threshold", "feature_version", "model"]
+    return dict(zip(keys, row))
+
+
+def save_anomaly_scores(user_id: int, scores: list[tuple[int, float]], replace_all: bool = False):
+    """
+    scores: (transaction_id, score) pairs. replace_all drops the user's
+    previous scores first (after a refit).
+    """
+    rows = [(tid, user_id, score) for tid, score in scores]
+
+    def write(cur):
+        if replace_all:
+            cur.execute("DELETE FROM anomaly_scores WHERE user_id = ?", (user_id,))
+        cur.executemany(
             """
-            INSERT INTO receipt_items(receipt_id, item_name, qty, unit_price, total)
-            VALUES (?,?,?,?,?)
+            INSERT OR REPLACE INTO anomaly_scores(transaction_id, user_id, score)
+            VALUES (?,?,?)
+            """,
+            rows
+        )
+
+    run_write(write, user_id)
+
+
+def load_anomaly_scores(user_id: int) -> pd.Series:
+    """
+    Stored scores indexed by transaction id (lower = more unusual).
+    """
+    init_db(user_id)
+    conn = get_conn(user_id)
+    df = pd.read_sql_query(
+        "SELECT transaction_id, score FROM anomaly_scores WHERE user_id = ?",
+        conn,
+        params=(user_id,)
+    )
+    conn.close()
+    return df.set_index("transaction_id")["score"]
+
+
+# Recurring payments
+RECURRING_COLUMNS = [
+    "merchant_key", "description", "cadence", "interval_days", "amount",
+    "n_payments", "first_date", "last_date", "next_date", "active",
+]
+
+
+def save_recurring_series(user_id: int, series: pd.DataFrame, data_version: int):
+    """
+    Replaces the user's stored series with `series` (RECURRING_COLUMNS),
+    detected from transactions at `data_version`.
+    """
+    rows = [(user_id, *row) for row in series[RECURRING_COLUMNS].itertuples(index=False)]
+
+    def write(cur):
+        cur.execute("DELETE FROM recurring_series WHERE user_id = ?", (user_id,))
+        cur.executemany(
+            f"""
+            INSERT INTO recurring_series (user_id, {", ".join(RECURRING_COLUMNS)})
+            VALUES (?{",?" * len(RECURRING_COLUMNS)})
             """,
-            (
-                receipt_id,
-                it.get("item_name"),
-                it.get("qty"),
-                it.get("unit_price"),
-                it.get("total"),
+            rows
+        )
+        cur.execute(
+            "INSERT OR REPLACE INTO recurring_scans(user_id, data_version) VALUES (?,?)",
+            (user_id, data_version)
+        )
+
+    run_write(write, user_id)
+
+
+def load_recurring_series(user_id: int) -> tuple[int | None, pd.DataFrame]:
+    """
+    (data version the series were detected from, series). The version is
+    None when the user has never been scanned.
+    """
+    init_db(user_id)
+    conn = get_conn(user_id)
+    row = conn.execute(
+        "SELECT data_version FROM recurring_scans WHERE user_id = ?",
+        (user_id,)
+    ).fetchone()
+    df = pd.read_sql_query(
+        f"""
+        SELECT {", ".join(RECURRING_COLUMNS)}
+        FROM recurring_series
+        WHERE user_id = ?
+        ORDER BY active DESC, amount ASC
+        """,
+        conn,
+        params=(user_id,)
+    )
+    conn.close()
+    df["active"] = df["active"].astype(bool)
+    return (row[0] if row else None), df
+
+
+# Forecast model orders
+def save_forecast_order(user_id: int, choice: dict):
+    """
+    Stores a select_order() result: order and seasonal_order tuples, aic,
+    backtest_mae, n_months, evaluated and selected_at.
+    """
+    run_write(lambda cur: cur.execute(
+        """
+        INSERT OR REPLACE INTO forecast_orders
+            (user_id, arima_order, seasonal_order, aic, backtest_mae,
+             n_months, evaluated, selected_at)
+        VALUES (?,?,?,?,?,?,?,?)
+        """,
+        (
+            user_id,
+            ",".join(map(str, choice["order"])),
+            ",".join(map(str, choice["seasonal_order"])),
+            choice["aic"],
+            choice["backtest_mae"],
+            choice["n_months"],
+            choice["evaluated"],
+            choice["selected_at"],
+        )
+    ), user_id)
+
+
+def load_forecast_order(user_id: int) -> dict | None:
+    init_db(user_id)
+    conn = get_conn(user_id)
+    row = conn.execute(
+        """
+        SELECT arima_order, seasonal_order, aic, backtest_mae,
+               n_months, evaluated, selected_at
+        FROM forecast_orders
+        WHERE user_id = ?
+        """,
+        (user_id,)
+    ).fetchone()
+    conn.close()
+    if not row:
+        return None
+    keys = ["aic", "backtest_mae", "n_months", "evaluated", "selected_at"]
+    choice = dict(zip(keys, row[2:]))
+    choice["order"] = tuple(int(v) for v in row[0].split(","))
+    choice["seasonal_order"] = tuple(int(v) for v in row[1].split(","))
+    return choice
+
+
+# Receipt handling
+# user_id selects the shard holding the transaction; it can be left out
+# when sharding is off
+def insert_receipt(
+    transaction_id: int,
+    filename: str,
+    ocr_text: str,
+    user_id: int | None = None,
+    image_sha256: str | None = None
+) -> int:
+    """
+    image_sha256 is the receipt_store digest of the uploaded image.
+    """
+    return run_write(lambda cur: cur.execute(
+        """
+        INSERT INTO receipts(transaction_id, filename, ocr_text, image_sha256)
+        VALUES (?,?,?,?)
+        """,
+        (transaction_id, filename, _pack_text(ocr_text), image_sha256)
+    ).lastrowid, user_id)
+
+
+def _item_rows(receipt_id: int, items: list[dict]) -> list[tuple]:
+    return [
+        (
+            receipt_id,
+            it.get("item_name"),
+            it.get("qty"),
+            it.get("unit_price"),
+            it.get("total"),
+        )
+        for it in items
+    ]
+
+
+_INSERT_ITEMS = """
+    INSERT INTO receipt_items(receipt_id, item_name, qty, unit_price, total)
+    VALUES (?,?,?,?,?)
+"""
+
+
+def insert_receipt_items(
+    receipt_id: int,
+    items: list[dict],
+    user_id: int | None = None,
+    parser_version: int | None = None
+):
+    """
+    parser_version records which parse_receipt produced the items, so
+    `cli.py reparse-receipts` can skip receipts that are up to date.
+    """
+    rows = _item_rows(receipt_id, items)
+
+    def write(cur):
+        cur.executemany(_INSERT_ITEMS, rows)
+        if parser_version is not None:
+            cur.execute(
+                "UPDATE receipts SET parser_version = ? WHERE id = ?",
+                (parser_version, receipt_id)
             )
+
+    run_write(write, user_id)
+
+
+def replace_receipt_items(
+    receipt_id: int,
+    items: list[dict],
+    parser_version: int,
+    ocr_text: str | None = None,
+    user_id: int | None = None
+) -> int:
+    """
+    Atomically swaps a receipt's items for a new parse (and its OCR text,
+    when re-read) and stamps the parser version. Returns the number of
+    items replaced.
+    """
+    rows = _item_rows(receipt_id, items)
+
+    def write(cur):
+        removed = cur.execute(
+            "DELETE FROM receipt_items WHERE receipt_id = ?", (receipt_id,)
+        ).rowcount
+        cur.executemany(_INSERT_ITEMS, rows)
+        cur.execute(
+            """
+            UPDATE receipts
+            SET parser_version = ?, ocr_text = COALESCE(?, ocr_text)
+            WHERE id = ?
+            """,
+            (parser_version, _pack_text(ocr_text), receipt_id)
         )
+        return removed
 
-    conn.commit()
+    return run_write(write, user_id)
+
+
+def receipts_to_parse(
+    user_id: int,
+    parser_version: int,
+    after_id: int = 0,
+    limit: int = 200,
+    force: bool = False
+) -> pd.DataFrame:
+    """
+    The next `limit` of the user's receipts with id > after_id that were
+    parsed by an older parser (all of them with force), in id order, so
+    callers can page through with after_id = last id seen.
+    """
+    init_db(user_id)
+    conn = get_conn(user_id)
+    df = pd.read_sql_query(
+        """
+        SELECT r.id, r.ocr_text, r.image_sha256
+        FROM receipts r
+        JOIN transactions t ON t.id = r.transaction_id
+        WHERE t.user_id = ?
+          AND r.id > ?
+          AND (? OR r.parser_version IS NULL OR r.parser_version < ?)
+        ORDER BY r.id
+        LIMIT ?
+        """,
+        conn,
+        params=(user_id, after_id, int(force), parser_version, limit)
+    )
     conn.close()
+    df["ocr_text"] = df["ocr_text"].map(_unpack_text)
+    return df
 
-def get_receipts_for_transaction(transaction_id: int) -> pd.DataFrame:
-    init_db()
-    conn = get_conn()
+
+def get_receipts_for_transaction(transaction_id: int, user_id: int | None = None) -> pd.DataFrame:
+    init_db(user_id)
+    conn = get_conn(user_id)
     df = pd.read_sql_query(
         """
-        SELECT id, transaction_id, filename, ocr_text, created_at
+        SELECT id, transaction_id, filename, ocr_text, created_at, image_sha256
         FROM receipts
         WHERE transaction_id = ?
         ORDER BY created_at DESC
@@ -244,12 +1555,13 @@ def get_receipts_for_transaction(transaction_id: int) -> pd.DataFrame:
         params=(transaction_id,)
     )
     conn.close()
+    df["ocr_text"] = df["ocr_text"].map(_unpack_text)
     return df
 
 
-def get_items_for_receipt(receipt_id: int) -> pd.DataFrame:
-    init_db()
-    conn = get_conn()
+def get_items_for_receipt(receipt_id: int, user_id: int | None = None) -> pd.DataFrame:
+    init_db(user_id)
+    conn = get_conn(user_id)
     df = pd.read_sql_query(
         """
         SELECT item_name, qty, unit_price, total
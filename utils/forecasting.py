@@ -1,7 +1,74 @@
+import os
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import get_context
+
+import numpy as np
 import pandas as pd
 from statsmodels.tsa.statespace.sarimax import SARIMAX
 
-def sarimax_forecast(monthly_series: pd.Series, steps: int = 6):
+from utils.timing import timed, span, count
+
+# Worker processes for per-category fits (CPU-bound, so threads would
+# serialise on the GIL). 1 fits inline.
+FORECAST_WORKERS = int(os.environ.get("SMARTSPEND_FORECAST_WORKERS", "2"))
+
+# Category series shorter than this are projected with their recent mean
+MIN_MODEL_MONTHS = 6
+RECENT_MONTHS = 6
+SEASONAL_MONTHS = 24
+
+# Balance model used until an order has been selected for a user
+DEFAULT_ORDER = (1, 1, 1)
+DEFAULT_SEASONAL_ORDER = (1, 1, 1, 12)
+
+# Order selection: seconds allowed for the candidate search, and the
+# rolling-origin backtest (forecast origins x months ahead) it scores
+SELECTION_BUDGET_SECONDS = float(os.environ.get("SMARTSPEND_ORDER_SEARCH_SECONDS", "10"))
+BACKTEST_ORIGINS = 3
+BACKTEST_HORIZON = 3
+# Orders are re-selected once the series has grown (or shrunk) this much
+RESELECT_AFTER_MONTHS = 6
+
+# Monte Carlo projection: simulated paths, months per bootstrap block (keeps
+# short runs such as quarterly bills together), history sampled from, and
+# the percentiles drawn as the fan. A fixed seed keeps the fan steady
+# across reruns.
+SIMULATION_PATHS = 5000
+BOOTSTRAP_BLOCK_MONTHS = 3
+SIMULATION_HISTORY_MONTHS = 24
+FAN_PERCENTILES = (5, 25, 50, 75, 95)
+SIMULATION_SEED = 0
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# user_id -> (data version, steps, result)
+_category_cache: dict[int, tuple[int, int, dict]] = {}
+_category_cache_lock = threading.Lock()
+
+
+def monthly_balance_series(df: pd.DataFrame) -> pd.Series:
+    """
+    Cumulative balance at each month end, from (date, amount) transactions.
+    """
+    d = df.assign(date=pd.to_datetime(df["date"]))
+    return (
+        d.groupby(pd.Grouper(key="date", freq="ME"))["amount"]
+        .sum()
+        .cumsum()
+    )
+
+
+@timed()
+def sarimax_forecast(
+    monthly_series: pd.Series,
+    steps: int = 6,
+    order: tuple = DEFAULT_ORDER,
+    seasonal_order: tuple = DEFAULT_SEASONAL_ORDER
+):
     """
     monthly_series: indexed by month datetime-like, values are net monthly change or balance.
     Returns forecast mean and confidence intervals.
@@ -12,13 +79,386 @@ def sarimax_forecast(monthly_series: pd.Series, steps: int = 6):
 
     model = SARIMAX(
         s,
-        order=(1, 1, 1),
-        seasonal_order=(1, 1, 1, 12),
+        order=order,
+        seasonal_order=seasonal_order,
         enforce_stationarity=False,
         enforce_invertibility=False
     )
-    res = model.fit(disp=False)
-    fc = res.get_forecast(steps=steps)
-    mean = fc.predicted_mean
-    ci = fc.conf_int()
+    with span("forecasting.fit"):
+        res = model.fit(disp=False)
+    with span("forecasting.predict"):
+        fc = res.get_forecast(steps=steps)
+        mean = fc.predicted_mean
+        ci = fc.conf_int()
     return mean, ci
+
+
+# Per-category forecasts
+def monthly_category_flows(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Net amount per month end (rows) and category (columns); months with
+    no transactions in a category are 0. Rows sum to the monthly change
+    in balance.
+    """
+    d = df.assign(date=pd.to_datetime(df["date"]))
+    if "category" not in d.columns:
+        d["category"] = "Other"
+    d["category"] = d["category"].fillna("Other").astype(str)
+    return (
+        d.groupby([pd.Grouper(key="date", freq="ME"), "category"])["amount"]
+        .sum()
+        .unstack(fill_value=0.0)
+        .asfreq("ME", fill_value=0.0)
+    )
+
+
+def _flow_forecast(values: np.ndarray, steps: int) -> np.ndarray:
+    """
+    Forecast of one monthly flow series (runs in a worker process).
+    Short series get their recent mean; longer ones a small SARIMAX,
+    seasonal once two years of history exist.
+    """
+    values = np.asarray(values, dtype=float)
+    fallback = np.full(steps, values[-RECENT_MONTHS:].mean() if len(values) else 0.0)
+    if len(values) < MIN_MODEL_MONTHS or np.allclose(values, values[0]):
+        return fallback
+
+    seasonal = (1, 0, 0, 12) if len(values) >= SEASONAL_MONTHS else (0, 0, 0, 0)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            res = SARIMAX(
+                values,
+                order=(1, 0, 0),
+                seasonal_order=seasonal,
+                trend="c",
+                enforce_stationarity=False,
+                enforce_invertibility=False
+            ).fit(disp=False)
+        forecast = res.forecast(steps)
+    except Exception:
+        return fallback
+    return forecast if np.all(np.isfinite(forecast)) else fallback
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: never fork a process that is running server threads
+            _pool = ProcessPoolExecutor(
+                max_workers=FORECAST_WORKERS, mp_context=get_context("spawn")
+            )
+        return _pool
+
+
+def _discard_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        # Queued work is dropped and the workers exit after their current task
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _map_forecasts(series: list[np.ndarray], steps: int, workers: int) -> list[np.ndarray]:
+    if workers <= 1 or len(series) <= 1:
+        return [_flow_forecast(s, steps) for s in series]
+    try:
+        return list(_get_pool().map(_flow_forecast, series, [steps] * len(series)))
+    except Exception:
+        # A broken pool (e.g. a worker was killed) must not break the page
+        _discard_pool()
+        return [_flow_forecast(s, steps) for s in series]
+
+
+def reconcile(total: np.ndarray, categories: np.ndarray) -> np.ndarray:
+    """
+    OLS reconciliation for a two-level hierarchy (total = sum of
+    categories): categories (k x steps) are shifted by an equal share of
+    the gap to the total forecast, so they add up to the reconciled total.
+    """
+    k = categories.shape[0]
+    gap = total - categories.sum(axis=0)
+    return categories + gap / (k + 1)
+
+
+def flow_forecasts(flows: pd.DataFrame, steps: int = 6, workers: int | None = None) -> pd.DataFrame:
+    """
+    Reconciled forecasts (next month ends x categories) for a
+    monthly_category_flows frame.
+    """
+    workers = FORECAST_WORKERS if workers is None else workers
+    months = pd.date_range(flows.index[-1], periods=steps + 1, freq="ME")[1:]
+
+    series = [flows[c].to_numpy() for c in flows.columns] + [flows.sum(axis=1).to_numpy()]
+    with span("forecasting.category_fits"):
+        fitted = _map_forecasts(series, steps, workers)
+    count("forecasting.series_fitted", len(series))
+
+    categories = reconcile(fitted[-1], np.vstack(fitted[:-1]))
+    return pd.DataFrame(categories.T, index=months, columns=flows.columns)
+
+
+@timed()
+def category_forecasts(
+    df: pd.DataFrame,
+    steps: int = 6,
+    workers: int | None = None
+) -> dict:
+    """
+    Monthly flow forecasts per category and for the total, fitted in
+    parallel and reconciled so the categories sum to the total.
+
+    Returns {"months": forecast month ends, "categories": DataFrame
+    (months x categories, net flow), "total": Series, "history": the
+    monthly_category_flows frame, "balance": projected month-end balance}.
+    """
+    flows = monthly_category_flows(df)
+    by_category = flow_forecasts(flows, steps, workers)
+    months = by_category.index
+    total = by_category.sum(axis=1)
+    last_balance = float(flows.sum(axis=1).sum())
+
+    return {
+        "months": months,
+        "categories": by_category,
+        "total": total,
+        "history": flows,
+        "balance": last_balance + total.cumsum(),
+    }
+
+
+def cached_category_forecasts(user_id: int, df: pd.DataFrame, steps: int = 6) -> dict:
+    """
+    category_forecasts for a user's full history, computed once per data
+    version (later reruns, e.g. moving a what-if slider, reuse it).
+    """
+    from utils.database import get_data_version
+
+    version = get_data_version(user_id)
+    with _category_cache_lock:
+        cached = _category_cache.get(user_id)
+    if cached is not None and cached[0] == version and cached[1] == steps:
+        count("forecasting.cache_hits")
+        return cached[2]
+
+    result = category_forecasts(df, steps=steps)
+    with _category_cache_lock:
+        _category_cache[user_id] = (version, steps, result)
+    return result
+
+
+# SARIMAX order selection
+def candidate_orders(n_months: int) -> list[tuple[tuple, tuple]]:
+    """
+    (order, seasonal_order) pairs worth trying for a balance series of
+    n_months, cheapest first so a tight budget still covers the simple
+    models. Seasonal terms need two years of history.
+    """
+    orders = [(0, 1, 0), (1, 1, 0), (0, 1, 1), (1, 1, 1), (2, 1, 0), (2, 1, 1)]
+    seasonal = [(0, 0, 0, 0)]
+    if n_months >= SEASONAL_MONTHS:
+        seasonal += [(1, 0, 0, 12), (0, 1, 1, 12), (1, 1, 1, 12)]
+    return [(o, so) for so in seasonal for o in orders]
+
+
+def _fit_values(values: np.ndarray, order: tuple, seasonal_order: tuple):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return SARIMAX(
+            values,
+            order=order,
+            seasonal_order=seasonal_order,
+            enforce_stationarity=False,
+            enforce_invertibility=False
+        ).fit(disp=False)
+
+
+def _evaluate_order(values: np.ndarray, order: tuple, seasonal_order: tuple) -> dict:
+    """
+    AIC on the full series and mean absolute error of rolling-origin
+    forecasts (runs in a worker process). Failed fits score infinity.
+    """
+    started = time.perf_counter()
+    values = np.asarray(values, dtype=float)
+    result = {"order": order, "seasonal_order": seasonal_order,
+              "aic": np.inf, "backtest_mae": np.inf}
+    try:
+        result["aic"] = float(_fit_values(values, order, seasonal_order).aic)
+
+        # Fit on everything before each origin, forecast the next months
+        errors = []
+        for i in range(1, BACKTEST_ORIGINS + 1):
+            origin = len(values) - BACKTEST_HORIZON * i
+            if origin < MIN_MODEL_MONTHS:
+                break
+            res = _fit_values(values[:origin], order, seasonal_order)
+            actual = values[origin:origin + BACKTEST_HORIZON]
+            errors.append(np.abs(res.forecast(BACKTEST_HORIZON) - actual))
+        if errors:
+            result["backtest_mae"] = float(np.mean(np.concatenate(errors)))
+    except Exception:
+        pass
+
+    for key in ("aic", "backtest_mae"):
+        if not np.isfinite(result[key]):
+            result[key] = np.inf
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+
+@timed()
+def select_order(
+    monthly_series: pd.Series,
+    budget: float | None = None,
+    workers: int | None = None
+) -> dict:
+    """
+    Evaluates candidate_orders() in the forecast worker pool and returns
+    the one with the lowest backtest error (AIC breaks ties, and decides
+    alone when the series is too short to backtest). Candidates still
+    running when the budget runs out are dropped; with none finished the
+    default orders are returned.
+
+    Returns {"order", "seasonal_order", "aic", "backtest_mae",
+    "n_months", "evaluated", "candidates", "selected_at"}.
+    """
+    budget = SELECTION_BUDGET_SECONDS if budget is None else budget
+    workers = FORECAST_WORKERS if workers is None else workers
+    values = monthly_series.dropna().to_numpy(dtype=float)
+    candidates = candidate_orders(len(values))
+    deadline = time.monotonic() + budget
+
+    results = []
+    with span("forecasting.order_search"):
+        if workers > 1:
+            try:
+                futures = [
+                    _get_pool().submit(_evaluate_order, values, o, so)
+                    for o, so in candidates
+                ]
+            except Exception:
+                futures = None
+            if futures is not None:
+                done, pending = wait(futures, timeout=budget)
+                # Queued candidates are cancelled; ones already running
+                # finish in the background and are ignored
+                for f in pending:
+                    f.cancel()
+                results = [f.result() for f in done if f.exception() is None]
+                if len(results) < len(done):
+                    _discard_pool()
+            else:
+                _discard_pool()
+        if not results and time.monotonic() < deadline:
+            for o, so in candidates:
+                if time.monotonic() >= deadline:
+                    break
+                results.append(_evaluate_order(values, o, so))
+    count("forecasting.orders_evaluated", len(results))
+
+    choice = {
+        "order": DEFAULT_ORDER,
+        "seasonal_order": DEFAULT_SEASONAL_ORDER,
+        "aic": None,
+        "backtest_mae": None,
+    }
+    scored = [r for r in results if np.isfinite(r["aic"])]
+    if scored:
+        best = min(scored, key=lambda r: (r["backtest_mae"], r["aic"]))
+        mae = best["backtest_mae"]
+        choice = {
+            "order": tuple(best["order"]),
+            "seasonal_order": tuple(best["seasonal_order"]),
+            "aic": round(best["aic"], 3),
+            "backtest_mae": round(mae, 2) if np.isfinite(mae) else None,
+        }
+    choice.update({
+        "n_months": len(values),
+        "evaluated": len(results),
+        "candidates": len(candidates),
+        "selected_at": int(time.time()),
+    })
+    return choice
+
+
+def forecast_orders(
+    user_id: int,
+    monthly_series: pd.Series,
+    reselect: bool = False,
+    workers: int | None = None
+) -> dict:
+    """
+    The user's stored SARIMAX orders, selected (and stored) first when
+    there are none yet, the series length has moved by
+    RESELECT_AFTER_MONTHS, or reselect is set. Series too short to model
+    get the default orders. Pass workers=1 from code that already runs in
+    a worker process.
+    """
+    from utils.database import load_forecast_order, save_forecast_order
+
+    n_months = int(monthly_series.notna().sum())
+    if n_months < MIN_MODEL_MONTHS:
+        return {"order": DEFAULT_ORDER, "seasonal_order": DEFAULT_SEASONAL_ORDER}
+
+    stored = None if reselect else load_forecast_order(user_id)
+    if stored is not None and abs(n_months - stored["n_months"]) < RESELECT_AFTER_MONTHS:
+        return stored
+
+    choice = select_order(monthly_series, workers=workers)
+    # With nothing evaluated in time (e.g. the pool was still starting) the
+    # defaults are used for this forecast only, and the search runs again
+    if choice["evaluated"]:
+        save_forecast_order(user_id, choice)
+    return choice
+
+
+# Monte Carlo projection
+@timed()
+def simulate_balance(
+    flows: pd.DataFrame,
+    steps: int = 6,
+    monthly_change: float = 0.0,
+    paths: int = SIMULATION_PATHS,
+    block: int = BOOTSTRAP_BLOCK_MONTHS,
+    seed: int = SIMULATION_SEED
+) -> dict:
+    """
+    Month-end balance paths built by block-bootstrapping whole months of
+    a monthly_category_flows frame (categories move together, so their
+    correlation is kept) over the last SIMULATION_HISTORY_MONTHS.
+    monthly_change is added to every simulated month (e.g. a what-if
+    spending change).
+
+    Returns {"months", "percentiles": DataFrame (months x
+    FAN_PERCENTILES), "overdraft_by_month": Series (share of paths below
+    zero), "overdraft_probability": share of paths below zero in any
+    month, "paths"}.
+    """
+    last_balance = float(flows.sum(axis=1).sum())
+    months = pd.date_range(flows.index[-1], periods=steps + 1, freq="ME")[1:]
+    # Summing the categories first gives the same balance paths as
+    # resampling them and summing afterwards, at a fraction of the memory
+    history = flows.sum(axis=1).to_numpy(dtype=float)[-SIMULATION_HISTORY_MONTHS:]
+    block = max(1, min(block, len(history)))
+
+    rng = np.random.default_rng(seed)
+    n_blocks = -(-steps // block)
+    starts = rng.integers(0, len(history) - block + 1, size=(paths, n_blocks))
+    idx = (starts[:, :, None] + np.arange(block)).reshape(paths, -1)[:, :steps]
+    balances = last_balance + np.cumsum(history[idx] + monthly_change, axis=1)
+
+    overdrawn = balances < 0
+    count("forecasting.paths_simulated", paths)
+    return {
+        "months": months,
+        "percentiles": pd.DataFrame(
+            np.percentile(balances, FAN_PERCENTILES, axis=0).T,
+            index=months,
+            columns=list(FAN_PERCENTILES)
+        ),
+        "overdraft_by_month": pd.Series(overdrawn.mean(axis=0), index=months),
+        "overdraft_probability": float(overdrawn.any(axis=1).mean()),
+        "paths": paths,
+    }
@@ -1,26 +1,300 @@
+import pickle
+import time
+import warnings
+
+import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 from sklearn.ensemble import IsolationForest
 
+from utils.data_processing import merchant_keys
+
+from utils.database import (
+    save_anomaly_model,
+    load_anomaly_model,
+    save_anomaly_scores,
+    load_anomaly_scores,
+)
+from utils.timing import timed, span, count
+
+# IsolationForest settings
+ANOMALY_CONTAMINATION = 0.05
+ANOMALY_TREES = 200
+
+# Stored models are refitted when older than this, when the unscored rows
+# exceed this share of the rows the model was fitted on, or when the
+# feature set changes (bump FEATURE_VERSION with anomaly_features).
+ANOMALY_REFIT_DAYS = 30
+ANOMALY_REFIT_GROWTH = 0.5
+FEATURE_VERSION = 3
+FEATURE_COLUMNS = [
+    "abs_amount", "day", "weekday",
+    "cat_dev", "merchant_freq", "days_since_merchant",
+]
+
+# Baseline windows: previous N transactions in the same category and of
+# the same sign / of the same sign (expense or income)
+CATEGORY_WINDOW = 12
+SIGN_WINDOW = 20
+# Rows per block of window statistics, so temporaries stay at a few MB
+# (rows x window floats) however long the history
+WINDOW_CHUNK_ROWS = 32_768
+# Stand-in gap for the first visit to a merchant
+NEW_MERCHANT_DAYS = 365
+
+
+def _prior_window_stats(
+    values: np.ndarray,
+    groups: np.ndarray,
+    window: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Median, MAD and count of the previous `window` values in the same
+    group, for arrays sorted by group then time. Computed over a strided
+    window view (no per-group Python loop), WINDOW_CHUNK_ROWS rows at a
+    time.
+    """
+    n = len(values)
+    padded_v = np.concatenate([np.full(window, np.nan), values])
+    padded_g = np.concatenate([np.full(window, -1), groups])
+
+    median = np.empty(n)
+    mad = np.empty(n)
+    counts = np.empty(n, dtype=np.int64)
+    for start in range(0, n, WINDOW_CHUNK_ROWS):
+        stop = min(start + WINDOW_CHUNK_ROWS, n)
+        # Row i sees values[i - window : i]
+        win_v = sliding_window_view(padded_v[start:stop + window - 1], window)
+        win_g = sliding_window_view(padded_g[start:stop + window - 1], window)
+        win = np.where(win_g == groups[start:stop, None], win_v, np.nan)
+
+        counts[start:stop] = np.count_nonzero(~np.isnan(win), axis=1)
+        with warnings.catch_warnings():
+            # All-NaN windows (first row of a group) give NaN, which is intended
+            warnings.simplefilter("ignore", RuntimeWarning)
+            median[start:stop] = np.nanmedian(win, axis=1)
+            mad[start:stop] = np.nanmedian(np.abs(win - median[start:stop, None]), axis=1)
+    return median, mad, counts
+
+
+def _grouped_baseline(
+    values: np.ndarray,
+    group_codes: np.ndarray,
+    time_key: np.ndarray,
+    window: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    order = np.lexsort((time_key, group_codes))
+    median, mad, counts = _prior_window_stats(values[order], group_codes[order], window)
+
+    out_median = np.empty_like(median)
+    out_mad = np.empty_like(mad)
+    out_counts = np.empty_like(counts)
+    out_median[order] = median
+    out_mad[order] = mad
+    out_counts[order] = counts
+    return out_median, out_mad, out_counts
+
+
+def transaction_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-transaction behaviour features, aligned to df's index:
+
+        abs_amount, day, weekday
+        cat_median, cat_mad, cat_count   previous CATEGORY_WINDOW amounts in the category
+                                         of the same sign (refunds don't move spend)
+        cat_dev                          robust z-score of abs_amount against that baseline
+        sign_median, sign_count          previous SIGN_WINDOW expenses (or incomes)
+        merchant_key, merchant_freq      merchant and its share of all transactions
+        days_since_merchant              gap since the previous visit to the merchant
+
+    Used by the anomaly model and by the Advisor's explanations.
+    """
+    dates = pd.to_datetime(df["date"])
+    amount = pd.to_numeric(df["amount"], errors="coerce").fillna(0).to_numpy(dtype=float)
+    abs_amount = np.abs(amount)
+
+    # Rank of each row in time order (ties keep the original row order)
+    time_order = np.argsort(dates.to_numpy(), kind="stable")
+    time_key = np.empty(len(df), dtype=np.int64)
+    time_key[time_order] = np.arange(len(df))
+
+    if "category" in df.columns:
+        category = df["category"].fillna("Other").astype(str)
+    else:
+        category = pd.Series("Other", index=df.index)
+    cat_codes, _ = pd.factorize(category)
+    sign_codes = (amount > 0).astype(np.int64)
+    cat_median, cat_mad, cat_count = _grouped_baseline(
+        abs_amount, cat_codes * 2 + sign_codes, time_key, CATEGORY_WINDOW
+    )
+
+    sign_median, _, sign_count = _grouped_baseline(abs_amount, sign_codes, time_key, SIGN_WINDOW)
+
+    # 1.4826 scales MAD to a standard deviation for normal data;
+    # +1 keeps near-constant spends (same bill every month) from exploding
+    cat_dev = (abs_amount - cat_median) / (1.4826 * cat_mad + 1.0)
+
+    keys = merchant_keys(df["description"])
+    merchant_freq = keys.map(keys.value_counts(normalize=True))
+
+    by_time = pd.DataFrame({"key": keys.to_numpy(), "date": dates.to_numpy()}).iloc[time_order]
+    gap = by_time.groupby("key", sort=False)["date"].diff().dt.days
+    days_since = np.empty(len(df))
+    days_since[time_order] = gap.to_numpy(dtype=float)
+
+    return pd.DataFrame({
+        "abs_amount": abs_amount,
+        "day": dates.dt.day.to_numpy(),
+        "weekday": dates.dt.weekday.to_numpy(),
+        "cat_median": cat_median,
+        "cat_mad": cat_mad,
+        "cat_count": cat_count,
+        "cat_dev": cat_dev,
+        "sign_median": sign_median,
+        "sign_count": sign_count,
+        "merchant_key": keys.to_numpy(),
+        "merchant_freq": merchant_freq.to_numpy(),
+        "days_since_merchant": days_since,
+    }, index=df.index)
+
+
+def anomaly_features(features: pd.DataFrame) -> pd.DataFrame:
+    """
+    Model inputs (FEATURE_COLUMNS) from transaction_features output.
+    """
+    X = features[FEATURE_COLUMNS].copy()
+    X["cat_dev"] = X["cat_dev"].fillna(0)
+    X["days_since_merchant"] = X["days_since_merchant"].fillna(NEW_MERCHANT_DAYS)
+    return X.fillna(0)
+
+
+def _new_model() -> IsolationForest:
+    return IsolationForest(
+        n_estimators=ANOMALY_TREES,
+        contamination=ANOMALY_CONTAMINATION,
+        random_state=42
+    )
+
+
+@timed()
 def detect_anomalies(df: pd.DataFrame) -> pd.DataFrame:
     """
     Flags unusual transactions using IsolationForest.
-    Features: amount magnitude + day-of-month (simple, stable for IPD).
+    Fits on the whole frame every call; pages use score_anomalies instead.
     """
     if df.empty:
         return df
 
+    with span("insights.features"):
+        d = df.copy()
+        d["date"] = pd.to_datetime(d["date"])
+        features = transaction_features(d)
+        X = anomaly_features(features)
+        d = d.join(features)
+
+    model = _new_model()
+    with span("insights.fit"):
+        preds = model.fit_predict(X)
+    d["is_anomaly"] = (preds == -1)
+    return d
+
+
+def _needs_refit(stored: dict | None, n_unscored: int, now: float) -> bool:
+    if stored is None:
+        return True
+    if stored["feature_version"] != FEATURE_VERSION:
+        return True
+    if now - stored["fitted_at"] > ANOMALY_REFIT_DAYS * 86400:
+        return True
+    return n_unscored > ANOMALY_REFIT_GROWTH * max(stored["n_rows"], 1)
+
+
+@timed()
+def score_anomalies(
+    user_id: int,
+    df: pd.DataFrame,
+    threshold: float | None = None,
+    refit: bool = False,
+    with_features: bool = False
+) -> pd.DataFrame:
+    """
+    Returns df (with parsed dates) plus anomaly_score and is_anomaly,
+    using scores stored in the database. with_features=True also joins the
+    transaction_features columns (computed at most once per call).
+
+    Only rows without a stored score are scored, with the user's saved
+    model; the model is refitted on the full history when missing, stale
+    (see _needs_refit) or when refit=True. A row is flagged when its score
+    is below `threshold` (lower = more unusual), defaulting to the cut-off
+    learned at fit time, so existing flags stay stable as history grows.
+    """
     d = df.copy()
+    if d.empty:
+        d["anomaly_score"] = pd.Series(dtype=float)
+        d["is_anomaly"] = pd.Series(dtype=bool)
+        return d
+
     d["date"] = pd.to_datetime(d["date"])
-    d["abs_amount"] = d["amount"].abs()
-    d["day"] = d["date"].dt.day
+    stored = load_anomaly_model(user_id)
+    scores = load_anomaly_scores(user_id)
+    unscored = ~d["id"].isin(scores.index)
+    now = time.time()
 
-    X = d[["abs_amount", "day"]].fillna(0)
+    # Decided first: a stale model is refitted even when every row is scored
+    refit = refit or _needs_refit(stored, int(unscored.sum()), now)
 
-    model = IsolationForest(
-        n_estimators=200,
-        contamination=0.05,
-        random_state=42
-    )
-    preds = model.fit_predict(X) 
-    d["is_anomaly"] = (preds == -1)
+    features = None
+    if with_features or refit or unscored.any():
+        with span("insights.features"):
+            features = transaction_features(d)
+
+    if refit:
+        X = anomaly_features(features)
+        model = _new_model()
+        with span("insights.fit"):
+            model.fit(X)
+            fitted = model.score_samples(X)
+        model_threshold = float(model.offset_)
+
+        save_anomaly_model(
+            user_id,
+            pickle.dumps(model),
+            model_threshold,
+            len(d),
+            int(now),
+            FEATURE_VERSION
+        )
+        save_anomaly_scores(
+            user_id,
+            list(zip(d["id"].astype(int).tolist(), fitted.tolist())),
+            replace_all=True
+        )
+        scores = pd.Series(fitted, index=d["id"].to_numpy())
+        count("insights.rows_scored", len(d))
+
+    else:
+        model_threshold = stored["threshold"]
+        if unscored.any():
+            model = pickle.loads(stored["model"])
+            X_new = anomaly_features(features)[unscored.to_numpy()]
+            with span("insights.score"):
+                new_scores = model.score_samples(X_new)
+            new_ids = d.loc[unscored, "id"].astype(int).tolist()
+            save_anomaly_scores(user_id, list(zip(new_ids, new_scores.tolist())))
+            scores = pd.concat([scores, pd.Series(new_scores, index=new_ids)])
+            count("insights.rows_scored", len(new_ids))
+
+    cut_off = model_threshold if threshold is None else threshold
+    d["anomaly_score"] = d["id"].map(scores).to_numpy(dtype=float)
+    d["is_anomaly"] = d["anomaly_score"] < cut_off
+    if with_features:
+        d = d.join(features)
     return d
+
+
+def anomaly_threshold(user_id: int) -> float | None:
+    """
+    Cut-off learned at the user's last fit (None before the first fit).
+    """
+    stored = load_anomaly_model(user_id)
+    return None if stored is None else stored["threshold"]
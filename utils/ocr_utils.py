@@ -2,32 +2,202 @@ import re
 from PIL import Image
 import pytesseract
 
+from utils.timing import timed
+
+
+@timed()
 def ocr_image(image: Image.Image) -> str:
     return pytesseract.image_to_string(image)
 
-def parse_receipt_items(ocr_text: str) -> list[dict]:
+
+# Receipt line patterns (compiled once, applied in a single pass)
+PRICE_RE = re.compile(
+    r"(-)?£?(?<![\d.,])(\d{1,3}(?:,\d{3})+\.\d{2}|\d{1,6}[.,]\d{2})(-)?(?![\d.,])"
+)
+QTY_RE = re.compile(
+    r"(?P<qty>\d+(?:\.\d+)?)\s*(?:kg|g)?\s*[xX@*]\s*£?(?P<unit>\d{1,6}[.,]\d{2})(?:\s*/\s*kg)?"
+)
+SUBTOTAL_RE = re.compile(r"\bsub[\s-]?total\b", re.I)
+TOTAL_RE = re.compile(r"\b(total|balance due|amount due|to pay)\b", re.I)
+VAT_RE = re.compile(r"\b(vat|tax)\b", re.I)
+DISCOUNT_WORDS = (
+    r"discount|savings?|multi\s?buy|promo|offer|coupon|voucher|"
+    r"clubcard|nectar|reduced|price cut"
+)
+DISCOUNT_RE = re.compile(rf"\b({DISCOUNT_WORDS})\b", re.I)
+# Discount lines either lead with a word no product name starts with, or
+# are made of discount words alone ("OFFER", "REDUCED"); "REDUCED FAT
+# MILK" and "HOLIDAY OFFER PACK" are items
+DISCOUNT_LEAD_RE = re.compile(
+    r"^(discount|savings?|multi\s?buy|promo|coupon|voucher|clubcard|nectar|"
+    r"price cut|reduced to clear)\b",
+    re.I
+)
+DISCOUNT_ONLY_RE = re.compile(rf"^(?:(?:{DISCOUNT_WORDS}|price|to clear)\W*)+$", re.I)
+NAME_STRIP_RE = re.compile(r"£|\s{2,}")
+
+RECONCILE_TOLERANCE = 0.01
+
+# Bump whenever parse_receipt's output changes; `cli.py reparse-receipts`
+# then re-parses receipts stored with an older version
+PARSER_VERSION = 2
+
+
+def _money(value: str) -> float:
+    # "1,234.56" has a thousands separator, "1,50" a decimal comma
+    if "." in value:
+        return float(value.replace(",", ""))
+    return float(value.replace(",", "."))
+
+
+def _is_discount(name: str) -> bool:
+    return bool(DISCOUNT_LEAD_RE.match(name) or DISCOUNT_ONLY_RE.match(name))
+
+
+def _item_name(line: str) -> str:
+    name = QTY_RE.sub(" ", line)
+    name = PRICE_RE.sub(" ", name)
+    name = NAME_STRIP_RE.sub(" ", name)
+    return name.strip(" -:.*")[:60]
+
+
+@timed()
+def parse_receipt(ocr_text: str) -> dict:
     """
-    Very simple parser for IPD: tries to detect lines with 'name ..... price'
-    You will improve this later, but this is "working".
+    Streams over the OCR lines once and returns:
+        items        - list of {item_name, qty, unit_price, total}
+        subtotal, vat, total - summary values found on the receipt (or None)
+        items_total  - sum of parsed item totals (discounts are negative items)
+        reconciled   - True/False when a total was found, otherwise None
+
+    Handles quantity lines ("2 x 1.50", "0.450 kg @ £2.00/kg") either inline
+    or on the line below the item, multi-buy / discount lines, and stops
+    collecting items once the receipt total has been read.
     """
-    items = []
-    lines = [ln.strip() for ln in ocr_text.splitlines() if ln.strip()]
-    money = re.compile(r"(\d+\.\d{2})")
+    items: list[dict] = []
+    subtotal = vat = total = None
+    pending_name = None
+    in_footer = False
+
+    for raw in ocr_text.splitlines():
+        ln = raw.strip()
+        if not ln:
+            continue
+
+        prices = PRICE_RE.findall(ln)
+
+        if not prices:
+            # Name-only line: its price may follow on a quantity line
+            pending_name = None if in_footer else (_item_name(ln) or None)
+            continue
+
+        neg_a, value, neg_b = prices[-1]
+        amount = _money(value)
+        is_negative = bool(neg_a or neg_b)
 
-    for ln in lines:
-        m = money.findall(ln)
-        if not m:
+        # Summary lines
+        if DISCOUNT_RE.search(ln) and TOTAL_RE.search(ln):
+            # e.g. "TOTAL SAVINGS 2.00" - already counted line by line
+            pending_name = None
             continue
-        # need to take last price-like number in line as total
-        price = float(m[-1])
-        name = re.sub(r"\d+\.\d{2}", "", ln).strip(" -:.")
+        if SUBTOTAL_RE.search(ln):
+            subtotal = amount
+            pending_name = None
+            continue
+        if VAT_RE.search(ln):
+            vat = amount
+            pending_name = None
+            continue
+        if TOTAL_RE.search(ln):
+            if total is None:
+                total = amount
+            in_footer = True
+            pending_name = None
+            continue
+
+        if in_footer:
+            # Payment, change and loyalty lines after the total
+            continue
+
+        qty_match = QTY_RE.search(ln)
+        name = _item_name(ln)
+
+        # Multi-buy and discount lines reduce the bill
+        if is_negative or (not qty_match and _is_discount(name)):
+            items.append({
+                "item_name": name or "Discount",
+                "qty": 1,
+                "unit_price": -amount,
+                "total": -amount
+            })
+            pending_name = None
+            continue
+
+        if qty_match:
+            qty = float(qty_match.group("qty"))
+            unit_price = _money(qty_match.group("unit"))
+            # A trailing price after the quantity expression is the line total
+            line_total = amount if len(prices) > 1 else round(qty * unit_price, 2)
+
+            if not name and pending_name:
+                name = pending_name
+            elif not name and items and items[-1]["total"] > 0:
+                last = items[-1]
+                if abs(last["total"] - line_total) <= RECONCILE_TOLERANCE:
+                    # Quantity breakdown printed under an item that is already priced
+                    last["qty"] = qty
+                    last["unit_price"] = unit_price
+                    pending_name = None
+                    continue
+                if last["qty"] == 1 and abs(last["total"] - unit_price) <= RECONCILE_TOLERANCE:
+                    # The item line showed the unit price; the quantity line sets the total
+                    last.update(qty=qty, unit_price=unit_price, total=line_total)
+                    pending_name = None
+                    continue
+
+            if len(name) < 2:
+                # A priced quantity line with no name is still part of the bill
+                name = "Unnamed item"
+
+            items.append({
+                "item_name": name,
+                "qty": qty,
+                "unit_price": unit_price,
+                "total": line_total
+            })
+            pending_name = None
+            continue
+
         if len(name) < 2:
+            pending_name = None
             continue
+
         items.append({
-            "item_name": name[:60],
+            "item_name": name,
             "qty": 1,
-            "unit_price": price,
-            "total": price
+            "unit_price": amount,
+            "total": amount
         })
+        pending_name = None
+
+    items_total = round(sum(it["total"] for it in items), 2)
+    expected = total if total is not None else subtotal
+    reconciled = None
+    if expected is not None:
+        reconciled = abs(items_total - expected) <= RECONCILE_TOLERANCE
 
-    return items[:25]  # cap for prototype stability, shouldn't let this grow beyond 25, even if more data exists
+    return {
+        "items": items,
+        "subtotal": subtotal,
+        "vat": vat,
+        "total": total,
+        "items_total": items_total,
+        "reconciled": reconciled
+    }
+
+
+def parse_receipt_items(ocr_text: str) -> list[dict]:
+    """
+    Item rows only, in the shape stored in receipt_items.
+    """
+    return parse_receipt(ocr_text)["items"]
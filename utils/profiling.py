@@ -0,0 +1,141 @@
+"""
+Developer mode: capture cProfile + tracemalloc for a single page rerun.
+
+SMARTSPEND_PROFILE=1      profile every rerun of every page
+SMARTSPEND_PROFILE=query  profile only reruns opened with ?profile=1
+                          (the parameter is cleared, so one rerun is captured)
+
+Each capture writes <db dir>/profiles/<stamp>-<page>.prof (open with
+snakeviz or pstats) and a matching .txt report listing the hottest
+functions and the top allocation sites. tracemalloc is process-wide, so
+allocations from other sessions rerunning at the same time are included.
+
+Pages run their body inside `with profile_page(name):`, so captures end
+(and tracing is released) however the rerun ends, including st.stop(),
+st.rerun() and st.switch_page().
+"""
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import streamlit as st
+
+PROFILE_MODE = os.environ.get("SMARTSPEND_PROFILE", "")
+PROFILE_PARAM = "profile"
+TOP_N = 30
+TRACE_FRAMES = 10
+
+_trace_lock = threading.Lock()
+_trace_users = 0
+
+
+def _requested() -> bool:
+    if PROFILE_MODE == "1":
+        return True
+    if PROFILE_MODE == "query" and st.query_params.get(PROFILE_PARAM) == "1":
+        del st.query_params[PROFILE_PARAM]
+        return True
+    return False
+
+
+def _acquire_tracing():
+    global _trace_users
+    with _trace_lock:
+        if _trace_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+        _trace_users += 1
+
+
+def _release_tracing():
+    global _trace_users
+    with _trace_lock:
+        _trace_users = max(_trace_users - 1, 0)
+        if _trace_users == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+@contextmanager
+def profile_page(page: str):
+    """
+    Captures the enclosed page body if developer mode asks for it. The
+    capture is stopped and written however the body exits.
+    """
+    if not PROFILE_MODE or not _requested():
+        yield
+        return
+
+    # Streamlit calls raise again once st.stop() or st.rerun() has been
+    # requested, so nothing below the yield reads session state
+    user_id = st.session_state.get("user_id")
+    _acquire_tracing()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        try:
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            ])
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            _release_tracing()
+        prof_path = _write_report(page, user_id, profiler, elapsed, snapshot, current, peak)
+    st.sidebar.caption(f"🔬 Profile saved: {prof_path.name}")
+
+
+def _write_report(
+    page: str,
+    user_id: int | None,
+    profiler: cProfile.Profile,
+    elapsed: float,
+    snapshot: tracemalloc.Snapshot,
+    current: int,
+    peak: int
+):
+    """
+    Writes the .prof file and report, and returns the .prof path.
+    """
+    from utils.database import DB_DIR
+
+    out_dir = DB_DIR / "profiles"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    slug = page.lower().replace(" ", "_")
+    stem = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{slug}"
+    if user_id is not None:
+        stem += f"-u{user_id}"
+
+    prof_path = out_dir / f"{stem}.prof"
+    profiler.dump_stats(prof_path)
+
+    buf = io.StringIO()
+    pstats.Stats(profiler, stream=buf).sort_stats("cumulative").print_stats(TOP_N)
+
+    lines = [
+        f"Page: {page}",
+        f"Wall time: {elapsed * 1000:,.1f} ms",
+        f"Traced memory: current {current / 2**20:.1f} MB, peak {peak / 2**20:.1f} MB",
+        "",
+        f"Top {TOP_N} allocation sites (by size):",
+    ]
+    for stat in snapshot.statistics("lineno")[:TOP_N]:
+        frame = stat.traceback[0]
+        lines.append(
+            f"  {stat.size / 1024:10.1f} KiB  {stat.count:8d} blocks  "
+            f"{frame.filename}:{frame.lineno}"
+        )
+    lines += ["", f"Top {TOP_N} functions (cumulative time):", buf.getvalue()]
+
+    (out_dir / f"{stem}.txt").write_text("\n".join(lines), encoding="utf-8")
+    return prof_path
@@ -0,0 +1,142 @@
+"""
+Content-addressed store for receipt images.
+
+Uploaded images are kept on local disk under <db dir>/receipts/, named by
+the SHA-256 of their bytes, so the same photo uploaded twice (by anyone)
+is stored once and receipts only record the digest. Files are written
+then renamed and never change afterwards, so readers need no locking.
+
+A small JPEG thumbnail is made for each image by one background thread;
+pages show thumbnails and read the full image only on request. Stored
+images can be OCR'd again later without another upload.
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from utils.timing import timed, count
+
+STORE_DIR_NAME = "receipts"
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 80
+
+_DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+
+_executor: ThreadPoolExecutor | None = None
+_executor_pid = os.getpid()
+_executor_lock = threading.Lock()
+
+
+def _store_dir() -> Path:
+    from utils.database import DB_DIR
+    return DB_DIR / STORE_DIR_NAME
+
+
+def _check_digest(digest: str) -> str:
+    # Digests come back from the database; never let one escape the store
+    if not isinstance(digest, str) or not _DIGEST_RE.fullmatch(digest):
+        raise ValueError(f"Not a SHA-256 hex digest: {digest!r}")
+    return digest
+
+
+def image_path(digest: str) -> Path:
+    _check_digest(digest)
+    return _store_dir() / "images" / digest[:2] / digest
+
+
+def thumbnail_path(digest: str) -> Path:
+    _check_digest(digest)
+    return _store_dir() / "thumbnails" / digest[:2] / f"{digest}.jpg"
+
+
+def _write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    with _executor_lock:
+        # A forked child (CLI process pool) needs its own thread
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smartspend-thumbs")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+@timed()
+def put_image(data: bytes) -> str:
+    """
+    Stores image bytes (once per distinct content), queues its thumbnail
+    and returns the SHA-256 hex digest that identifies it.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    path = image_path(digest)
+    if path.exists():
+        count("receipt_store.duplicates")
+    else:
+        _write_atomic(path, data)
+    if not thumbnail_path(digest).exists():
+        _get_executor().submit(make_thumbnail, digest)
+    return digest
+
+
+def has_image(digest: str) -> bool:
+    return image_path(digest).exists()
+
+
+def read_image(digest: str) -> bytes:
+    return image_path(digest).read_bytes()
+
+
+def open_image(digest: str) -> Image.Image:
+    return Image.open(image_path(digest))
+
+
+def make_thumbnail(digest: str) -> Path:
+    """
+    Writes the image's thumbnail (if missing) and returns its path.
+    """
+    path = thumbnail_path(digest)
+    if path.exists():
+        return path
+    with open_image(digest) as img:
+        # Phone photos are often stored sideways with an EXIF rotation
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail(THUMBNAIL_SIZE)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    _write_atomic(path, buf.getvalue())
+    count("receipt_store.thumbnails")
+    return path
+
+
+def thumbnail(digest: str) -> bytes | None:
+    """
+    JPEG thumbnail bytes, made now if the background thread has not got
+    to it yet. None when the image is not in the store.
+    """
+    if not has_image(digest):
+        return None
+    try:
+        return make_thumbnail(digest).read_bytes()
+    except OSError:
+        # Not a readable image (e.g. a truncated upload)
+        return None
+
+
+def wait_for_thumbnails():
+    """
+    Blocks until queued thumbnails are written (for batch jobs that exit
+    straight after storing images).
+    """
+    marker: Future = _get_executor().submit(lambda: None)
+    marker.result()
@@ -0,0 +1,205 @@
+"""
+Recurring payment detection (rent, bills, gyms, subscriptions).
+
+Outgoing transactions are grouped by merchant key in one sort, so the
+cost is O(n log n) in the number of transactions instead of comparing
+every pair of payments. A merchant is a recurring series when its
+payment gaps sit close to a known cadence and its amounts are stable.
+"""
+import numpy as np
+import pandas as pd
+
+from utils.data_processing import merchant_keys
+from utils.database import (
+    get_data_version,
+    save_recurring_series,
+    load_recurring_series,
+    RECURRING_COLUMNS,
+)
+from utils.timing import timed
+
+# Cadence name -> typical gap in days, and the calendar step used to
+# project the next payments (so monthly bills keep their day of month)
+CADENCES = {
+    "weekly": 7.0,
+    "fortnightly": 14.0,
+    "monthly": 30.44,
+    "quarterly": 91.31,
+    "yearly": 365.25,
+}
+CADENCE_STEPS = {
+    "weekly": pd.DateOffset(weeks=1),
+    "fortnightly": pd.DateOffset(weeks=2),
+    "monthly": pd.DateOffset(months=1),
+    "quarterly": pd.DateOffset(months=3),
+    "yearly": pd.DateOffset(years=1),
+}
+# A gap matches a cadence within this fraction of the cadence length
+CADENCE_TOLERANCE = 0.15
+# Share of gaps that must match the cadence
+MIN_REGULARITY = 0.75
+MIN_PAYMENTS = 3
+# Median absolute deviation of amounts, as a fraction of the median amount
+AMOUNT_TOLERANCE = 0.15
+# A series is still active if a payment was due no more than this many
+# cadence lengths before the latest transaction
+ACTIVE_GRACE = 1.5
+
+
+def _empty_series() -> pd.DataFrame:
+    return pd.DataFrame({c: pd.Series(dtype=object) for c in RECURRING_COLUMNS})
+
+
+@timed()
+def detect_recurring(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Recurring outgoing payments in a (date, description, amount) frame,
+    one row per merchant with RECURRING_COLUMNS. Amounts are negative
+    (outflows), dates are YYYY-MM-DD strings.
+    """
+    out = df[pd.to_numeric(df["amount"], errors="coerce") < 0]
+    if out.empty:
+        return _empty_series()
+
+    d = pd.DataFrame({
+        "key": merchant_keys(out["description"]).to_numpy(),
+        "description": out["description"].astype(str).to_numpy(),
+        "date": pd.to_datetime(out["date"]).dt.normalize().to_numpy(),
+        "amount": out["amount"].astype(float).abs().to_numpy(),
+    })
+    d = d[d["key"] != ""]
+    # Several payments to one merchant on a day count as one visit
+    d = d.sort_values(["key", "date"], kind="stable").drop_duplicates(["key", "date"])
+
+    grouped = d.groupby("key", sort=False)
+    d["gap"] = grouped["date"].diff().dt.days
+    d["amount_dev"] = (d["amount"] - grouped["amount"].transform("median")).abs()
+
+    stats = grouped.agg(
+        n_payments=("date", "size"),
+        first_date=("date", "first"),
+        last_date=("date", "last"),
+        description=("description", "last"),
+        interval_days=("gap", "median"),
+        amount=("amount", "median"),
+        amount_mad=("amount_dev", "median"),
+    )
+    stats = stats[stats["n_payments"] >= MIN_PAYMENTS]
+    if stats.empty:
+        return _empty_series()
+
+    # Nearest cadence on a log scale, so 7 vs 14 and 30 vs 91 are symmetric
+    names = np.array(list(CADENCES))
+    lengths = np.array(list(CADENCES.values()))
+    nearest = np.abs(np.log(stats["interval_days"].to_numpy()[:, None] / lengths)).argmin(axis=1)
+    stats["cadence"] = names[nearest]
+    stats["cadence_days"] = lengths[nearest]
+
+    cadence_days = d["key"].map(stats["cadence_days"])
+    d["on_cadence"] = (d["gap"] - cadence_days).abs() <= CADENCE_TOLERANCE * cadence_days
+    stats["regularity"] = d[d["gap"].notna()].groupby("key")["on_cadence"].mean()
+
+    keep = (
+        ((stats["interval_days"] - stats["cadence_days"]).abs()
+         <= CADENCE_TOLERANCE * stats["cadence_days"])
+        & (stats["regularity"] >= MIN_REGULARITY)
+        & (stats["amount_mad"] <= AMOUNT_TOLERANCE * stats["amount"])
+    )
+    stats = stats[keep]
+    if stats.empty:
+        return _empty_series()
+
+    next_date = pd.DatetimeIndex([
+        last + CADENCE_STEPS[cadence]
+        for last, cadence in zip(stats["last_date"], stats["cadence"])
+    ], name="key")
+    latest = d["date"].max()
+    grace = pd.to_timedelta(ACTIVE_GRACE * stats["cadence_days"], unit="D")
+
+    result = pd.DataFrame({
+        "merchant_key": stats.index,
+        "description": stats["description"],
+        "cadence": stats["cadence"],
+        "interval_days": stats["interval_days"].astype(float),
+        "amount": -stats["amount"].round(2),
+        "n_payments": stats["n_payments"].astype(int),
+        "first_date": stats["first_date"].dt.strftime("%Y-%m-%d"),
+        "last_date": stats["last_date"].dt.strftime("%Y-%m-%d"),
+        "next_date": next_date.strftime("%Y-%m-%d"),
+        "active": (next_date + grace.to_numpy()) >= latest,
+    })
+    return result.sort_values(["active", "amount"], ascending=[False, True]).reset_index(drop=True)
+
+
+def recurring_series(user_id: int, df: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    The user's stored recurring series, re-detected from `df` (their full
+    transaction history) only when their data has changed since the last
+    scan. Without df, the stored series are returned as they are.
+    """
+    version = get_data_version(user_id)
+    scanned, series = load_recurring_series(user_id)
+    if df is None or scanned == version:
+        return series
+
+    series = detect_recurring(df)
+    save_recurring_series(user_id, series, version)
+    return series
+
+
+def project_outflows(series: pd.DataFrame, months: pd.DatetimeIndex) -> pd.Series:
+    """
+    Known outflows (negative totals) from the active series in each of
+    `months` (month-end dates, e.g. a monthly forecast index).
+    """
+    periods = pd.DatetimeIndex(months).to_period("M")
+    totals = pd.Series(0.0, index=periods)
+    if totals.empty:
+        return pd.Series(0.0, index=months)
+    first, last = periods[0].start_time, periods[-1].end_time
+
+    for row in series[series["active"].astype(bool)].itertuples(index=False):
+        step = CADENCE_STEPS[row.cadence]
+        due = pd.Timestamp(row.next_date)
+        # Overdue payments are not carried into the horizon
+        while due < first:
+            due += step
+        while due <= last:
+            period = due.to_period("M")
+            if period in totals.index:
+                totals[period] += row.amount
+            due += step
+
+    return pd.Series(totals.to_numpy(), index=months)
+
+
+def recurring_history(df: pd.DataFrame, series: pd.DataFrame, months: pd.DatetimeIndex) -> pd.Series:
+    """
+    Outflows (negative totals) paid to the active series in each of
+    `months` (month-end dates, e.g. a monthly balance index).
+    """
+    keys = set(series.loc[series["active"].astype(bool), "merchant_key"])
+    out = df[pd.to_numeric(df["amount"], errors="coerce") < 0]
+    if not keys or out.empty:
+        return pd.Series(0.0, index=months)
+
+    paid = out[merchant_keys(out["description"]).isin(keys).to_numpy()]
+    totals = paid.groupby(pd.to_datetime(paid["date"]).dt.to_period("M"))["amount"].sum()
+    periods = pd.DatetimeIndex(months).to_period("M")
+    return pd.Series(totals.reindex(periods, fill_value=0.0).to_numpy(dtype=float), index=months)
+
+
+def split_recurring(
+    df: pd.DataFrame,
+    series: pd.DataFrame,
+    monthly_balance: pd.Series,
+    steps: int
+) -> tuple[pd.Series, pd.Series]:
+    """
+    The month-end balance without the recurring payments, for models to
+    fit, and the cumulative scheduled outflows over the next `steps`
+    months, to add back onto their forecasts.
+    """
+    paid = recurring_history(df, series, monthly_balance.index)
+    horizon = pd.date_range(monthly_balance.index[-1], periods=steps + 1, freq="ME")[1:]
+    return monthly_balance - paid.cumsum(), project_outflows(series, horizon).cumsum()
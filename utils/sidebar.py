@@ -0,0 +1,38 @@
+import streamlit as st
+import pandas as pd
+
+from utils.auth import login_latency_stats
+from utils.timing import is_enabled, rerun_report, log_rerun
+
+
+def timing_panel(page: str):
+    """
+    Debug breakdown of this rerun, shown when SMARTSPEND_TIMING=1.
+    Call at the very end of a page.
+    """
+    if not is_enabled():
+        return
+
+    report = rerun_report()
+    log_rerun(page, report)
+
+    with st.sidebar:
+        with st.expander("⏱ Rerun timings", expanded=False):
+            st.caption(f"Total: {report['total_ms']:,.0f} ms")
+            if report["spans"]:
+                st.dataframe(
+                    pd.DataFrame(report["spans"]),
+                    hide_index=True,
+                    use_container_width=True
+                )
+            if report["counters"]:
+                st.json(report["counters"])
+
+            # For sizing SMARTSPEND_BCRYPT_ROUNDS to the hardware
+            logins = login_latency_stats()
+            if logins["count"]:
+                st.caption(
+                    f"Logins ({logins['count']} recent, work factor {logins['rounds']}): "
+                    f"p50 {logins['p50_ms']:,.0f} ms, p95 {logins['p95_ms']:,.0f} ms, "
+                    f"max {logins['max_ms']:,.0f} ms"
+                )
@@ -0,0 +1,190 @@
+"""
+Per-user columnar snapshots of transaction history.
+
+Each snapshot is an uncompressed Arrow IPC file named after the user's
+data version, so a write from any process (page, CLI) makes the old file
+stale without explicit invalidation. Reads memory-map the file instead of
+building rows through sqlite3 + pandas.
+
+With SMARTSPEND_SHARED_STORE=1 the mapped files are also shared: each
+process keeps one mapping per user, and frames are built as zero-copy
+views over it (numeric columns as read-only NumPy views, text columns as
+Arrow-backed strings). Every session and worker process then reads the
+same OS page-cache pages, so resident memory tracks the dataset size
+rather than dataset size x sessions. Frames from the shared store are
+read-only: replace columns rather than modifying them in place.
+"""
+import io
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - snapshots are an optimisation only
+    pa = None
+
+from utils.database import load_transactions, get_data_version
+from utils.timing import timed, count
+
+SNAPSHOT_DIR_NAME = "snapshots"
+EXPORT_FORMATS = ("csv", "parquet", "arrow")
+
+SHARED_STORE = os.environ.get("SMARTSPEND_SHARED_STORE", "") == "1"
+
+# user_id -> (version, mapped table); shared by every session in the process
+_mapped: dict[int, tuple[int, "pa.Table"]] = {}
+_mapped_lock = threading.Lock()
+
+
+def _snapshot_dir() -> Path:
+    from utils.database import DB_DIR
+    return DB_DIR / SNAPSHOT_DIR_NAME
+
+
+def snapshot_path(user_id: int, version: int) -> Path:
+    return _snapshot_dir() / f"user_{user_id}_v{version}.arrow"
+
+
+def _write_snapshot(df: pd.DataFrame, user_id: int, version: int):
+    path = snapshot_path(user_id, version)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # pandas' Arrow-backed strings use large_string; storing that layout
+    # lets shared-store reads wrap the mapped buffers without a cast
+    table = table.cast(pa.schema([
+        f.with_type(pa.large_string()) if pa.types.is_string(f.type) else f
+        for f in table.schema
+    ]))
+
+    # Write then rename, so readers never see a partial file
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    with pa.OSFile(str(tmp), "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+    # Older versions for this user are now stale
+    for old in path.parent.glob(f"user_{user_id}_v*.arrow"):
+        if old != path:
+            old.unlink(missing_ok=True)
+
+
+def _read_snapshot(path: Path) -> pd.DataFrame:
+    with pa.memory_map(str(path), "r") as source:
+        table = ipc.open_file(source).read_all()
+    return table.to_pandas()
+
+
+def _map_table(path: Path) -> "pa.Table":
+    # The table keeps the mapping alive for as long as it is referenced
+    return ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+
+
+def _zero_copy_frame(table: "pa.Table") -> pd.DataFrame:
+    columns = {}
+    for name, col in zip(table.column_names, table.columns):
+        if pa.types.is_string(col.type) or pa.types.is_large_string(col.type):
+            columns[name] = pd.arrays.ArrowStringArray(col)
+        elif col.num_chunks == 1 and col.null_count == 0:
+            columns[name] = col.chunk(0).to_numpy(zero_copy_only=True)
+        else:
+            columns[name] = col.to_pandas()
+    return pd.DataFrame(columns, copy=False)
+
+
+def _load_shared(user_id: int, version: int) -> pd.DataFrame | None:
+    with _mapped_lock:
+        cached = _mapped.get(user_id)
+        if cached is not None and cached[0] == version:
+            count("snapshot.shared_hits")
+            return _zero_copy_frame(cached[1])
+
+        path = snapshot_path(user_id, version)
+        if not path.exists():
+            return None
+        try:
+            table = _map_table(path)
+        except (OSError, pa.ArrowInvalid):
+            return None
+
+        # Replacing the entry releases the mapping of the stale version
+        _mapped[user_id] = (version, table)
+        count("snapshot.hits")
+        return _zero_copy_frame(table)
+
+
+@timed()
+def load_snapshot(user_id: int) -> pd.DataFrame:
+    """
+    Drop-in replacement for load_transactions on read-only analytics pages.
+    Rebuilds the snapshot from SQLite when the user's data has changed.
+    """
+    if pa is None:
+        return load_transactions(user_id)
+
+    version = get_data_version(user_id)
+    path = snapshot_path(user_id, version)
+
+    if SHARED_STORE:
+        df = _load_shared(user_id, version)
+        if df is not None:
+            return df
+
+    if path.exists():
+        try:
+            df = _read_snapshot(path)
+            count("snapshot.hits")
+            return df
+        except (OSError, pa.ArrowInvalid):
+            path.unlink(missing_ok=True)
+
+    count("snapshot.misses")
+    df = load_transactions(user_id)
+    try:
+        _write_snapshot(df, user_id, version)
+    except OSError:
+        return df
+
+    if SHARED_STORE:
+        # Serve even the first read from the mapping, not a private copy
+        shared = _load_shared(user_id, version)
+        if shared is not None:
+            return shared
+    return df
+
+
+def drop_snapshots(user_id: int):
+    with _mapped_lock:
+        _mapped.pop(user_id, None)
+    for path in _snapshot_dir().glob(f"user_{user_id}_v*.arrow"):
+        path.unlink(missing_ok=True)
+
+
+def export_transactions(user_id: int, fmt: str = "parquet") -> bytes:
+    """
+    Full transaction history as CSV, Parquet or Arrow IPC bytes.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    df = load_snapshot(user_id).drop(columns=["id"])
+
+    if fmt == "csv":
+        return df.to_csv(index=False).encode("utf-8")
+
+    if pa is None:
+        raise ValueError(f"{fmt} export needs pyarrow installed")
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    buf = io.BytesIO()
+    if fmt == "parquet":
+        pq.write_table(table, buf, compression="zstd")
+    else:
+        with ipc.new_file(buf, table.schema) as writer:
+            writer.write_table(table)
+    return buf.getvalue()
@@ -0,0 +1,148 @@
+"""
+Lightweight timing and counters for page reruns.
+
+Disabled by default. Set SMARTSPEND_TIMING=1 to collect timings, show the
+sidebar breakdown and append one JSON line per rerun to db/timings.jsonl.
+When disabled, timed functions and spans cost a single flag check.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+_enabled = os.environ.get("SMARTSPEND_TIMING", "") == "1"
+
+# Each Streamlit session reruns its script on its own thread
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(enabled: bool):
+    global _enabled
+    _enabled = enabled
+
+
+def _records() -> dict:
+    rec = getattr(_local, "records", None)
+    if rec is None:
+        rec = _local.records = {"spans": {}, "counters": {}, "started": time.perf_counter()}
+    return rec
+
+
+def _add(name: str, seconds: float):
+    spans = _records()["spans"]
+    total, calls = spans.get(name, (0.0, 0))
+    spans[name] = (total + seconds, calls + 1)
+
+
+class _Span:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str):
+    """
+    Context manager timing a block under `name`.
+    """
+    return _Span(name) if _enabled else _NOOP
+
+
+def timed(name: str | None = None):
+    """
+    Decorator timing every call of a function (default name: module.function).
+    """
+    def decorate(fn):
+        label = name or f"{fn.__module__.split('.')[-1]}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _add(label, time.perf_counter() - started)
+
+        return wrapper
+    return decorate
+
+
+def count(name: str, n: int = 1):
+    if not _enabled:
+        return
+    counters = _records()["counters"]
+    counters[name] = counters.get(name, 0) + n
+
+
+def start_rerun():
+    """
+    Clears the current thread's records; call at the top of a page.
+    """
+    if _enabled:
+        _local.records = None
+        _records()
+
+
+def rerun_report() -> dict:
+    """
+    Spans (ms, calls) sorted slowest first, counters, and wall time so far.
+    """
+    rec = _records()
+    spans = [
+        {"name": k, "ms": round(v[0] * 1000, 3), "calls": v[1]}
+        for k, v in rec["spans"].items()
+    ]
+    spans.sort(key=lambda s: s["ms"], reverse=True)
+    return {
+        "total_ms": round((time.perf_counter() - rec["started"]) * 1000, 3),
+        "spans": spans,
+        "counters": dict(rec["counters"]),
+    }
+
+
+def log_rerun(page: str, report: dict | None = None):
+    """
+    Appends the rerun breakdown as one JSON line to db/timings.jsonl.
+    """
+    if not _enabled:
+        return
+    from utils.database import DB_DIR
+
+    entry = {
+        "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "page": page,
+        **(report or rerun_report()),
+    }
+    DB_DIR.mkdir(parents=True, exist_ok=True)
+    with _log_lock, open(DB_DIR / "timings.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")